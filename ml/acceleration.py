@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# ml/acceleration.py - Opções de execução do Keras: XLA, precisão mista e steps_per_execution
+
+import argparse
+from typing import TYPE_CHECKING, Dict, Any
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+PRECISIONS = ('float32', 'bfloat16', 'float16', 'auto')
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Flags comuns a train.py e evaluate.py"""
+    parser.add_argument('--jit-compile', action='store_true',
+                        help='Compilar os passos de treino/predição com XLA')
+    parser.add_argument('--mixed-precision', type=str, default='float32', choices=PRECISIONS,
+                        help='Precisão de cálculo: bfloat16 (CPUs com AVX512-BF16/AMX ou GPU), '
+                             'float16 (GPU) ou auto (a melhor suportada)')
+    parser.add_argument('--steps-per-execution', type=int, default=1,
+                        help='Passos executados por chamada ao grafo (reduz o overhead do laço Python)')
+
+def cpu_supports_bfloat16() -> bool:
+    """Indica se a CPU tem instruções bfloat16 nativas (Linux: flags do /proc/cpuinfo)"""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def resolve_precision(requested: str) -> str:
+    """Precisão efetiva: recai em float32 quando o hardware não suporta a pedida"""
+    import tensorflow as tf
+    has_gpu = bool(tf.config.list_physical_devices('GPU'))
+    if requested == 'auto':
+        if has_gpu:
+            return 'float16'
+        return 'bfloat16' if cpu_supports_bfloat16() else 'float32'
+    if requested == 'float16' and not has_gpu:
+        print("Aviso: float16 exige GPU; usando float32")
+        return 'float32'
+    if requested == 'bfloat16' and not has_gpu and not cpu_supports_bfloat16():
+        print("Aviso: a CPU não tem instruções bfloat16; usando float32")
+        return 'float32'
+    return requested
+
+def policy_name(precision: str) -> str:
+    return 'float32' if precision == 'float32' else f'mixed_{precision}'
+
+def configure(args) -> str:
+    """Define a política global de precisão antes de criar modelos; retorna a precisão efetiva
+
+    A precisão efetiva fica em args.mixed_precision, para ser registrada com o modelo.
+    """
+    import tensorflow as tf
+    precision = resolve_precision(args.mixed_precision)
+    tf.keras.mixed_precision.set_global_policy(policy_name(precision))
+    args.mixed_precision = precision
+    if precision != 'float32':
+        print(f"Precisão mista: {policy_name(precision)}")
+    return precision
+
+def compile_options(args) -> Dict[str, Any]:
+    """Argumentos extras de model.compile (aplicados a fit, predict e evaluate)"""
+    return {'jit_compile': bool(args.jit_compile), 'steps_per_execution': max(1, args.steps_per_execution)}
+
+def batch_options(args) -> Dict[str, Any]:
+    """Argumentos de compile para modelos usados só com predict_on_batch (um lote por chamada)"""
+    return {'jit_compile': bool(args.jit_compile)}
+
+def describe(args) -> Dict[str, Any]:
+    """Configuração de execução, para o histórico e relatórios"""
+    return {'jit_compile': bool(args.jit_compile), 'mixed_precision': args.mixed_precision,
+            'steps_per_execution': max(1, args.steps_per_execution)}
+
+def _policies(model: 'tf.keras.Model') -> set:
+    import tensorflow as tf
+    policies = set()
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.Model):
+            policies |= _policies(layer)
+        else:
+            policies.add(layer.dtype_policy.name)
+    return policies
+
+def with_precision(model: 'tf.keras.Model', precision: str) -> 'tf.keras.Model':
+    """Recria um modelo com a política de precisão pedida, copiando os pesos
+
+    Serve tanto para rodar em precisão mista um modelo salvo em float32 quanto para
+    voltar a float32 um modelo treinado em precisão mista (ex.: antes do TFLite).
+    A última camada continua em float32 para que as probabilidades saiam em float32.
+    """
+    import tensorflow as tf
+    policy = policy_name(precision)
+    if precision == 'float32' and _policies(model) == {'float32'}:
+        return model
+    output_layer = model.layers[-1]
+
+    def clone(layer):
+        if isinstance(layer, tf.keras.Model):
+            return tf.keras.models.clone_model(layer, clone_function=clone)
+        config = layer.get_config()
+        config['dtype'] = 'float32' if layer is output_layer else policy
+        return layer.__class__.from_config(config)
+
+    cloned = tf.keras.models.clone_model(model, clone_function=clone)
+    cloned.set_weights(model.get_weights())
+    return cloned
+
+def prepare_for_inference(model: 'tf.keras.Model', args) -> 'tf.keras.Model':
+    """Aplica precisão, XLA e steps_per_execution a um modelo carregado para predição"""
+    model = with_precision(model, args.mixed_precision)
+    model.compile(**compile_options(args))
+    return model
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# ml/bench/run_bench.py - Benchmarks offline do pipeline de ML do SafeWatch
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import numpy as np
+from datetime import datetime
+from typing import Dict, Any, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generate_dataset, RESOLUTIONS
+
+BENCHMARKS = ('prep', 'decode', 'loader', 'train', 'inference', 'publish', 'startup')
+# Dependências que o safewatch-ml não pode carregar só para mostrar a ajuda ou validar argumentos
+# (o cv2, ~0,1 s, fica de fora: as opções do prep vêm dos módulos de decodificação)
+HEAVY_MODULES = ('tensorflow', 'sklearn', 'matplotlib', 'pandas', 'boto3')
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmarks offline do pipeline de ML do SafeWatch')
+    parser.add_argument('--work-dir', type=str, default='bench_data', help='Diretório dos dados sintéticos e saídas')
+    parser.add_argument('--output', type=str, default='bench_results.json', help='Arquivo JSON de resultados')
+    parser.add_argument('--baseline', type=str, help='Resultados de referência para comparação')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Piora relativa a partir da qual uma métrica é marcada como regressão')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Sair com código 1 se houver regressões')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS),
+                        help='Benchmarks a executar')
+    parser.add_argument('--num-images', type=int, default=200, help='Frames sintéticos por resolução')
+    parser.add_argument('--resolutions', nargs='+', choices=list(RESOLUTIONS), default=list(RESOLUTIONS),
+                        help='Resoluções dos frames sintéticos')
+    parser.add_argument('--image-size', type=int, default=224, help='Tamanho das imagens')
+    parser.add_argument('--batch-size', type=int, default=32, help='Tamanho do batch')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processos do data_prep')
+    parser.add_argument('--loader-batches', type=int, default=20, help='Lotes medidos por carregador')
+    parser.add_argument('--backbones', nargs='+', choices=['mobilenet', 'resnet', 'efficientnet'],
+                        default=['mobilenet', 'resnet', 'efficientnet'], help='Backbones do benchmark de treino')
+    parser.add_argument('--train-steps', type=int, default=10, help='Passos de treino medidos por backbone')
+    parser.add_argument('--inference-runs', type=int, default=50, help='Predições de um frame medidas')
+    parser.add_argument('--s3-endpoint-url', type=str,
+                        help='S3 local do benchmark de publicação (ex.: MinIO); padrão: servidor moto em processo')
+    parser.add_argument('--artifact-mb', type=int, default=64, help='Tamanho do modelo sintético publicado (MB)')
+    parser.add_argument('--startup-runs', type=int, default=5, help='Execuções medidas por etapa do safewatch-ml')
+    return parser.parse_args()
+
+def metric(value: float, unit: str, higher_is_better: bool) -> Dict[str, Any]:
+    return {'value': float(value), 'unit': unit, 'higher_is_better': higher_is_better}
+
+def bench_prep(args, results: Dict[str, Any]) -> str:
+    """Vazão do process_images por resolução; retorna o diretório processado da primeira"""
+    from data_prep import process_images
+
+    processed_dirs = []
+    for resolution in args.resolutions:
+        paths = generate_dataset(os.path.join(args.work_dir, 'raw', resolution), args.num_images, resolution)
+        annotations = {os.path.basename(p): os.path.basename(p).split('_')[0] for p in paths}
+        output_dir = os.path.join(args.work_dir, 'processed', resolution)
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+        start = time.perf_counter()
+        process_images(paths, annotations, output_dir, args.image_size, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        results[f'prep_{resolution}_images_per_sec'] = metric(len(paths) / elapsed, 'images/s', True)
+        processed_dirs.append(output_dir)
+    return processed_dirs[0]
+
+def bench_decode(args, results: Dict[str, Any]):
+    """Imagens/s da decodificação completa x reduzida e PSNR de cada uma por resolução"""
+    from image_decode import compare_decode_paths, DECODE_MODES
+
+    for resolution in args.resolutions:
+        paths = generate_dataset(os.path.join(args.work_dir, 'raw', resolution), args.num_images, resolution)
+        report = compare_decode_paths(paths, args.image_size)
+        for decode in DECODE_MODES:
+            results[f'decode_{resolution}_{decode}_images_per_sec'] = metric(
+                report[f'{decode}_images_per_sec'], 'images/s', True)
+            results[f'decode_{resolution}_{decode}_psnr_db'] = metric(
+                report[f'{decode}_psnr_vs_reference']['mean_db'], 'dB', True)
+
+def _time_batches(loader, num_batches: int) -> float:
+    """Lotes por segundo em num_batches lotes, após um lote de aquecimento"""
+    from loaders import model_input
+    source = model_input(loader)
+    if hasattr(source, 'as_numpy_iterator'):
+        iterator = source.repeat().as_numpy_iterator()
+        get = lambda i: next(iterator)
+    else:
+        get = lambda i: source[i % len(source)]
+    get(0)
+    start = time.perf_counter()
+    for i in range(1, num_batches + 1):
+        get(i)
+    return num_batches / (time.perf_counter() - start)
+
+def bench_loaders(args, results: Dict[str, Any], processed_dir: str):
+    """Lotes/s de treino (com aumentação) para cada formato de dataset e pipeline de entrada"""
+    from shards import write_shards
+    from train import create_data_generators
+    from loaders import list_image_directory
+
+    filepaths, labels, class_indices = list_image_directory(processed_dir)
+    class_names = sorted(class_indices, key=class_indices.get)
+    records = [{'filename': os.path.basename(p), 'label': class_names[l], 'processed_path': p}
+               for p, l in zip(filepaths, labels)]
+    shard_dir = os.path.join(args.work_dir, 'shards')
+    write_shards(records, class_names, shard_dir, args.image_size)
+
+    for data_format, data_dir in (('directory', processed_dir), ('shards', shard_dir)):
+        for loader in ('keras', 'tfdata'):
+            train_generator, _, _ = create_data_generators(data_dir, data_dir, args.batch_size, args.image_size,
+                                                           data_format, loader)
+            results[f'loader_{loader}_{data_format}_batches_per_sec'] = metric(
+                _time_batches(train_generator, args.loader_batches), 'batches/s', True)
+
+def bench_train(args, results: Dict[str, Any]):
+    """Tempo por passo de treino de cada backbone (pesos aleatórios, sem download)"""
+    import tensorflow as tf
+    from train import create_model
+
+    rng = np.random.default_rng(0)
+    x = rng.random((args.batch_size, args.image_size, args.image_size, 3), dtype=np.float32)
+    y = tf.keras.utils.to_categorical(rng.integers(0, 2, args.batch_size), 2)
+    for backbone in args.backbones:
+        model = create_model(backbone, (args.image_size, args.image_size, 3), 2, weights=None)
+        model.train_on_batch(x, y)
+        start = time.perf_counter()
+        for _ in range(args.train_steps):
+            model.train_on_batch(x, y)
+        step_ms = (time.perf_counter() - start) * 1000 / args.train_steps
+        results[f'train_{backbone}_step_ms'] = metric(step_ms, 'ms', False)
+        tf.keras.backend.clear_session()
+
+def bench_inference(args, results: Dict[str, Any]):
+    """Latência de um frame (p50/p95/p99) e vazão em lote do modelo padrão (mobilenet)"""
+    import tensorflow as tf
+    from train import create_model
+
+    model = create_model('mobilenet', (args.image_size, args.image_size, 3), 2, weights=None)
+    rng = np.random.default_rng(0)
+    frame = rng.random((1, args.image_size, args.image_size, 3), dtype=np.float32)
+    batch = rng.random((args.batch_size, args.image_size, args.image_size, 3), dtype=np.float32)
+    for _ in range(3):
+        model.predict_on_batch(frame)
+
+    latencies = []
+    for _ in range(args.inference_runs):
+        start = time.perf_counter()
+        model.predict_on_batch(frame)
+        latencies.append((time.perf_counter() - start) * 1000)
+    for name, value in zip(('p50', 'p95', 'p99'), np.percentile(latencies, [50, 95, 99])):
+        results[f'inference_latency_ms_{name}'] = metric(value, 'ms', False)
+
+    model.predict_on_batch(batch)
+    runs = max(1, args.inference_runs // 10)
+    start = time.perf_counter()
+    for _ in range(runs):
+        model.predict_on_batch(batch)
+    results['inference_batch_frames_per_sec'] = metric(
+        args.batch_size * runs / (time.perf_counter() - start), 'frames/s', True)
+    tf.keras.backend.clear_session()
+
+def _local_s3(args):
+    """S3 local do benchmark: (endpoint, contexto) com o endpoint informado ou o moto em processo"""
+    import contextlib
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    if args.s3_endpoint_url:
+        return args.s3_endpoint_url, contextlib.nullcontext()
+    try:
+        from moto import mock_aws
+    except ImportError:
+        return None, None
+    return None, mock_aws()
+
+def bench_publish(args, results: Dict[str, Any]):
+    """Publicação de artefatos por conteúdo: vazão da 1ª versão e bytes reenviados na 2ª
+
+    A 2ª versão só altera o histórico (como um novo treino com o mesmo SavedModel) e é
+    conferida baixando-a de volta pelo manifesto. Sem --s3-endpoint-url, usa o moto em
+    processo (mede hash, HEAD e o caminho multipart do cliente, sem rede).
+    """
+    from s3_sync import create_s3_client, publish_artifacts, fetch_artifacts, file_sha256
+
+    endpoint_url, context = _local_s3(args)
+    if context is None:
+        print("Aviso: sem --s3-endpoint-url nem moto instalado; benchmark de publicação ignorado")
+        return
+    with context:
+        artifact_dir = os.path.join(args.work_dir, 'publish')
+        shutil.rmtree(artifact_dir, ignore_errors=True)
+        rng = np.random.default_rng(0)
+        sizes = {'model_final_tf/variables/variables.data-00000-of-00001': args.artifact_mb * 1024 * 1024,
+                 'model_final_tf/variables/variables.index': 16 * 1024,
+                 'model_final_tf/saved_model.pb': 2 * 1024 * 1024,
+                 'model_confusion_matrix.png': 100 * 1024,
+                 'model_history.csv': 4 * 1024}
+        files = {}
+        for name, size in sizes.items():
+            path = os.path.join(artifact_dir, *name.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(rng.bytes(size))
+            files[name] = path
+
+        s3 = create_s3_client(max_pool_connections=32, endpoint_url=endpoint_url)
+        bucket = f"safewatch-bench-{int(time.time())}"
+        s3.create_bucket(Bucket=bucket)
+
+        start = time.perf_counter()
+        first = publish_artifacts(files, bucket, 'models', 'v1', s3=s3)
+        elapsed = time.perf_counter() - start
+        results['publish_first_mb_per_sec'] = metric(first['bytes_sent'] / elapsed / 1e6, 'MB/s', True)
+
+        with open(files['model_history.csv'], 'wb') as f:
+            f.write(rng.bytes(sizes['model_history.csv']))
+        start = time.perf_counter()
+        second = publish_artifacts(files, bucket, 'models', 'v2', s3=s3)
+        results['publish_repeat_seconds'] = metric(time.perf_counter() - start, 's', False)
+        results['publish_repeat_bytes_sent'] = metric(second['bytes_sent'], 'bytes', False)
+        results['publish_repeat_bytes_skipped'] = metric(second['bytes_skipped'], 'bytes', True)
+
+        fetched_dir = os.path.join(args.work_dir, 'publish_fetched')
+        shutil.rmtree(fetched_dir, ignore_errors=True)
+        fetch_artifacts(bucket, second['manifest_key'], fetched_dir, s3=s3)
+        for name, path in files.items():
+            if file_sha256(os.path.join(fetched_dir, *name.split('/'))) != file_sha256(path):
+                raise RuntimeError(f"Artefato {name} difere do publicado")
+
+# Roda em um processo novo: tempo até o fim do --help, memória e módulos pesados carregados
+STARTUP_PROBE = """
+import sys, json, time, resource
+start = time.perf_counter()
+from safewatch_ml.cli import main
+try:
+    main([sys.argv[1], '--help'])
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in json.loads(sys.argv[2]) if m in sys.modules)
+print(json.dumps({'seconds': elapsed, 'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'heavy': heavy}))
+"""
+
+def bench_startup(args, results: Dict[str, Any]):
+    """Tempo e memória de "safewatch-ml <etapa> --help" em um interpretador novo (mediana)
+
+    Falha se alguma etapa carregar uma dependência pesada (TensorFlow, sklearn, ...) antes
+    de precisar dela: as importações pesadas devem ficar dentro das funções das etapas.
+    """
+    import subprocess
+    from safewatch_ml.cli import STAGES
+
+    ml_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for stage in STAGES:
+        runs = []
+        for _ in range(args.startup_runs):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', STARTUP_PROBE, stage, json.dumps(HEAVY_MODULES)],
+                                    cwd=ml_dir, capture_output=True, text=True, check=True).stdout
+            probe = json.loads(output.strip().splitlines()[-1])
+            probe['process_seconds'] = time.perf_counter() - start
+            runs.append(probe)
+        if runs[0]['heavy']:
+            raise RuntimeError(f"safewatch-ml {stage} --help importou {', '.join(runs[0]['heavy'])}")
+        results[f'startup_{stage}_help_seconds'] = metric(
+            np.median([run['process_seconds'] for run in runs]), 's', False)
+        results[f'startup_{stage}_import_seconds'] = metric(np.median([run['seconds'] for run in runs]), 's', False)
+        results[f'startup_{stage}_rss_mb'] = metric(np.median([run['rss_mb'] for run in runs]), 'MB', False)
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Imprime a comparação com a referência e retorna as métricas que pioraram além do limite"""
+    regressions = []
+    print(f"{'Métrica':<45} {'Referência':>12} {'Atual':>12} {'Variação':>9}")
+    for name, current in results.items():
+        reference = baseline.get(name)
+        if reference is None or not reference['value']:
+            print(f"{name:<45} {'-':>12} {current['value']:>12.2f} {'-':>9}")
+            continue
+        change = (current['value'] - reference['value']) / reference['value']
+        worse = -change if current['higher_is_better'] else change
+        flag = ''
+        if worse > threshold:
+            regressions.append(name)
+            flag = '  REGRESSÃO'
+        print(f"{name:<45} {reference['value']:>12.2f} {current['value']:>12.2f} {change:>+8.1%}{flag}")
+    return regressions
+
+def main():
+    args = parse_arguments()
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    results: Dict[str, Any] = {}
+    processed_dir = None
+    if 'prep' in args.only or 'loader' in args.only:
+        processed_dir = bench_prep(args, results)
+        if 'prep' not in args.only:
+            results = {}
+    if 'decode' in args.only:
+        bench_decode(args, results)
+    if 'loader' in args.only:
+        bench_loaders(args, results, processed_dir)
+    if 'train' in args.only:
+        bench_train(args, results)
+    if 'inference' in args.only:
+        bench_inference(args, results)
+    if 'publish' in args.only:
+        bench_publish(args, results)
+    if 'startup' in args.only:
+        bench_startup(args, results)
+
+    import tensorflow as tf
+    report = {
+        'date': datetime.now().isoformat(),
+        'environment': {'python': platform.python_version(), 'tensorflow': tf.__version__,
+                        'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.threshold)
+        report['baseline'] = args.baseline
+        report['regressions'] = regressions
+        print(f"{len(regressions)} regressões acima de {args.threshold:.0%}")
+    else:
+        for name, m in results.items():
+            print(f"{name:<45} {m['value']:>12.2f} {m['unit']}")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados salvos em {args.output}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
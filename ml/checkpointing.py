@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# ml/checkpointing.py - Checkpoints periódicos e retomáveis do treino (modelo, otimizador, callbacks e posição)
+
+import os
+import re
+import json
+import time
+import shutil
+import numpy as np
+import tensorflow as tf
+from typing import Dict, Any, List, Optional, Tuple
+
+# Atributos de estado dos callbacks do Keras usados no treino (zerados em on_train_begin)
+CALLBACK_STATE = {
+    'ModelCheckpoint': ('best',),
+    'EarlyStopping': ('wait', 'stopped_epoch', 'best', 'best_epoch'),
+    'ReduceLROnPlateau': ('wait', 'best', 'cooldown_counter'),
+}
+# Ordem de leitura da época atual nos loaders baseados em Sequence
+LOADER_ORDER = ('order', 'index_array')
+
+def checkpoint_root(args, output_dir: str) -> str:
+    return args.checkpoint_dir or os.path.join(output_dir, 'checkpoints')
+
+def find_run(root: str, name: str = 'latest') -> Optional[str]:
+    """Nome da execução a retomar: a informada ou a de checkpoint mais recente em root"""
+    if name != 'latest':
+        return name if os.path.isdir(os.path.join(root, name)) else None
+    runs = [entry for entry in os.listdir(root) if tf.train.latest_checkpoint(os.path.join(root, entry))] \
+        if os.path.isdir(root) else []
+    if not runs:
+        return None
+    return max(runs, key=lambda run: os.path.getmtime(tf.train.latest_checkpoint(os.path.join(root, run)) + '.index'))
+
+def _plain(value):
+    """Converte escalares numpy para tipos serializáveis em JSON"""
+    return value.item() if isinstance(value, np.generic) else value
+
+def _callback_state(callbacks: List[tf.keras.callbacks.Callback]) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """Estado dos callbacks: valores simples (JSON) e arrays (best_weights do EarlyStopping)"""
+    state, arrays = {}, {}
+    for i, callback in enumerate(callbacks):
+        attributes = CALLBACK_STATE.get(type(callback).__name__)
+        if attributes is None:
+            continue
+        state[str(i)] = {attr: _plain(getattr(callback, attr)) for attr in attributes if hasattr(callback, attr)}
+        for j, weight in enumerate(getattr(callback, 'best_weights', None) or []):
+            arrays[f'callback{i}_weight{j}'] = np.array(weight)
+    return state, arrays
+
+def _apply_callback_state(callbacks: List[tf.keras.callbacks.Callback], state: Dict[str, Any],
+                          arrays: Dict[str, np.ndarray]):
+    for i, callback in enumerate(callbacks):
+        for attr, value in state.get(str(i), {}).items():
+            setattr(callback, attr, value)
+        weights = [arrays[key] for key in sorted((k for k in arrays if k.startswith(f'callback{i}_weight')),
+                                                 key=lambda k: int(k.rsplit('weight', 1)[1]))]
+        if weights:
+            callback.best_weights = weights
+
+def _loader_state(loader) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """Ordem da época atual e estado do gerador aleatório de um loader (quando expostos)"""
+    state, arrays = {}, {}
+    for attr in LOADER_ORDER:
+        if getattr(loader, attr, None) is not None:
+            arrays[f'loader_{attr}'] = np.array(getattr(loader, attr))
+    rng = getattr(loader, '_rng', None)
+    if isinstance(rng, np.random.Generator):
+        state['rng'] = rng.bit_generator.state
+    return state, arrays
+
+def order_restorable(loader) -> bool:
+    """Se a ordem da época atual do loader pode ser reproduzida numa retomada
+
+    Sequences guardam a ordem da época (LOADER_ORDER) no checkpoint; um pipeline
+    tf.data embaralhado gera outra ordem a cada iteração, e pular os lotes já feitos
+    repetiria parte dos exemplos e omitiria outros.
+    """
+    if hasattr(loader, 'dataset'):
+        return not getattr(loader, 'shuffled', True)
+    # index_array do DirectoryIterator só é preenchido no primeiro lote
+    return any(hasattr(loader, attr) for attr in LOADER_ORDER)
+
+def _apply_loader_state(loader, state: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+    for attr in LOADER_ORDER:
+        if f'loader_{attr}' in arrays:
+            setattr(loader, attr, arrays[f'loader_{attr}'])
+    if 'rng' in state and isinstance(getattr(loader, '_rng', None), np.random.Generator):
+        loader._rng.bit_generator.state = state['rng']
+
+class TrainingCheckpoint(tf.keras.callbacks.Callback):
+    """Grava checkpoints retomáveis a cada N passos/minutos e ao fim de cada época
+
+    Cada checkpoint (tf.train.CheckpointManager) guarda os pesos e o estado do
+    otimizador (inclusive a taxa de aprendizado ajustada pelo ReduceLROnPlateau);
+    ao lado dele, ckpt-N.state.json guarda época, passo, o estado dos callbacks e do
+    loader, e ckpt-N.arrays.npz os arrays correspondentes. O state.json é escrito por
+    último, depois da escrita (assíncrona) do checkpoint: sua presença marca o
+    checkpoint como completo.
+
+    Deve ser o último callback, para registrar o estado já atualizado dos demais.
+    Com loaders cuja ordem não é restaurável (ver order_restorable), só os
+    checkpoints de fim de época são gravados e usados na retomada.
+    """
+
+    def __init__(self, directory: str, every_steps: int = 0, every_minutes: float = 0, max_to_keep: int = 3,
+                 async_write: bool = True, resume: bool = False, restore_directory: Optional[str] = None):
+        super().__init__()
+        self.directory = directory
+        self.resume = resume
+        # Workers não-chief gravam em diretório próprio, mas retomam dos checkpoints do chief
+        self.restore_directory = restore_directory or directory
+        self.every_steps = every_steps
+        self.every_seconds = every_minutes * 60
+        self.max_to_keep = max_to_keep
+        self.async_write = async_write
+        self.callbacks: List[tf.keras.callbacks.Callback] = []
+        self.loader = None
+        self.manager = None
+        self.resume_step = 0
+        # Métricas das épocas concluídas (o histórico CSV só é gravado ao fim do treino)
+        self.history: Dict[str, List] = {'epoch': []}
+        self.restored_epochs = 0
+        self._carry: Optional[Tuple[Dict[str, Any], Dict[str, np.ndarray]]] = None
+
+    def attach(self, model: tf.keras.Model, loader, callbacks: List[tf.keras.callbacks.Callback]):
+        self.loader = loader
+        self.callbacks = callbacks
+        self.mid_epoch = order_restorable(loader)
+        if not self.mid_epoch and (self.every_steps or self.every_seconds):
+            print("Aviso: a ordem do loader não é restaurável; checkpoints só ao fim de cada época")
+        self._epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self._step = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer, epoch=self._epoch,
+                                              step=self._step)
+        self.manager = tf.train.CheckpointManager(self.checkpoint, self.directory, max_to_keep=self.max_to_keep)
+
+    def restore(self) -> Tuple[int, int]:
+        """Restaura o checkpoint completo mais recente; retorna (época, passo dentro da época)
+
+        Sem checkpoint, retorna (0, 0) e o treino começa do início.
+        """
+        state = tf.train.get_checkpoint_state(self.restore_directory)
+        paths = list(state.all_model_checkpoint_paths) if state else []
+        for path in reversed(paths):
+            if not os.path.exists(f'{path}.state.json'):
+                continue
+            with open(f'{path}.state.json', 'r') as f:
+                state = json.load(f)
+            if state['step'] and not self.mid_epoch:
+                print(f"Ignorando {path}: meio de época e a ordem do loader não é restaurável")
+                continue
+            self.checkpoint.restore(path).expect_partial()
+            arrays = {}
+            if os.path.exists(f'{path}.arrays.npz'):
+                with np.load(f'{path}.arrays.npz') as data:
+                    arrays = dict(data)
+            _apply_loader_state(self.loader, state['loader'], arrays)
+            self._carry = (state['callbacks'], arrays)
+            self.resume_step = state['step']
+            self.history = state['history']
+            self.restored_epochs = len(self.history['epoch'])
+            print(f"Retomando de {path}: época {state['epoch'] + 1}, passo {state['step']}")
+            return state['epoch'], state['step']
+        print(f"Nenhum checkpoint completo em {self.directory}; treinando do início")
+        return 0, 0
+
+    def save(self, epoch: int, step: int):
+        """Grava um checkpoint na posição (época, passos já feitos nela)"""
+        self._epoch.assign(epoch)
+        self._step.assign(step)
+        callback_state, arrays = _callback_state(self.callbacks)
+        loader_state, loader_arrays = _loader_state(self.loader)
+        arrays.update(loader_arrays)
+        state = {'epoch': epoch, 'step': step, 'callbacks': callback_state, 'loader': loader_state,
+                 'history': {key: list(values) for key, values in self.history.items()}, 'time': time.time()}
+        options = tf.train.CheckpointOptions(
+            enable_async=self.async_write,
+            experimental_write_callbacks=[lambda path: self._write_state(path, state, arrays)])
+        self.manager.save(options=options)
+        self._last_save = time.perf_counter()
+        self._steps_at_save = step
+
+    def _write_state(self, path: str, state: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+        if arrays:
+            np.savez(f'{path}.arrays.npz', **arrays)
+        with open(f'{path}.state.json.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(f'{path}.state.json.tmp', f'{path}.state.json')
+        # Remove os arquivos auxiliares de checkpoints já descartados pelo CheckpointManager
+        kept = {os.path.basename(p) for p in self.manager.checkpoints} | {os.path.basename(path)}
+        for filename in os.listdir(self.directory):
+            match = re.match(r'(ckpt-\d+)\.(state\.json|arrays\.npz)$', filename)
+            if match and match.group(1) not in kept:
+                os.remove(os.path.join(self.directory, filename))
+
+    def on_train_begin(self, logs=None):
+        # Os callbacks zeram seu estado em on_train_begin; este roda depois deles
+        if self._carry is not None:
+            _apply_callback_state(self.callbacks, *self._carry)
+            self._carry = None
+        self._last_save = time.perf_counter()
+        self._steps_at_save = self.resume_step
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._current_epoch = epoch
+
+    def on_train_batch_end(self, batch, logs=None):
+        steps = self.resume_step + batch + 1
+        if self.params.get('steps') and batch + 1 >= self.params['steps']:
+            return  # último lote: o checkpoint de fim de época é gravado após a validação
+        if not self.mid_epoch:
+            return
+        due_steps = self.every_steps and steps - self._steps_at_save >= self.every_steps
+        due_time = self.every_seconds and time.perf_counter() - self._last_save >= self.every_seconds
+        if due_steps or due_time:
+            self.save(self._current_epoch, steps)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.history['epoch'].append(epoch)
+        for key, value in (logs or {}).items():
+            self.history.setdefault(key, []).append(_plain(np.asarray(value).item()))
+        self.resume_step = 0
+        self.save(epoch + 1, 0)
+
+    def on_train_end(self, logs=None):
+        # Estado levado para um fit seguinte (retomada no meio de uma época) e espera da escrita
+        self._carry = _callback_state(self.callbacks)
+        self.checkpoint.sync()
+
+    def finish(self):
+        """Apaga os checkpoints ao concluir o treino (o modelo final já foi salvo)"""
+        self.checkpoint.sync()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def skip_batches(loader, steps: int):
+    """Loader com os primeiros steps lotes da época atual pulados, para concluir uma época retomada
+
+    Exige a ordem restaurada (order_restorable) e fit com shuffle=False, para que o
+    lote i seja o i-ésimo consumido na época.
+    """
+    if hasattr(loader, 'dataset'):
+        class Skipped:
+            dataset = loader.dataset.skip(steps)
+        return Skipped()
+
+    class SkippedSequence(tf.keras.utils.Sequence):
+        def __init__(self, inner):
+            super().__init__()
+            self._inner = inner
+
+        def __len__(self):
+            return len(self._inner) - steps
+
+        def __getitem__(self, idx):
+            return self._inner[idx + steps]
+
+        def on_epoch_end(self):
+            if hasattr(self._inner, 'on_epoch_end'):
+                self._inner.on_epoch_end()
+
+    return SkippedSequence(loader)
+
+def with_restored_history(history: tf.keras.callbacks.History, checkpointer: TrainingCheckpoint):
+    """Histórico completo de uma execução retomada: épocas anteriores à retomada + as novas"""
+    restored = checkpointer.restored_epochs
+    if not restored:
+        return history
+    for key, values in history.history.items():
+        history.history[key] = checkpointer.history.get(key, [None] * len(checkpointer.history['epoch']))[:restored] \
+            + list(values)
+    history.epoch = checkpointer.history['epoch'][:restored] + list(history.epoch)
+    return history
+
+def merge_histories(first: tf.keras.callbacks.History, second: tf.keras.callbacks.History) -> tf.keras.callbacks.History:
+    """Junta o histórico da época retomada com o das épocas seguintes"""
+    for key, values in second.history.items():
+        first.history.setdefault(key, []).extend(values)
+    first.epoch.extend(second.epoch)
+    return first
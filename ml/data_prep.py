@@ -5,164 +5,544 @@
 import os
 import sys
 import json
+import hashlib
 import argparse
 import numpy as np
-import pandas as pd
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional, Iterator, Sequence
 import cv2
 from tqdm import tqdm
-import boto3
+from prep_cache import ProcessingCache, prune_outputs, link_or_copy
+from shards import write_shards
+from metadata_io import MetadataWriter, metadata_path, iter_metadata, iter_records
+from dedup import Deduplicator, phash_hex
+from image_decode import DECODE_MODES, RESIZE_MODES, decode_image, resize_image, interpolation_for
+from pyramid import size_dir, variant_file, write_manifest
+from splitting import SPLIT_KEYS, HashSplitter
+from video_ingest import VIDEO_EXTENSIONS, TimeRangeLabels, is_video, group_video_inputs, iter_video_frames, frame_filename, parse_m3u8
+import instrumentation
+from instrumentation import Stopwatch
 from datetime import datetime
 import io
+import math
+import time
+import itertools
+import functools
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def parse_arguments():
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description='Prepara dados para treinamento do modelo SafeWatch')
     parser.add_argument('--input-dir', type=str, default='data/raw', help='Diretório com dados brutos')
     parser.add_argument('--output-dir', type=str, default='data/processed', help='Diretório de saída')
     parser.add_argument('--from-s3', action='store_true', help='Baixar dados do S3')
     parser.add_argument('--s3-bucket', type=str, help='Bucket S3 para dados')
     parser.add_argument('--s3-prefix', type=str, default='frames/', help='Prefixo S3')
+    parser.add_argument('--s3-endpoint-url', type=str, help='Endpoint S3 alternativo (ex.: MinIO local)')
+    parser.add_argument('--download-workers', type=int, default=16, help='Downloads simultâneos do S3')
     parser.add_argument('--annotations-file', type=str, help='Arquivo de anotações dos frames')
+    parser.add_argument('--time-annotations', type=str,
+                        help='Rótulos de vídeos por intervalo (CSV/JSONL/Parquet com source, start, end, label)')
+    parser.add_argument('--sample-fps', type=float, default=1.0,
+                        help='Frames amostrados por segundo de vídeo (0 = todos os frames candidatos)')
+    parser.add_argument('--scene-threshold', type=float,
+                        help='Amostrar vídeos por mudança de cena: diferença média mínima (0-255) entre frames')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Remover frames quase duplicados (hash perceptual, mesmo rótulo)')
+    parser.add_argument('--dedup-radius', type=int, default=6,
+                        help='Distância de Hamming máxima (de 64 bits) entre quase duplicados')
+    parser.add_argument('--dedup-max-per-cluster', type=int, default=1,
+                        help='Frames mantidos por grupo de quase duplicados')
     parser.add_argument('--image-size', type=int, default=224, help='Tamanho de redimensionamento')
+    parser.add_argument('--extra-sizes', type=int, nargs='+', default=[],
+                        help='Tamanhos adicionais gerados da mesma decodificação, em <output-dir>/size_<N>/')
+    parser.add_argument('--decode', type=str, default='full', choices=DECODE_MODES,
+                        help='full = decodificação completa; reduced = JPEG decodificado em 1/2-1/8 da '
+                             'resolução (o que ainda cobre --image-size) + INTER_AREA')
+    parser.add_argument('--resize-mode', type=str, default='stretch', choices=RESIZE_MODES,
+                        help='stretch = distorce a proporção; letterbox = completa com preto; '
+                             'crop = recorta o quadrado central')
     parser.add_argument('--test-split', type=float, default=0.2, help='Proporção de teste')
-    return parser.parse_args()
+    parser.add_argument('--split-key', type=str, default='source', choices=SPLIT_KEYS,
+                        help='Chave cujo hash define o conjunto: source = vídeo de origem (frames de um vídeo '
+                             'ficam juntos; imagens avulsas usam o arquivo) ou filename')
+    parser.add_argument('--split-key-pattern', type=str,
+                        help=r"Regex aplicada à chave; o 1º grupo vira a chave (ex.: '^(cam\d+)_' agrupa por câmera)")
+    parser.add_argument('--split-salt', type=str, default='',
+                        help='Salt do hash (mudá-lo sorteia uma nova divisão)')
+    parser.add_argument('--output-format', type=str, default='directory', choices=['directory', 'shards'],
+                        help='Formato do dataset de saída: diretórios de imagens ou shards .npy')
+    parser.add_argument('--shard-size', type=int, default=1024, help='Exemplos por shard (--output-format shards)')
+    parser.add_argument('--metadata-format', type=str, default='parquet', choices=['parquet', 'arrow', 'jsonl', 'json'],
+                        help='Formato dos metadados (json = JSON indentado + CSV, formato antigo)')
+    parser.add_argument('--timeline', type=str,
+                        help='Arquivo JSON da linha do tempo da execução (padrão: <output-dir>/metadata/timeline.json)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Número de processos para processar imagens (1 = serial)')
+    parser.add_argument('--chunk-size', type=int, help='Imagens por bloco enviado a cada worker')
+    parser.add_argument('--cache-dir', type=str, help='Diretório do cache de processamento (padrão: <output-dir>/cache)')
+    parser.add_argument('--no-cache', action='store_true', help='Reprocessar tudo sem usar o cache')
+    return parser.parse_args(argv)
 
-def download_from_s3(bucket: str, prefix: str, output_dir: str) -> List[str]:
+def download_from_s3(bucket: str, prefix: str, output_dir: str, workers: int = 16,
+                     endpoint_url: Optional[str] = None) -> List[str]:
     """Baixa frames do S3 e retorna lista de caminhos"""
+    from s3_sync import download_prefix
     print(f"Baixando dados do S3 bucket '{bucket}' com prefixo '{prefix}'...")
     
-    s3 = boto3.client('s3')
-    
-    # Listar objetos no bucket
-    objects = []
-    paginator = s3.get_paginator('list_objects_v2')
-    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-        if 'Contents' in page:
-            objects.extend(page['Contents'])
-    
-    # Criar diretório de saída se não existir
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Baixar cada objeto
-    file_paths = []
-    for obj in tqdm(objects, desc="Baixando frames"):
-        if not obj['Key'].endswith(('.jpg', '.jpeg', '.png')):
-            continue
-        
-        # Definir caminho local
-        filename = os.path.basename(obj['Key'])
-        filepath = os.path.join(output_dir, filename)
-        
-        # Baixar arquivo
-        s3.download_file(bucket, obj['Key'], filepath)
-        file_paths.append(filepath)
-    
-    print(f"Download concluído. {len(file_paths)} arquivos baixados.")
-    return file_paths
+    return download_prefix(bucket, prefix, output_dir, suffixes=('.jpg', '.jpeg', '.png') + VIDEO_EXTENSIONS,
+                           workers=workers, endpoint_url=endpoint_url)
 
 def load_annotations(annotations_file: str) -> Dict[str, str]:
-    """Carrega anotações de arquivo JSON ou CSV"""
+    """Carrega anotações de arquivo JSON, CSV, JSONL ou Parquet
+    
+    Arquivos tabulares são lidos em blocos, apenas com as colunas filename e label.
+    """
     if annotations_file.endswith('.json'):
         with open(annotations_file, 'r') as f:
             return json.load(f)
-    elif annotations_file.endswith('.csv'):
-        df = pd.read_csv(annotations_file)
-        return dict(zip(df['filename'], df['label']))
+    elif annotations_file.endswith(('.csv', '.jsonl', '.parquet', '.arrow')):
+        annotations = {}
+        for df in iter_metadata(annotations_file, columns=['filename', 'label']):
+            annotations.update(zip(df['filename'], df['label']))
+        return annotations
     else:
         raise ValueError(f"Formato de arquivo não suportado: {annotations_file}")
 
-def process_images(file_paths: List[str], annotations: Dict[str, str], 
-                  output_dir: str, image_size: int) -> List[Dict[str, Any]]:
-    """Processa imagens e retorna metadados"""
-    os.makedirs(output_dir, exist_ok=True)
+def _process_image(filepath: str, label: str, output_dir: str, image_size: int,
+                   stopwatch: Optional[Stopwatch] = None, decode: str = 'full',
+                   resize_mode: str = 'stretch', extra_sizes: Sequence[int] = ()) -> Dict[str, Any]:
+    """Processa uma única imagem e retorna seus metadados"""
+    stopwatch = stopwatch or Stopwatch()
     
-    # Diretórios para cada classe
-    class_dirs = set(annotations.values())
-    for cls in class_dirs:
-        os.makedirs(os.path.join(output_dir, cls), exist_ok=True)
+    # Ler imagem (no modo reduced, já em resolução próxima da final)
+    with stopwatch.time('prep/decode'):
+        image = decode_image(filepath, max([image_size, *extra_sizes]), decode, resize_mode)
+    if image is None:
+        raise ValueError(f"Não foi possível ler a imagem: {filepath}")
+    
+    return _process_frame(image, os.path.basename(filepath), label, output_dir, image_size, stopwatch,
+                          decode, resize_mode, extra_sizes)
+
+def _process_frame(image: np.ndarray, filename: str, label: str, output_dir: str, image_size: int,
+                   stopwatch: Stopwatch, decode: str = 'full', resize_mode: str = 'stretch',
+                   extra_sizes: Sequence[int] = ()) -> Dict[str, Any]:
+    """Redimensiona e grava um frame já decodificado (BGR), retornando seus metadados
+    
+    Cada tamanho de extra_sizes é redimensionado do mesmo frame e gravado na variante
+    size_<N> de output_dir; os metadados descrevem o tamanho principal.
+    """
+    output_file = os.path.join(output_dir, label, filename)
+    interpolation = interpolation_for(decode)
+    for size in extra_sizes:
+        with stopwatch.time('prep/resize'):
+            variant = resize_image(image, size, resize_mode, interpolation)
+        with stopwatch.time('prep/encode'):
+            cv2.imwrite(variant_file(output_file, output_dir, size), variant)
+    
+    # Pré-processamento: redimensionar, equalizar histograma, etc.
+    with stopwatch.time('prep/resize'):
+        image = resize_image(image, image_size, resize_mode, interpolation)
+    
+    # Salvar imagem processada
+    with stopwatch.time('prep/encode'):
+        cv2.imwrite(output_file, image)
     
-    metadata = []
-    for filepath in tqdm(file_paths, desc="Processando imagens"):
+    # Extrair features básicas para metadados
+    with stopwatch.time('prep/stats'):
+        average_brightness = np.mean(image)
+        std_brightness = np.std(image)
+        perceptual_hash = phash_hex(image)
+    
+    return {
+        'filename': filename,
+        'label': label,
+        'processed_path': output_file,
+        'brightness_mean': float(average_brightness),
+        'brightness_std': float(std_brightness),
+        'width': image_size,
+        'height': image_size,
+        'phash': perceptual_hash
+    }
+
+def _process_task(task: Tuple[str, str], output_dir: str, image_size: int,
+                  stopwatch: Optional[Stopwatch] = None, decode: str = 'full', resize_mode: str = 'stretch',
+                  extra_sizes: Sequence[int] = ()) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Processa uma tarefa (caminho, rótulo) retornando (metadados, erro)"""
+    filepath, label = task
+    try:
+        return _process_image(filepath, label, output_dir, image_size, stopwatch, decode, resize_mode,
+                              extra_sizes), None
+    except Exception as e:
+        return None, f"Erro ao processar {filepath}: {e}"
+
+def _process_chunk(chunk: List[Tuple[str, str]], output_dir: str, image_size: int, decode: str = 'full',
+                   resize_mode: str = 'stretch',
+                   extra_sizes: Sequence[int] = ()) -> Tuple[List[Tuple[Optional[Dict[str, Any]], Optional[str]]], Dict[str, List[float]]]:
+    """Processa um bloco de tarefas dentro de um worker do pool; retorna também os tempos por etapa"""
+    stopwatch = Stopwatch()
+    return [_process_task(task, output_dir, image_size, stopwatch, decode, resize_mode, extra_sizes)
+            for task in chunk], stopwatch.timings
+
+def _init_worker():
+    """Evita que o OpenCV crie threads próprias em cada processo do pool"""
+    cv2.setNumThreads(0)
+
+def _iter_tasks(file_paths: List[str], annotations: Dict[str, str], warn=print):
+    """Gera tarefas (caminho, rótulo) apenas para arquivos com anotação"""
+    for filepath in file_paths:
         filename = os.path.basename(filepath)
         
         # Verificar se há anotação para este arquivo
         if filename not in annotations:
-            print(f"Aviso: Não há anotação para {filename}")
+            warn(f"Aviso: Não há anotação para {filename}")
             continue
         
-        label = annotations[filename]
-        
-        try:
-            # Ler imagem
-            image = cv2.imread(filepath)
-            if image is None:
-                raise ValueError(f"Não foi possível ler a imagem: {filepath}")
-            
-            # Pré-processamento: redimensionar, equalizar histograma, etc.
-            image = cv2.resize(image, (image_size, image_size))
-            
-            # Converter para espaço de cor adequado
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        yield filepath, annotations[filename]
+
+def iter_process_images(file_paths: List[str], annotations: Dict[str, str], 
+                        output_dir: str, image_size: int, workers: int = 1,
+                        chunk_size: Optional[int] = None,
+                        cache: Optional[ProcessingCache] = None,
+                        window_size: int = 8192, decode: str = 'full', resize_mode: str = 'stretch',
+                        extra_sizes: Sequence[int] = ()) -> Iterator[Dict[str, Any]]:
+    """Processa imagens e produz os metadados de cada uma, na ordem de file_paths
+    
+    As tarefas são tratadas em janelas de window_size arquivos, de modo que a memória
+    não cresce com o tamanho do dataset. Com workers > 1 cada janela é dividida em
+    blocos processados em processos separados; o resultado é idêntico ao do modo
+    serial. Com um cache, fontes já processadas com os mesmos parâmetros são
+    restauradas sem decodificação e apenas as novas ou alteradas são processadas.
+    decode e resize_mode escolhem o caminho de decodificação (ver image_decode);
+    extra_sizes são gravados a partir da mesma decodificação (ver pyramid).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # Diretórios para cada classe, em cada tamanho
+    class_dirs = set(annotations.values())
+    for root in [output_dir] + [size_dir(output_dir, size) for size in extra_sizes]:
+        for cls in class_dirs:
+            os.makedirs(os.path.join(root, cls), exist_ok=True)
+    
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    
+    live_digests = set()
+    processed = 0
+    # Total só dos arquivos anotados: os demais são descartados sem processamento
+    annotated = sum(os.path.basename(p) in annotations for p in file_paths)
+    progress = tqdm(total=annotated, desc="Processando imagens")
+    tasks_iter = _iter_tasks(file_paths, annotations, progress.write)
+    try:
+        while True:
+            tasks = list(itertools.islice(tasks_iter, window_size))
+            if not tasks:
+                break
+            results: List[Optional[Dict[str, Any]]] = [None] * len(tasks)
+            pending = list(range(len(tasks)))
             
-            # Salvar imagem processada
-            output_file = os.path.join(output_dir, label, filename)
-            cv2.imwrite(output_file, image)
+            # Restaurar do cache o que já foi processado com os mesmos parâmetros
+            digests = {}
+            if cache is not None:
+                lookup_start = time.perf_counter()
+                pending = []
+                for i, (filepath, label) in enumerate(tasks):
+                    try:
+                        digests[i] = cache.digest(filepath)
+                    except OSError as e:
+                        progress.write(f"Erro ao processar {filepath}: {e}")
+                        continue
+                    results[i] = cache.restore(digests[i], os.path.basename(filepath), label, output_dir)
+                    if results[i] is None:
+                        # Não sobrescrever no lugar um arquivo que pode ser hardlink do cache
+                        output_file = os.path.join(output_dir, label, os.path.basename(filepath))
+                        for target in [output_file] + [variant_file(output_file, output_dir, size)
+                                                       for size in extra_sizes]:
+                            if os.path.lexists(target):
+                                os.remove(target)
+                        pending.append(i)
+                live_digests.update(digests.values())
+                progress.update(len(tasks) - len(pending))
+                instrumentation.timeline.add('prep/cache_lookup', time.perf_counter() - lookup_start, len(tasks))
+                instrumentation.count('prep/cache_hits', len(tasks) - len(pending))
             
-            # Extrair features básicas para metadados
-            average_brightness = np.mean(image)
-            std_brightness = np.std(image)
+            if executor is None or len(pending) <= 1:
+                stopwatch = Stopwatch()
+                for i in pending:
+                    results[i], error = _process_task(tasks[i], output_dir, image_size, stopwatch,
+                                                      decode, resize_mode, extra_sizes)
+                    if error:
+                        progress.write(error)
+                    progress.update(1)
+                instrumentation.timeline.merge(stopwatch.timings)
+            else:
+                # Blocos pequenos o suficiente para balancear a carga entre workers
+                size = chunk_size or max(1, min(256, math.ceil(len(pending) / (workers * 4))))
+                chunks = [pending[i:i + size] for i in range(0, len(pending), size)]
+                futures = {executor.submit(_process_chunk, [tasks[i] for i in chunk], output_dir, image_size,
+                                           decode, resize_mode, extra_sizes): chunk
+                           for chunk in chunks}
+                for future in as_completed(futures):
+                    chunk = futures[future]
+                    chunk_results, timings = future.result()
+                    instrumentation.timeline.merge(timings)
+                    # Cada resultado volta para a posição original da tarefa
+                    for i, (record, error) in zip(chunk, chunk_results):
+                        results[i] = record
+                        if error:
+                            progress.write(error)
+                    progress.update(len(chunk))
             
-            # Adicionar metadados
-            metadata.append({
-                'filename': filename,
-                'label': label,
-                'processed_path': output_file,
-                'brightness_mean': float(average_brightness),
-                'brightness_std': float(std_brightness),
-                'width': image_size,
-                'height': image_size
-            })
+            if cache is not None:
+                for i in pending:
+                    if results[i] is not None:
+                        cache.store(digests[i], results[i], output_dir)
+                # Uma interrupção perde no máximo a janela em andamento
+                cache.commit()
+            processed += len(pending)
+            instrumentation.count('prep/images_processed', len(pending))
+            instrumentation.count('prep/errors', sum(results[i] is None for i in pending))
             
-        except Exception as e:
-            print(f"Erro ao processar {filepath}: {e}")
+            for record in results:
+                if record is not None:
+                    yield record
+    finally:
+        progress.close()
+        if executor is not None:
+            executor.shutdown()
     
-    return metadata
+    if cache is not None:
+        removed = cache.prune(live_digests, file_paths)
+        print(f"Cache: {cache.hits} reaproveitadas, {processed} processadas, {removed} entradas obsoletas removidas")
 
-def split_train_test(metadata: List[Dict[str, Any]], test_split: float) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
-    """Divide os dados em conjuntos de treinamento e teste"""
-    df = pd.DataFrame(metadata)
-    
-    # Garantir divisão estratificada por classe
-    from sklearn.model_selection import train_test_split
-    train_df, test_df = train_test_split(df, test_size=test_split, stratify=df['label'], random_state=42)
+def _frame_label(source: str, timestamp: float, default_label: Optional[str],
+                 time_labels: TimeRangeLabels) -> Optional[str]:
+    """Rótulo de um frame: intervalo de tempo que o contém ou, na falta dele, o rótulo do vídeo"""
+    return time_labels.label_at(source, timestamp) if source in time_labels else default_label
+
+def _process_video(task: Tuple[str, Optional[str]], output_dir: str, image_size: int,
+                   time_labels: TimeRangeLabels, sample_fps: Optional[float],
+                   scene_threshold: Optional[float], decode: str = 'full', resize_mode: str = 'stretch',
+                   extra_sizes: Sequence[int] = ()) -> Tuple[Dict[float, Dict[str, Any]], List[float], Optional[str], Dict[str, List[float]]]:
+    """Decodifica um vídeo em fluxo e processa os frames amostrados sem arquivos intermediários
     
-    return train_df.to_dict('records'), test_df.to_dict('records')
+    Retorna (metadados por timestamp dos frames rotulados, timestamps de todos os frames
+    amostrados, erro, tempos por etapa).
+    """
+    source, default_label = task
+    stopwatch = Stopwatch()
+    frames_done = {}
+    sampled = []
+    created = set()
+    try:
+        frames = iter_video_frames(source, sample_fps, scene_threshold)
+        while True:
+            with stopwatch.time('prep/video_decode'):
+                item = next(frames, None)
+            if item is None:
+                break
+            timestamp, frame = item
+            sampled.append(timestamp)
+            label = _frame_label(source, timestamp, default_label, time_labels)
+            if label is None:
+                continue
+            if label not in created:
+                for root in [output_dir] + [size_dir(output_dir, size) for size in extra_sizes]:
+                    os.makedirs(os.path.join(root, label), exist_ok=True)
+                created.add(label)
+            # Não sobrescrever no lugar um arquivo que pode ser hardlink do cache
+            output_file = os.path.join(output_dir, label, frame_filename(source, timestamp))
+            for target in [output_file] + [variant_file(output_file, output_dir, size) for size in extra_sizes]:
+                if os.path.lexists(target):
+                    os.remove(target)
+            record = _process_frame(frame, frame_filename(source, timestamp), label, output_dir,
+                                    image_size, stopwatch, decode, resize_mode, extra_sizes)
+            record.update({'source': os.path.basename(source), 'timestamp': round(timestamp, 3)})
+            frames_done[timestamp] = record
+    except Exception as e:
+        return frames_done, sampled, f"Erro ao processar {source}: {e}", stopwatch.timings
+    return frames_done, sampled, None, stopwatch.timings
 
-def save_metadata(train_data: List[Dict[str, Any]], test_data: List[Dict[str, Any]], output_dir: str):
-    """Salva metadados em arquivos JSON"""
-    os.makedirs(output_dir, exist_ok=True)
+def _recording_digest(cache: ProcessingCache, source: str) -> str:
+    """Hash do conteúdo de uma gravação; playlists .m3u8 incluem o conteúdo dos segmentos"""
+    if not source.lower().endswith('.m3u8'):
+        return cache.digest(source)
+    h = hashlib.sha256(cache.digest(source).encode())
+    for segment, _ in parse_m3u8(source):
+        h.update(cache.digest(segment).encode())
+    return h.hexdigest()
+
+def _restore_video(cache: ProcessingCache, video_key: str, task: Tuple[str, Optional[str]],
+                   time_labels: TimeRangeLabels, output_dir: str) -> Optional[Tuple[List[Dict[str, Any]], int]]:
+    """Restaura do cache os frames de um vídeo com os rótulos atuais; None se faltar algum"""
+    source, default_label = task
+    sampled = cache.video_timestamps(video_key)
+    if sampled is None:
+        cache.misses += 1
+        return None
+    records = []
+    for timestamp in sampled:
+        label = _frame_label(source, timestamp, default_label, time_labels)
+        if label is None:
+            continue
+        # Um frame antes sem rótulo nunca foi processado: o vídeo todo é refeito
+        record = cache.restore_frame(video_key, timestamp, frame_filename(source, timestamp), label, output_dir)
+        if record is None:
+            return None
+        record['source'] = os.path.basename(source)
+        records.append(record)
+    return records, len(sampled) - len(records)
+
+def iter_process_videos(video_paths: List[str], annotations: Dict[str, str], time_labels: TimeRangeLabels,
+                        output_dir: str, image_size: int, sample_fps: Optional[float] = 1.0,
+                        scene_threshold: Optional[float] = None, workers: int = 1, decode: str = 'full',
+                        resize_mode: str = 'stretch', extra_sizes: Sequence[int] = (),
+                        cache: Optional[ProcessingCache] = None) -> Iterator[Dict[str, Any]]:
+    """Processa vídeos (MP4/TS/m3u8) e produz os metadados dos frames amostrados
     
-    train_file = os.path.join(output_dir, 'train_metadata.json')
-    test_file = os.path.join(output_dir, 'test_metadata.json')
+    Cada vídeo é decodificado em fluxo por um worker; os frames são rotulados pelos
+    intervalos de tempo de time_labels ou, na falta deles, pelo rótulo do vídeo
+    inteiro em annotations. Frames sem rótulo são descartados. Frames de vídeo já
+    chegam decodificados; decode só escolhe a interpolação do redimensionamento.
+    Com um cache, vídeos já amostrados com os mesmos parâmetros (hash da gravação +
+    sample_fps/scene_threshold + tamanhos) são restaurados sem decodificação.
+    """
+    tasks = []
+    for source in video_paths:
+        default_label = annotations.get(os.path.basename(source))
+        if source not in time_labels and default_label is None:
+            print(f"Aviso: Não há anotação para {os.path.basename(source)}")
+            continue
+        tasks.append((source, default_label))
     
-    # Salvar como JSON
-    with open(train_file, 'w') as f:
-        json.dump(train_data, f, indent=2)
+    # Restaurar do cache os vídeos já amostrados; só os demais são decodificados
+    restored = {}
+    video_keys = {}
+    hits = 0
+    if cache is not None:
+        lookup_start = time.perf_counter()
+        sampling = {'sample_fps': sample_fps, 'scene_threshold': scene_threshold}
+        for task in tasks:
+            try:
+                video_keys[task[0]] = cache.video_key(_recording_digest(cache, task[0]), sampling)
+            except OSError as e:
+                print(f"Erro ao processar {task[0]}: {e}")
+                continue
+            result = _restore_video(cache, video_keys[task[0]], task, time_labels, output_dir)
+            if result is not None:
+                restored[task[0]] = result
+        instrumentation.timeline.add('prep/cache_lookup', time.perf_counter() - lookup_start, len(tasks))
+        hits = len(restored)
+        instrumentation.count('prep/cache_hits', hits)
+    pending = [task for task in tasks if task[0] not in restored and (cache is None or task[0] in video_keys)]
     
-    with open(test_file, 'w') as f:
-        json.dump(test_data, f, indent=2)
+    process = functools.partial(_process_video, output_dir=output_dir, image_size=image_size,
+                                time_labels=time_labels, sample_fps=sample_fps, scene_threshold=scene_threshold,
+                                decode=decode, resize_mode=resize_mode, extra_sizes=extra_sizes)
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) if workers > 1 else None
+    results = executor.map(process, pending) if executor is not None else map(process, pending)
+    results = iter(results)
     
-    # Também salvar como CSV para análise fácil
-    pd.DataFrame(train_data).to_csv(os.path.join(output_dir, 'train_metadata.csv'), index=False)
-    pd.DataFrame(test_data).to_csv(os.path.join(output_dir, 'test_metadata.csv'), index=False)
+    frames = 0
+    unlabeled = 0
+    try:
+        for source, _ in tqdm(tasks, desc="Processando vídeos"):
+            if source in restored:
+                records, skipped = restored.pop(source)
+            elif cache is not None and source not in video_keys:
+                continue
+            else:
+                frames_done, sampled, error, timings = next(results)
+                instrumentation.timeline.merge(timings)
+                if error:
+                    print(error)
+                    instrumentation.count('prep/errors')
+                elif cache is not None:
+                    cache.store_video(video_keys[source], sampled, frames_done, output_dir)
+                    cache.commit()
+                records = list(frames_done.values())
+                skipped = len(sampled) - len(records)
+            frames += len(records)
+            unlabeled += skipped
+            yield from records
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    
+    instrumentation.count('prep/video_frames', frames)
+    print(f"Vídeos: {len(tasks)} processados, {frames} frames amostrados, {unlabeled} sem rótulo descartados")
+    if cache is not None:
+        removed = cache.prune_videos(set(video_keys.values()))
+        if tasks or removed:
+            print(f"Cache de vídeos: {hits} reaproveitados, {len(pending)} processados, "
+                  f"{removed} obsoletos removidos")
+
+def process_images(file_paths: List[str], annotations: Dict[str, str], 
+                  output_dir: str, image_size: int, workers: int = 1,
+                  chunk_size: Optional[int] = None,
+                  cache: Optional[ProcessingCache] = None, decode: str = 'full',
+                  resize_mode: str = 'stretch', extra_sizes: Sequence[int] = ()) -> List[Dict[str, Any]]:
+    """Processa imagens e retorna metadados"""
+    return list(iter_process_images(file_paths, annotations, output_dir, image_size,
+                                    workers, chunk_size, cache, decode=decode, resize_mode=resize_mode,
+                                    extra_sizes=extra_sizes))
+
+def link_split_dir(records: List[Dict[str, Any]], split_dir: str) -> int:
+    """Monta o diretório de um conjunto (classe/arquivo) com links para as imagens processadas"""
+    keep = []
+    for record in records:
+        target = os.path.join(split_dir, record['label'], record['filename'])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not (os.path.exists(target) and os.path.samefile(record['processed_path'], target)):
+            link_or_copy(record['processed_path'], target)
+        keep.append(target)
+    prune_outputs(split_dir, keep)
+    return len(keep)
+
+def _sized_records(records: Iterator[Dict[str, Any]], processed_dir: str, size: int) -> Iterator[Dict[str, Any]]:
+    """Registros apontando para a variante de tamanho size de cada imagem processada"""
+    for record in records:
+        yield dict(record, processed_path=variant_file(record['processed_path'], processed_dir, size),
+                   width=size, height=size)
+
+def save_dataset(train_path: str, test_path: str, class_names: List[str], output_dir: str,
+                 output_format: str, image_size: int, shard_size: int, extra_sizes: Sequence[int] = ()):
+    """Grava os conjuntos de treino e teste no formato consumido pelo train.py/evaluate.py
+    
+    Cada tamanho de extra_sizes ganha os mesmos conjuntos em <output_dir>/size_<N>/.
+    """
+    processed_dir = os.path.join(output_dir, 'images')
+    for split, path in (('train', train_path), ('test', test_path)):
+        name = f'shards_{split}' if output_format == 'shards' else f'images_{split}'
+        for size in [image_size] + list(extra_sizes):
+            records = iter_records(path)
+            split_dir = os.path.join(output_dir, name)
+            if size != image_size:
+                records = _sized_records(records, processed_dir, size)
+                split_dir = size_dir(split_dir, size)
+            if output_format == 'shards':
+                write_shards(records, class_names, split_dir, size, shard_size)
+            else:
+                link_split_dir(records, split_dir)
+    print(f"Dataset salvo em {output_dir} (formato: {output_format})")
+
+def save_metadata(all_path: str, output_dir: str, fmt: str) -> Tuple[str, str]:
+    """Grava os metadados de treino e teste a partir do arquivo completo (coluna split), em blocos"""
+    train_file = metadata_path(output_dir, 'train', fmt)
+    test_file = metadata_path(output_dir, 'test', fmt)
+    
+    with MetadataWriter(train_file, fmt) as train_writer, MetadataWriter(test_file, fmt) as test_writer:
+        for record in iter_records(all_path):
+            (test_writer if record['split'] == 'test' else train_writer).write(record)
     
     print(f"Metadados salvos em {output_dir}")
-    print(f"Conjunto de treinamento: {len(train_data)} amostras")
-    print(f"Conjunto de teste: {len(test_data)} amostras")
+    print(f"Conjunto de treinamento: {train_writer.count} amostras")
+    print(f"Conjunto de teste: {test_writer.count} amostras")
+    return train_file, test_file
 
-def main():
-    args = parse_arguments()
+def main(argv=None):
+    args = parse_arguments(argv)
+    instrumentation.start_run('data_prep')
     
     # Criar diretórios
     os.makedirs(args.output_dir, exist_ok=True)
@@ -175,22 +555,30 @@ def main():
         if not args.s3_bucket:
             print("Erro: --s3-bucket é obrigatório quando --from-s3 está habilitado")
             sys.exit(1)
-        file_paths = download_from_s3(args.s3_bucket, args.s3_prefix, raw_dir)
+        with instrumentation.stage('prep/download'):
+            file_paths = download_from_s3(args.s3_bucket, args.s3_prefix, raw_dir,
+                                          args.download_workers, args.s3_endpoint_url)
     else:
         if not os.path.exists(raw_dir):
             print(f"Erro: Diretório de entrada {raw_dir} não existe")
             sys.exit(1)
         file_paths = [os.path.join(raw_dir, f) for f in os.listdir(raw_dir) 
-                      if f.endswith(('.jpg', '.jpeg', '.png'))]
+                      if f.endswith(('.jpg', '.jpeg', '.png')) or is_video(f)]
+    
+    # Vídeos são decodificados em fluxo; segmentos de uma playlist .m3u8 entram pela playlist
+    video_paths = sorted(group_video_inputs([p for p in file_paths if is_video(p)]))
+    file_paths = [p for p in file_paths if not is_video(p)]
+    time_labels = TimeRangeLabels(args.time_annotations)
     
     # Carregar anotações
     if args.annotations_file and os.path.exists(args.annotations_file):
-        annotations = load_annotations(args.annotations_file)
+        with instrumentation.stage('prep/load_annotations'):
+            annotations = load_annotations(args.annotations_file)
     else:
         print("Aviso: Arquivo de anotações não fornecido. Usando nomes de arquivo para inferir classes.")
         # Inferir classe do nome do arquivo (por exemplo, "fall_001.jpg" -> "fall")
         annotations = {}
-        for filepath in file_paths:
+        for filepath in file_paths + [p for p in video_paths if p not in time_labels]:
             filename = os.path.basename(filepath)
             if '_' in filename:
                 label = filename.split('_')[0]
@@ -198,15 +586,88 @@ def main():
             else:
                 print(f"Aviso: Não foi possível inferir classe para {filename}")
     
-    # Processar imagens
-    metadata = process_images(file_paths, annotations, processed_dir, args.image_size)
+    # Cache de processamento chaveado pelo conteúdo da fonte e pelos parâmetros
+    extra_sizes = sorted(set(args.extra_sizes) - {args.image_size})
+    cache = None
+    if not args.no_cache:
+        cache = ProcessingCache(args.cache_dir or os.path.join(args.output_dir, 'cache'),
+                                {'image_size': args.image_size, 'color': 'bgr',
+                                 'decode': args.decode, 'resize_mode': args.resize_mode},
+                                extra_sizes=extra_sizes)
+    
+    # Processar imagens, gravando os metadados à medida que são produzidos
+    all_path = metadata_path(metadata_dir, 'all', args.metadata_format)
+    processed_paths = []
+    dedup = Deduplicator(args.dedup_radius, args.dedup_max_per_cluster) if args.dedup else None
+    # Conjunto de cada registro decidido na hora, pelo hash da chave (estável com novos dados)
+    splitter = HashSplitter(args.test_split, args.split_key, args.split_key_pattern, args.split_salt)
+    try:
+        with instrumentation.stage('prep/process_images'), MetadataWriter(all_path, args.metadata_format) as writer:
+            records = itertools.chain(
+                iter_process_images(file_paths, annotations, processed_dir, args.image_size,
+                                    workers=args.workers, chunk_size=args.chunk_size, cache=cache,
+                                    decode=args.decode, resize_mode=args.resize_mode, extra_sizes=extra_sizes),
+                iter_process_videos(video_paths, annotations, time_labels, processed_dir, args.image_size,
+                                    args.sample_fps or None, args.scene_threshold, args.workers,
+                                    decode=args.decode, resize_mode=args.resize_mode, extra_sizes=extra_sizes,
+                                    cache=cache))
+            for record in records:
+                if dedup is not None:
+                    dedup_start = time.perf_counter()
+                    keep = dedup.add(record)
+                    instrumentation.timeline.add('prep/dedup', time.perf_counter() - dedup_start)
+                    if not keep:
+                        continue
+                record['split'] = splitter.assign(record)
+                write_start = time.perf_counter()
+                writer.write(record)
+                instrumentation.timeline.add('prep/metadata_write', time.perf_counter() - write_start)
+                processed_paths.append(record['processed_path'])
+    finally:
+        if cache is not None:
+            cache.close()
     
-    # Dividir em conjuntos de treinamento e teste
-    train_data, test_data = split_train_test(metadata, args.test_split)
+    if dedup is not None:
+        report = dedup.report()
+        print(f"Deduplicação: {report['frames']} frames em {report['clusters']} grupos, "
+              f"{report['kept']} mantidos, {report['removed']} removidos ({report['shrink_ratio']:.1%} menor)")
+        with open(os.path.join(metadata_dir, 'dedup_report.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+        instrumentation.count('prep/dedup_removed', report['removed'])
+    
+    # Remover saídas de fontes que não existem mais (e frames descartados como duplicados)
+    removed = prune_outputs(processed_dir, processed_paths)
+    for size in extra_sizes:
+        prune_outputs(size_dir(processed_dir, size), (variant_file(p, processed_dir, size) for p in processed_paths))
+    if removed:
+        print(f"{removed} imagens processadas obsoletas removidas")
+    del processed_paths
+    
+    # Divisão treino/teste obtida por classe
+    split_report = splitter.report()
+    for label, counts in split_report.items():
+        print(f"Classe {label}: {counts['train']} treino, {counts['test']} teste "
+              f"({counts['test_fraction']:.1%} no teste)")
+        if counts['train'] == 0 or counts['test'] == 0:
+            print(f"Aviso: a classe {label} ficou sem exemplos em um dos conjuntos (poucos grupos)")
+    with open(os.path.join(metadata_dir, 'split_report.json'), 'w') as f:
+        json.dump({'key': args.split_key, 'pattern': args.split_key_pattern, 'salt': args.split_salt,
+                   'test_split': args.test_split, 'classes': split_report}, f, indent=2)
     
     # Salvar metadados
-    save_metadata(train_data, test_data, metadata_dir)
+    with instrumentation.stage('prep/save_metadata'):
+        train_path, test_path = save_metadata(all_path, metadata_dir, args.metadata_format)
+    
+    # Salvar conjuntos no formato pedido (mesma ordenação de classes do flow_from_directory)
+    class_names = splitter.class_names
+    with instrumentation.stage('prep/save_dataset', format=args.output_format):
+        save_dataset(train_path, test_path, class_names, args.output_dir, args.output_format,
+                     args.image_size, args.shard_size, extra_sizes)
+    write_manifest(args.output_dir, args.image_size, [args.image_size] + extra_sizes,
+                   {'decode': args.decode, 'resize_mode': args.resize_mode})
     
+    instrumentation.timeline.print_summary()
+    instrumentation.timeline.save(args.timeline or os.path.join(metadata_dir, 'timeline.json'))
     print("Preparação de dados concluída com sucesso!")
 
 if __name__ == "__main__":
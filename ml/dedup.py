@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# ml/dedup.py - Remoção de frames quase duplicados por hash perceptual
+
+import itertools
+import numpy as np
+import cv2
+from typing import Dict, Any, List, Tuple
+
+HASH_BITS = 64
+
+def phash(image: np.ndarray) -> int:
+    """Hash perceptual (DCT) de 64 bits de uma imagem BGR ou em tons de cinza"""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # Mediana sem o termo DC, que só reflete o brilho médio
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+def phash_hex(image: np.ndarray) -> str:
+    return f"{phash(image):016x}"
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+class MultiIndexHash:
+    """Índice de hashes para busca por distância de Hamming até radius (multi-index hashing)
+
+    Divide os 64 bits em num_blocks blocos: pelo princípio da casa dos pombos, dois
+    hashes a distância <= radius estão a no máximo radius // num_blocks bits em pelo
+    menos um bloco. A busca sonda, em cada tabela, os valores de bloco vizinhos dentro
+    desse sub-raio e só verifica a distância completa dos candidatos.
+    """
+
+    def __init__(self, radius: int, num_blocks: int = 4):
+        if not 0 <= radius < HASH_BITS:
+            raise ValueError(f"Raio de Hamming inválido: {radius}")
+        self.radius = radius
+        bounds = np.linspace(0, HASH_BITS, num_blocks + 1).astype(int)
+        self._blocks = [(int(lo), (1 << int(hi - lo)) - 1) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in self._blocks]
+        # Máscaras de bits a inverter dentro de cada bloco, agrupadas por número de bits
+        # (0 = o próprio bloco, até radius // num_blocks)
+        sub_radius = radius // num_blocks
+        width = HASH_BITS // num_blocks
+        self._levels = [[sum(1 << b for b in bits) for bits in itertools.combinations(range(width), k)]
+                        for k in range(sub_radius + 1)]
+        self.hashes: List[int] = []
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, value: int) -> int:
+        """Insere um hash e retorna seu id"""
+        item_id = len(self.hashes)
+        self.hashes.append(value)
+        for table, (shift, mask) in zip(self._tables, self._blocks):
+            table.setdefault((value >> shift) & mask, []).append(item_id)
+        return item_id
+
+    def nearest(self, value: int) -> Tuple[int, int]:
+        """Retorna (id, distância) de um hash dentro do raio, ou (-1, -1)
+
+        As sondagens vão do bloco exato para vizinhos mais distantes; ao fim do primeiro
+        nível com algum candidato dentro do raio, devolve o mais próximo encontrado.
+        Duplicatas quase exatas são resolvidas logo no primeiro nível.
+        """
+        best_id, best_distance = -1, self.radius + 1
+        seen = set()
+        blocks = [(value >> shift) & mask for shift, mask in self._blocks]
+        for flips in self._levels:
+            for table, block in zip(self._tables, blocks):
+                for flip in flips:
+                    for item_id in table.get(block ^ flip, ()):
+                        if item_id in seen:
+                            continue
+                        seen.add(item_id)
+                        distance = hamming(value, self.hashes[item_id])
+                        if distance < best_distance:
+                            best_id, best_distance = item_id, distance
+                            if distance == 0:
+                                return best_id, 0
+            if best_id >= 0:
+                return best_id, best_distance
+        return -1, -1
+
+class Deduplicator:
+    """Agrupa frames quase duplicados (mesmo rótulo, hash a até radius bits) em fluxo
+
+    Cada frame entra no grupo do representante mais próximo ou cria um novo grupo;
+    apenas os representantes ficam no índice, então a busca não depende do número de
+    duplicatas. São mantidos até max_per_cluster frames por grupo, na ordem de chegada.
+    """
+
+    def __init__(self, radius: int = 6, max_per_cluster: int = 1):
+        self.radius = radius
+        self.max_per_cluster = max_per_cluster
+        self._indexes: Dict[str, MultiIndexHash] = {}
+        self._cluster_ids: Dict[str, List[int]] = {}
+        self.cluster_sizes: List[int] = []
+        self.kept = 0
+        self.total = 0
+
+    def add(self, record: Dict[str, Any]) -> bool:
+        """Atribui cluster_id ao registro e indica se ele deve ser mantido"""
+        self.total += 1
+        value = int(record['phash'], 16)
+        label = record['label']
+        if label not in self._indexes:
+            self._indexes[label] = MultiIndexHash(self.radius)
+            self._cluster_ids[label] = []
+        index = self._indexes[label]
+        cluster_ids = self._cluster_ids[label]
+
+        rep_id, _ = index.nearest(value)
+        if rep_id < 0:
+            index.add(value)
+            cluster_id = len(self.cluster_sizes)
+            cluster_ids.append(cluster_id)
+            self.cluster_sizes.append(0)
+        else:
+            cluster_id = cluster_ids[rep_id]
+
+        self.cluster_sizes[cluster_id] += 1
+        record['cluster_id'] = cluster_id
+        keep = self.cluster_sizes[cluster_id] <= self.max_per_cluster
+        self.kept += keep
+        return keep
+
+    def report(self) -> Dict[str, Any]:
+        removed = self.total - self.kept
+        return {
+            'radius': self.radius,
+            'max_per_cluster': self.max_per_cluster,
+            'frames': self.total,
+            'clusters': len(self.cluster_sizes),
+            'kept': self.kept,
+            'removed': removed,
+            'shrink_ratio': removed / self.total if self.total else 0.0,
+            'largest_cluster': max(self.cluster_sizes, default=0),
+        }
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# ml/distributed.py - Estratégias tf.distribute e papéis dos workers (TF_CONFIG)
+
+import os
+import json
+import shutil
+import tempfile
+from typing import TYPE_CHECKING, Any, Dict, Tuple
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+STRATEGIES = ('default', 'mirrored', 'multiworker')
+
+def tf_config() -> Dict[str, Any]:
+    """Conteúdo da variável TF_CONFIG ({'cluster': ..., 'task': ...}), ou {}"""
+    return json.loads(os.environ.get('TF_CONFIG') or '{}')
+
+def task_info() -> Tuple[str, int, int]:
+    """(tipo da tarefa, índice, número de workers do cluster) segundo o TF_CONFIG
+
+    Sem TF_CONFIG, o processo é o único worker (chief).
+    """
+    config = tf_config()
+    cluster = config.get('cluster', {})
+    task = config.get('task', {})
+    num_workers = len(cluster.get('chief', [])) + len(cluster.get('worker', []))
+    return task.get('type', 'chief'), int(task.get('index', 0)), max(1, num_workers)
+
+def is_chief() -> bool:
+    """O chief é a tarefa 'chief' ou, se o cluster não tiver uma, o worker 0"""
+    task_type, index, _ = task_info()
+    if task_type == 'chief':
+        return True
+    return task_type == 'worker' and index == 0 and 'chief' not in tf_config().get('cluster', {})
+
+def worker_shard() -> Tuple[int, int]:
+    """(número de partes, parte deste processo) para dividir os dados de treino entre workers"""
+    task_type, index, num_workers = task_info()
+    if 'chief' in tf_config().get('cluster', {}) and task_type == 'worker':
+        index += 1
+    return num_workers, index
+
+def create_strategy(name: str) -> 'tf.distribute.Strategy':
+    """Cria a estratégia pedida; deve ser chamada antes de qualquer outra operação do TensorFlow
+
+    mirrored replica o modelo entre os dispositivos locais; multiworker entre processos
+    e máquinas descritos no TF_CONFIG (comunicação coletiva por anel/gRPC em CPUs).
+    """
+    import tensorflow as tf
+    if name == 'default':
+        return tf.distribute.get_strategy()
+    if name == 'mirrored':
+        return tf.distribute.MirroredStrategy()
+    if name == 'multiworker':
+        if not tf_config():
+            print("Aviso: TF_CONFIG não definido; multiworker rodará com um único worker")
+        return tf.distribute.MultiWorkerMirroredStrategy()
+    raise ValueError(f"Estratégia inválida: {name}")
+
+def global_batch_size(per_replica_batch: int, strategy: 'tf.distribute.Strategy') -> int:
+    """Lote global de cada passo: o lote por réplica vezes o número de réplicas sincronizadas"""
+    return per_replica_batch * strategy.num_replicas_in_sync
+
+def worker_output_dir(output_dir: str) -> str:
+    """Diretório de gravação deste processo
+
+    Todos os workers precisam salvar checkpoints e modelos (as variáveis são lidas em
+    operações coletivas), mas só o chief grava em output_dir; os demais gravam em um
+    diretório temporário, removido por cleanup_output_dir.
+    """
+    if is_chief():
+        return output_dir
+    _, index, _ = task_info()
+    return tempfile.mkdtemp(prefix=f'safewatch_worker{index}_')
+
+def cleanup_output_dir(write_dir: str, output_dir: str):
+    if os.path.abspath(write_dir) != os.path.abspath(output_dir):
+        shutil.rmtree(write_dir, ignore_errors=True)
@@ -4,36 +4,63 @@
 
 import os
 import json
+import time
 import argparse
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 from datetime import datetime
 from pathlib import Path
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from sklearn.metrics import classification_report, confusion_matrix
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
-import cv2
+from prediction_cache import PredictionCache
+from pyramid import resolve_size_dir
+import acceleration
+import metrics_client
+import instrumentation
+import reporting
 
-def parse_arguments():
+# TensorFlow, sklearn, matplotlib e cv2 são importados nas funções que os usam
+
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description='Avalia modelo de detecção do SafeWatch')
     parser.add_argument('--model-path', type=str, required=True, help='Caminho do modelo treinado')
     parser.add_argument('--data-dir', type=str, default='data/processed/images_test', help='Diretório com dados de teste')
     parser.add_argument('--output-dir', type=str, default='evaluation', help='Diretório para salvar resultados')
     parser.add_argument('--batch-size', type=int, default=32, help='Tamanho do batch')
     parser.add_argument('--image-size', type=int, default=224, help='Tamanho das imagens')
+    parser.add_argument('--data-format', type=str, default='directory', choices=['directory', 'shards'],
+                        help='Formato do dataset (diretório de imagens ou shards .npy)')
+    parser.add_argument('--loader', type=str, default='keras', choices=['keras', 'tfdata'],
+                        help='Pipeline de entrada: ImageDataGenerator (keras) ou tf.data')
+    parser.add_argument('--tfdata-cache', type=str,
+                        help="Cache das imagens decodificadas no tf.data: 'memory' ou caminho em disco")
+    parser.add_argument('--cache-dir', type=str,
+                        help='Diretório do cache de predições (padrão: prediction_cache ao lado do modelo)')
+    parser.add_argument('--cache-max-mb', type=int, default=1024, help='Tamanho máximo do cache de predições (MB)')
+    parser.add_argument('--no-cache', action='store_true', help='Ignorar o cache de predições e refazer a inferência')
+    acceleration.add_arguments(parser)
+    parser.add_argument('--timeline', type=str,
+                        help='Arquivo JSON da linha do tempo da execução (padrão: <output-dir>/timeline.json)')
     parser.add_argument('--confusion-matrix', action='store_true', help='Gerar matriz de confusão')
     parser.add_argument('--examples', action='store_true', help='Gerar exemplos de predições')
     parser.add_argument('--supabase-url', type=str, help='URL do Supabase para registrar métricas')
     parser.add_argument('--supabase-key', type=str, help='Chave do Supabase para registrar métricas')
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
-def load_test_data(data_dir, batch_size, image_size):
+def load_test_data(data_dir, batch_size, image_size, data_format='directory', loader='keras', cache=None):
     """Carrega dados de teste"""
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+    from loaders import ShardSequence, make_tfdata_loader
     print(f"Carregando dados de teste de {data_dir}...")
     
+    if loader == 'tfdata':
+        test_generator = make_tfdata_loader(data_dir, batch_size, image_size, data_format,
+                                            training=False, cache=cache)
+        print(f"Classes encontradas: {test_generator.class_indices}")
+        return test_generator, test_generator.class_indices
+    
+    if data_format == 'shards':
+        test_generator = ShardSequence(data_dir, batch_size, image_size, shuffle=False)
+        print(f"Classes encontradas: {test_generator.class_indices}")
+        return test_generator, test_generator.class_indices
+    
     test_datagen = ImageDataGenerator(rescale=1./255)
     test_generator = test_datagen.flow_from_directory(
         data_dir,
@@ -48,15 +75,84 @@ def load_test_data(data_dir, batch_size, image_size):
     
     return test_generator, class_indices
 
-def evaluate_model(model, test_generator, class_indices, output_dir):
-    """Avalia o modelo e gera métricas"""
-    print("Avaliando modelo...")
+class ExampleReservoir:
+    """Amostragem por reservatório de exemplos corretos e incorretos de cada classe
+    
+    Alimentado lote a lote durante a predição; guarda no máximo num_examples imagens
+    (uint8) por classe e tipo, de modo que a memória não depende do tamanho do teste.
+    """
+    
+    def __init__(self, num_examples: int = 5, seed=None):
+        self.num_examples = num_examples
+        self._rng = np.random.default_rng(seed)
+        self.samples = {}  # (classe, correto) -> lista de (imagem, predição)
+        self.seen = {}
+    
+    def offer(self, images, y_true, y_pred):
+        for image, true, pred in zip(images, y_true, y_pred):
+            key = (int(true), bool(true == pred))
+            seen = self.seen.get(key, 0)
+            self.seen[key] = seen + 1
+            kept = self.samples.setdefault(key, [])
+            if seen < self.num_examples:
+                slot = len(kept)
+                kept.append(None)
+            else:
+                slot = self._rng.integers(seen + 1)
+                if slot >= self.num_examples:
+                    continue
+            # Copiar só a imagem escolhida, já convertida de volta para 0-255
+            kept[slot] = (np.clip(image * 255, 0, 255).astype(np.uint8), int(pred))
+
+def predict_test_set(model, test_generator, reservoir=None, steps_per_execution: int = 1) -> np.ndarray:
+    """Roda o modelo sobre o conjunto de teste em uma passada, alimentando o reservatório de exemplos
+    
+    Com steps_per_execution > 1 a predição usa model.predict, que agrupa vários lotes
+    por chamada ao grafo; os exemplos são então escolhidos em uma segunda passada.
+    """
+    from loaders import iterate_batches, model_input
+    start = time.perf_counter()
+    if steps_per_execution > 1:
+        y_pred_prob = np.asarray(model.predict(model_input(test_generator), steps=len(test_generator)))
+        print(f"Predição: {len(test_generator) / (time.perf_counter() - start):.2f} passos/s")
+        if reservoir is not None:
+            fill_reservoir(test_generator, y_pred_prob, reservoir)
+        return y_pred_prob
+
+    y_pred_prob = []
+    steps = 0
+    for x, y in iterate_batches(test_generator):
+        prob = np.asarray(model.predict_on_batch(x))
+        y_pred_prob.append(prob)
+        if reservoir is not None:
+            reservoir.offer(x, np.argmax(y, axis=1), np.argmax(prob, axis=1))
+        steps += 1
+        if steps >= len(test_generator):
+            break
+    print(f"Predição: {steps / (time.perf_counter() - start):.2f} passos/s")
+    return np.concatenate(y_pred_prob)
+
+def fill_reservoir(test_generator, y_pred_prob, reservoir):
+    """Escolhe exemplos a partir de predições já conhecidas (só decodifica as imagens)"""
+    from loaders import iterate_batches
+    row = 0
+    for steps, (x, y) in enumerate(iterate_batches(test_generator), 1):
+        reservoir.offer(x, np.argmax(y, axis=1), np.argmax(y_pred_prob[row:row + len(x)], axis=1))
+        row += len(x)
+        if steps >= len(test_generator):
+            break
+
+def evaluate_model(model, test_generator, class_indices, output_dir, model_name, reservoir=None, y_pred_prob=None):
+    """Avalia o modelo e gera métricas
     
-    # Inverter mapeamento de classes
-    class_labels = {v: k for k, v in class_indices.items()}
+    Se reservoir for dado, os exemplos são escolhidos na mesma passada da predição.
+    y_pred_prob permite reaproveitar predições já calculadas (ex.: do cache).
+    """
+    print("Avaliando modelo...")
     
     # Gerar predições
-    y_pred_prob = model.predict(test_generator)
+    if y_pred_prob is None:
+        y_pred_prob = predict_test_set(model, test_generator, reservoir)
     y_pred = np.argmax(y_pred_prob, axis=1)
     
     # Obter rótulos reais
@@ -68,57 +164,18 @@ def evaluate_model(model, test_generator, class_indices, output_dir):
     y_true = y_true[:samples_count]
     
     # Calcular métricas
-    accuracy = accuracy_score(y_true, y_pred)
-    precision = precision_score(y_true, y_pred, average='weighted')
-    recall = recall_score(y_true, y_pred, average='weighted')
-    f1 = f1_score(y_true, y_pred, average='weighted')
-    
-    print(f"Accuracy: {accuracy:.4f}")
-    print(f"Precision: {precision:.4f}")
-    print(f"Recall: {recall:.4f}")
-    print(f"F1 Score: {f1:.4f}")
-    
-    # Relatório completo
-    class_names = list(class_indices.keys())
-    report = classification_report(y_true, y_pred, target_names=class_names, output_dict=True)
-    print(classification_report(y_true, y_pred, target_names=class_names))
-    
-    # Matriz de confusão
-    cm = confusion_matrix(y_true, y_pred)
+    metrics = reporting.classification_metrics(y_true, y_pred, class_indices, model_name, detailed=True)
+    metrics['evaluation_date'] = datetime.now().isoformat()
     
     # Criar diretório de saída se não existir
     os.makedirs(output_dir, exist_ok=True)
     
     # Plotar matriz de confusão
-    plt.figure(figsize=(10, 8))
-    plt.imshow(cm, interpolation='nearest', cmap=plt.cm.Blues)
-    plt.title('Matriz de Confusão')
-    plt.colorbar()
-    tick_marks = np.arange(len(class_indices))
-    plt.xticks(tick_marks, [class_labels[i] for i in range(len(class_labels))], rotation=45)
-    plt.yticks(tick_marks, [class_labels[i] for i in range(len(class_labels))])
-    plt.tight_layout()
-    plt.ylabel('Rótulo Verdadeiro')
-    plt.xlabel('Rótulo Predito')
     cm_path = os.path.join(output_dir, "confusion_matrix.png")
-    plt.savefig(cm_path)
+    reporting.plot_confusion_matrix(metrics['confusion_matrix'], class_indices, cm_path)
     print(f"Matriz de confusão salva em {cm_path}")
     
     # Salvar métricas em JSON
-    model_name = os.path.basename(args.model_path).split('.')[0]
-    metrics = {
-        'model_name': model_name,
-        'accuracy': float(accuracy),
-        'precision': float(precision),
-        'recall': float(recall),
-        'f1_score': float(f1),
-        'class_report': report,
-        'confusion_matrix': cm.tolist(),
-        'evaluation_date': datetime.now().isoformat(),
-        'number_of_classes': len(class_indices),
-        'classes': class_names,
-    }
-    
     metrics_path = os.path.join(output_dir, "evaluation_metrics.json")
     with open(metrics_path, 'w') as f:
         json.dump(metrics, f, indent=2)
@@ -126,31 +183,14 @@ def evaluate_model(model, test_generator, class_indices, output_dir):
     
     return metrics, y_pred, y_pred_prob, y_true
 
-def generate_examples(model, test_generator, class_indices, y_pred, output_dir, num_examples=5):
-    """Gera exemplos visuais de predições corretas e incorretas"""
+def generate_examples(reservoir, class_indices, output_dir):
+    """Salva os exemplos de predições corretas e incorretas escolhidos durante a avaliação"""
+    import cv2
     print("Gerando exemplos de predições...")
     
     # Inverter mapeamento de classes
     class_labels = {v: k for k, v in class_indices.items()}
     
-    # Obter dados originais
-    images = []
-    labels = []
-    
-    # Resetar o gerador e obter imagens e rótulos
-    test_generator.reset()
-    for i in range(min(len(test_generator), int(np.ceil(test_generator.samples / test_generator.batch_size)))):
-        batch = test_generator.next()
-        images.extend(batch[0])
-        labels.extend(np.argmax(batch[1], axis=1))
-        if len(images) >= test_generator.samples:
-            break
-    
-    # Limitar ao número correto de amostras
-    images = images[:test_generator.samples]
-    labels = labels[:test_generator.samples]
-    
-    # Encontrar exemplos corretos e incorretos para cada classe
     os.makedirs(os.path.join(output_dir, "examples"), exist_ok=True)
     
     for class_idx, class_name in class_labels.items():
@@ -160,125 +200,86 @@ def generate_examples(model, test_generator, class_indices, y_pred, output_dir,
         os.makedirs(correct_dir, exist_ok=True)
         os.makedirs(incorrect_dir, exist_ok=True)
         
-        # Índices para esta classe
-        class_indices = np.where(np.array(labels) == class_idx)[0]
-        
-        # Encontrar predições corretas e incorretas
-        correct_indices = [i for i in class_indices if y_pred[i] == class_idx]
-        incorrect_indices = [i for i in class_indices if y_pred[i] != class_idx]
-        
-        # Salvar exemplos corretos
-        for i, idx in enumerate(np.random.choice(correct_indices, size=min(num_examples, len(correct_indices)), replace=False)):
-            img = images[idx]
-            # Converter de volta para 0-255 e BGR
-            img = (img * 255).astype(np.uint8)
-            if img.shape[2] == 3:  # RGB para BGR
-                img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-            cv2.imwrite(os.path.join(correct_dir, f"correct_{i}.jpg"), img)
+        # Salvar exemplos corretos (RGB para BGR)
+        for i, (img, _) in enumerate(reservoir.samples.get((class_idx, True), [])):
+            cv2.imwrite(os.path.join(correct_dir, f"correct_{i}.jpg"), cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
         
         # Salvar exemplos incorretos
-        for i, idx in enumerate(np.random.choice(incorrect_indices, size=min(num_examples, len(incorrect_indices)), replace=False)):
-            img = images[idx]
-            img = (img * 255).astype(np.uint8)
-            if img.shape[2] == 3:
-                img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-            predicted = class_labels[y_pred[idx]]
-            cv2.imwrite(os.path.join(incorrect_dir, f"incorrect_{i}_pred_{predicted}.jpg"), img)
+        for i, (img, pred) in enumerate(reservoir.samples.get((class_idx, False), [])):
+            predicted = class_labels[pred]
+            cv2.imwrite(os.path.join(incorrect_dir, f"incorrect_{i}_pred_{predicted}.jpg"),
+                        cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
     
     print(f"Exemplos salvos em {os.path.join(output_dir, 'examples')}")
 
-def register_metrics_to_supabase(supabase_url, supabase_key, metrics):
-    """Registra métricas da avaliação no Supabase"""
-    if not supabase_url or not supabase_key:
-        print("Aviso: URL ou chave do Supabase não fornecidos, métricas não serão registradas.")
-        return
-    
-    import requests
-    
-    # Preparar dados para inserção ou atualização
-    data = {
-        'model_name': metrics['model_name'],
-        'version': datetime.now().strftime("%Y%m%d_%H%M%S"),
-        'accuracy': metrics['accuracy'],
-        'precision': metrics['precision'],
-        'recall': metrics['recall'],
-        'f1_score': metrics['f1_score'],
-        'parameters': {
-            'classes': metrics['classes'],
-            'number_of_classes': metrics['number_of_classes'],
-            'evaluation_date': metrics['evaluation_date']
-        }
-    }
-    
-    # Enviar dados para Supabase
-    try:
-        # Verificar se já existe registro para este modelo
-        response = requests.get(
-            f"{supabase_url}/rest/v1/model_metrics",
-            params={'select': 'id', 'model_name': f'eq.{metrics["model_name"]}'},
-            headers={
-                'apikey': supabase_key,
-                'Authorization': f'Bearer {supabase_key}'
-            }
-        )
-        
-        if response.status_code == 200 and response.json():
-            # Atualizar registro existente
-            model_id = response.json()[0]['id']
-            update_response = requests.patch(
-                f"{supabase_url}/rest/v1/model_metrics?id=eq.{model_id}",
-                json=data,
-                headers={
-                    'apikey': supabase_key,
-                    'Authorization': f'Bearer {supabase_key}',
-                    'Content-Type': 'application/json',
-                    'Prefer': 'return=representation'
-                }
-            )
-            if update_response.status_code == 200:
-                print("Métricas de avaliação atualizadas com sucesso no Supabase.")
-            else:
-                print(f"Erro ao atualizar métricas: {update_response.status_code} - {update_response.text}")
-        else:
-            # Criar novo registro
-            insert_response = requests.post(
-                f"{supabase_url}/rest/v1/model_metrics",
-                json=data,
-                headers={
-                    'apikey': supabase_key,
-                    'Authorization': f'Bearer {supabase_key}',
-                    'Content-Type': 'application/json',
-                    'Prefer': 'return=representation'
-                }
-            )
-            if insert_response.status_code == 201:
-                print("Métricas de avaliação registradas com sucesso no Supabase.")
-            else:
-                print(f"Erro ao registrar métricas: {insert_response.status_code} - {insert_response.text}")
-    
-    except Exception as e:
-        print(f"Erro ao conectar ao Supabase: {e}")
-
-def main():
-    global args
-    args = parse_arguments()
-    
-    # Carregar modelo
-    print(f"Carregando modelo de {args.model_path}...")
-    model = load_model(args.model_path)
+def main(argv=None):
+    args = parse_arguments(argv)
+    instrumentation.start_run('evaluate')
+    acceleration.configure(args)
+    # Com várias resoluções preparadas (--extra-sizes), usar a de --image-size
+    args.data_dir = resolve_size_dir(args.data_dir, args.image_size)
     
     # Carregar dados de teste
-    test_generator, class_indices = load_test_data(args.data_dir, args.batch_size, args.image_size)
-    
-    # Avaliar modelo
-    metrics, y_pred, y_pred_prob, y_true = evaluate_model(model, test_generator, class_indices, args.output_dir)
+    with instrumentation.stage('evaluate/load_data'):
+        test_generator, class_indices = load_test_data(args.data_dir, args.batch_size, args.image_size,
+                                                     args.data_format, args.loader, args.tfdata_cache)
+    reservoir = ExampleReservoir() if args.examples else None
+    
+    # Predições em cache para o mesmo modelo, dataset e pré-processamento
+    cache, cache_key, cached = None, None, None
+    if not args.no_cache:
+        cache = PredictionCache(args.cache_dir or os.path.join(os.path.dirname(os.path.abspath(args.model_path)),
+                                                               'prediction_cache'),
+                                args.cache_max_mb * 1024 * 1024)
+        with instrumentation.stage('evaluate/cache_lookup'):
+            cache_key = cache.key(args.model_path, args.data_dir, {
+                'image_size': args.image_size, 'data_format': args.data_format,
+                'loader': args.loader, 'rescale': 1 / 255, 'class_indices': class_indices,
+                **({'precision': args.mixed_precision} if args.mixed_precision != 'float32' else {}),
+            })
+            cached = cache.load(cache_key)
+        instrumentation.count('evaluate/cache_hits', int(cached is not None))
+    
+    model, y_pred_prob = None, None
+    if cached is not None and len(cached['probabilities']) == test_generator.samples:
+        print(f"Usando predições em cache ({cache_key})")
+        y_pred_prob = cached['probabilities']
+        if reservoir is not None:
+            with instrumentation.stage('evaluate/select_examples'):
+                fill_reservoir(test_generator, y_pred_prob, reservoir)
+    else:
+        # Carregar modelo
+        print(f"Carregando modelo de {args.model_path}...")
+        from tensorflow.keras.models import load_model
+        with instrumentation.stage('evaluate/load_model'):
+            model = acceleration.prepare_for_inference(load_model(args.model_path), args)
+        with instrumentation.stage('evaluate/predict', samples=test_generator.samples,
+                                   **acceleration.describe(args)):
+            y_pred_prob = predict_test_set(model, test_generator, reservoir, args.steps_per_execution)
+        if cache is not None:
+            with instrumentation.stage('evaluate/cache_store'):
+                cache.store(cache_key, y_pred_prob, test_generator.classes, test_generator.filenames)
+    
+    # Avaliar modelo (exemplos, se solicitados, são escolhidos na mesma passada)
+    with instrumentation.stage('evaluate/metrics'):
+        model_name = os.path.basename(args.model_path).split('.')[0]
+        metrics, y_pred, y_pred_prob, y_true = evaluate_model(model, test_generator, class_indices, args.output_dir,
+                                                              model_name, reservoir, y_pred_prob)
     
     # Gerar exemplos se solicitado
     if args.examples:
-        generate_examples(model, test_generator, class_indices, y_pred, args.output_dir)
+        with instrumentation.stage('evaluate/examples'):
+            generate_examples(reservoir, class_indices, args.output_dir)
     
     # Registrar métricas no Supabase
-    register_metrics_to_supabase(args.supabase_url, args.supabase_key, metrics)
+    with instrumentation.stage('evaluate/supabase'):
+        reporting.register_metrics_to_supabase(args.supabase_url, args.supabase_key, metrics,
+                                               spool_dir=os.path.join(args.output_dir, 'metrics_spool'))
+    
+    instrumentation.timeline.print_summary()
+    instrumentation.timeline.save(args.timeline or os.path.join(args.output_dir, 'timeline.json'))
+    # Espera (com limite) o envio das métricas; o que faltar fica no spool, junto dos artefatos
+    metrics_client.close_all()
     
     print("Avaliação concluída!")
 
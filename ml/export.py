@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# ml/export.py - Exportação quantizada (TFLite/ONNX) com relatório de latência e acurácia
+
+import os
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from typing import List, Optional, Dict, Any, Callable
+from loaders import iterate_batches, list_image_directory
+from reporting import classification_metrics
+from shards import ShardReader
+
+TFLITE_VARIANTS = ('dynamic', 'float16', 'int8')
+
+def representative_images(train_dir: str, data_format: str, image_size: int,
+                          num_samples: int = 200, seed: int = 42) -> np.ndarray:
+    """Amostra aleatória de imagens de treino (float32 em [0, 1]) para calibrar o int8"""
+    rng = np.random.default_rng(seed)
+    if data_format == 'shards':
+        reader = ShardReader(train_dir)
+        indices = np.sort(rng.choice(reader.samples, size=min(num_samples, reader.samples), replace=False))
+        return reader.get_images(indices).astype(np.float32) / 255.0
+
+    filepaths, _, _ = list_image_directory(train_dir)
+    chosen = rng.choice(len(filepaths), size=min(num_samples, len(filepaths)), replace=False)
+    images = []
+    for i in chosen:
+        image = tf.io.decode_image(tf.io.read_file(filepaths[i]), channels=3, expand_animations=False)
+        images.append(tf.image.resize(image, (image_size, image_size), method='nearest').numpy())
+    return np.stack(images).astype(np.float32) / 255.0
+
+def convert_tflite(model: tf.keras.Model, variant: str, calibration: Optional[np.ndarray] = None) -> bytes:
+    """Converte o modelo para TFLite com quantização dinâmica, float16 ou int8 completa
+
+    No int8 os pesos e ativações são inteiros; entrada e saída continuam float32 para
+    manter o mesmo pré-processamento dos outros modelos.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == 'int8':
+        if calibration is None or not len(calibration):
+            raise ValueError("Quantização int8 exige imagens de calibração")
+        converter.representative_dataset = lambda: ([image[np.newaxis]] for image in calibration)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    elif variant != 'dynamic':
+        raise ValueError(f"Variante TFLite inválida: {variant}")
+    return converter.convert()
+
+class TFLitePredictor:
+    """Interpretador TFLite com a interface predict_on_batch dos modelos Keras"""
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads or os.cpu_count())
+        self._input = self.interpreter.get_input_details()[0]['index']
+        self._output = self.interpreter.get_output_details()[0]['index']
+        self._batch = None
+
+    def predict_on_batch(self, x: np.ndarray) -> np.ndarray:
+        if self._batch != len(x):
+            self.interpreter.resize_tensor_input(self._input, [len(x), *x.shape[1:]])
+            self.interpreter.allocate_tensors()
+            self._batch = len(x)
+        self.interpreter.set_tensor(self._input, np.ascontiguousarray(x, dtype=np.float32))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output)
+
+class ONNXPredictor:
+    """Sessão onnxruntime (CPU) com a interface predict_on_batch"""
+
+    def __init__(self, model_path: str):
+        import onnxruntime as ort
+        self.session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        self._input = self.session.get_inputs()[0].name
+
+    def predict_on_batch(self, x: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self._input: np.asarray(x, dtype=np.float32)})[0]
+
+def export_onnx(model: tf.keras.Model, path: str) -> bool:
+    """Exporta para ONNX se tf2onnx estiver instalado; retorna se exportou"""
+    try:
+        import tf2onnx
+    except ImportError:
+        print("Aviso: tf2onnx não instalado, exportação ONNX ignorada.")
+        return False
+    spec = (tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=path)
+    return True
+
+def benchmark(predict: Callable[[np.ndarray], np.ndarray], sample: np.ndarray, batch_size: int,
+              runs: int = 50, warmup: int = 5) -> Dict[str, float]:
+    """Latência de um frame (p50/p95 em ms) e vazão em lotes (frames/s) na CPU"""
+    frame = sample[:1]
+    for _ in range(warmup):
+        predict(frame)
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        predict(frame)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    batch = np.resize(sample, (batch_size, *sample.shape[1:]))
+    predict(batch)
+    batch_runs = max(1, runs // 10)
+    start = time.perf_counter()
+    for _ in range(batch_runs):
+        predict(batch)
+    elapsed = time.perf_counter() - start
+
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return {'latency_ms_p50': float(p50), 'latency_ms_p95': float(p95),
+            'batch_frames_per_sec': batch_size * batch_runs / elapsed}
+
+def score(predictor, val_generator, name: str) -> Dict[str, float]:
+    """Métricas do evaluate_model (reporting.classification_metrics) sobre o conjunto de validação"""
+    y_true, y_pred = [], []
+    for steps, (x, y) in enumerate(iterate_batches(val_generator), 1):
+        y_pred.append(np.argmax(predictor.predict_on_batch(x), axis=1))
+        y_true.append(np.argmax(y, axis=1))
+        if steps >= len(val_generator):
+            break
+    metrics = classification_metrics(np.concatenate(y_true), np.concatenate(y_pred),
+                                      val_generator.class_indices, name)
+    return {key: metrics[key] for key in ('accuracy', 'precision', 'recall', 'f1_score')}
+
+def export_variants(model: tf.keras.Model, output_dir: str, model_name: str, val_generator,
+                    calibration: np.ndarray, variants: List[str], accuracy_budget: float = 0.01,
+                    batch_size: int = 32) -> Dict[str, Any]:
+    """Exporta, mede e pontua cada variante e recomenda a mais rápida dentro do orçamento de acurácia
+
+    O modelo Keras float32 é a referência; uma variante é aceita se sua acurácia cair no
+    máximo accuracy_budget em relação a ela. O relatório é salvo em
+    {model_name}_export_report.json.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    sample = calibration[:batch_size]
+
+    results = {}
+    print("Medindo modelo de referência (float32)...")
+    results['float32'] = {'path': os.path.join(output_dir, f"{model_name}_final.h5"),
+                          **benchmark(model.predict_on_batch, sample, batch_size),
+                          **score(model, val_generator, model_name)}
+
+    for variant in variants:
+        if variant == 'onnx':
+            path = os.path.join(output_dir, f"{model_name}.onnx")
+            if not export_onnx(model, path):
+                continue
+            try:
+                predictor = ONNXPredictor(path)
+            except ImportError:
+                print("Aviso: onnxruntime não instalado, modelo ONNX exportado sem medição.")
+                results[variant] = {'path': path, 'size_bytes': os.path.getsize(path)}
+                continue
+        else:
+            print(f"Convertendo para TFLite ({variant})...")
+            path = os.path.join(output_dir, f"{model_name}_{variant}.tflite")
+            with open(path, 'wb') as f:
+                f.write(convert_tflite(model, variant, calibration if variant == 'int8' else None))
+            predictor = TFLitePredictor(path)
+        results[variant] = {'path': path, 'size_bytes': os.path.getsize(path),
+                            **benchmark(predictor.predict_on_batch, sample, batch_size),
+                            **score(predictor, val_generator, f"{model_name}_{variant}")}
+
+    # Mais rápida (vazão em lote) entre as que respeitam o orçamento de acurácia
+    baseline = results['float32']['accuracy']
+    eligible = [name for name, r in results.items()
+                if 'accuracy' in r and r['accuracy'] >= baseline - accuracy_budget]
+    recommended = max(eligible, key=lambda name: results[name]['batch_frames_per_sec'])
+
+    print(f"{'Variante':<10} {'Acurácia':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} {'frames/s':>9}")
+    for name, r in results.items():
+        if 'accuracy' in r:
+            print(f"{name:<10} {r['accuracy']:>9.4f} {r['latency_ms_p50']:>9.2f} "
+                  f"{r['latency_ms_p95']:>9.2f} {r['batch_frames_per_sec']:>9.1f}")
+    print(f"Variante recomendada (orçamento de acurácia {accuracy_budget}): {recommended}")
+
+    report = {'model_name': model_name, 'accuracy_budget': accuracy_budget, 'batch_size': batch_size,
+              'calibration_samples': len(calibration), 'recommended': recommended, 'variants': results}
+    with open(os.path.join(output_dir, f"{model_name}_export_report.json"), 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
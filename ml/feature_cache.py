@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# ml/feature_cache.py - Cache de embeddings do backbone congelado para treinar só a cabeça
+
+import os
+import json
+import hashlib
+import numpy as np
+import tensorflow as tf
+from typing import Optional, Tuple, List, Dict, Any
+from tqdm import tqdm
+from loaders import iterate_batches
+from pyramid import dataset_manifest
+from shards import INDEX_FILENAME
+
+def _content_files(loader) -> List[str]:
+    """Arquivos de onde o loader lê os pixels: as imagens ou, em shards, os arquivos dos shards"""
+    directory = getattr(loader, 'directory', None)
+    if directory is None:
+        return []
+    if os.path.exists(os.path.join(directory, INDEX_FILENAME)):
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+    return [os.path.join(directory, filename) for filename in sorted(loader.filenames)]
+
+def preprocessing_params(loader) -> Dict[str, Any]:
+    """Parâmetros que mudam os pixels vistos pelo backbone: os do data_prep e os do loader"""
+    manifest = dataset_manifest(loader.directory) if getattr(loader, 'directory', None) else None
+    generator = getattr(loader, 'image_data_generator', None)
+    return {
+        'loader': type(loader).__name__,
+        'interpolation': getattr(loader, 'interpolation', None),
+        'rescale': getattr(generator, 'rescale', None),
+        'prep': (manifest or {}).get('params'),
+    }
+
+def dataset_fingerprint(loader) -> str:
+    """Identifica o conjunto de dados independente da ordem de leitura
+
+    Combina arquivos e rótulos, tamanho e mtime de cada arquivo lido (uma imagem
+    reprocessada com o mesmo nome muda a impressão digital) e os parâmetros de
+    pré-processamento.
+    """
+    h = hashlib.sha256()
+    for filename, label in sorted(zip(loader.filenames, (int(c) for c in loader.classes))):
+        h.update(f"{filename}\t{label}\n".encode())
+    h.update(json.dumps(sorted(loader.class_indices.items())).encode())
+    for path in _content_files(loader):
+        st = os.stat(path)
+        h.update(f"{os.path.basename(path)}\t{st.st_size}\t{st.st_mtime_ns}\n".encode())
+    h.update(json.dumps(preprocessing_params(loader), sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+class FeatureStore:
+    """Armazena embeddings agrupados (pooling) do backbone em arrays .npy mapeados em memória
+
+    Organizado por backbone, pesos e tamanho de imagem; cada conjunto guarda
+    features.npy (N x D float32), labels.npy e meta.json com a impressão digital dos
+    dados. Como só depende do backbone, o cache é reaproveitado entre execuções e
+    mudanças de hiperparâmetros da cabeça.
+    """
+
+    def __init__(self, root: str, backbone: str, image_size: int, weights: Optional[str] = 'imagenet',
+                 precision: str = 'float32'):
+        # Features calculadas em precisão mista ficam separadas das calculadas em float32
+        suffix = '' if precision == 'float32' else f'_{precision}'
+        self.dir = os.path.join(root, f"{backbone}_{weights or 'random'}_{image_size}{suffix}")
+
+    def _paths(self, split: str):
+        split_dir = os.path.join(self.dir, split)
+        return (split_dir, os.path.join(split_dir, 'features.npy'),
+                os.path.join(split_dir, 'labels.npy'), os.path.join(split_dir, 'meta.json'))
+
+    def load(self, split: str, fingerprint: str, passes: int, augmented: bool) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Retorna (features, rótulos) se o cache corresponder aos dados e ao número de passadas"""
+        _, features_path, labels_path, meta_path = self._paths(split)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get('fingerprint') != fingerprint or meta.get('passes') != passes or meta.get('augmented') != augmented:
+            return None
+        return np.load(features_path, mmap_mode='r'), np.load(labels_path)
+
+    def build(self, split: str, extractor: tf.keras.Model, loader, fingerprint: str,
+              passes: int = 1, augmented: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Roda o backbone sobre o loader (passes vezes) e grava as features"""
+        split_dir, features_path, labels_path, meta_path = self._paths(split)
+        os.makedirs(split_dir, exist_ok=True)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        dim = extractor.output_shape[-1]
+        total = loader.samples * passes
+        features = np.lib.format.open_memmap(features_path, mode='w+', dtype=np.float32, shape=(total, dim))
+        labels = np.empty(total, dtype=np.int32)
+
+        row = 0
+        with tqdm(total=total, desc=f"Extraindo features ({split})") as progress:
+            for _ in range(passes):
+                for x, y in iterate_batches(loader):
+                    n = len(x)
+                    features[row:row + n] = extractor.predict_on_batch(x)
+                    labels[row:row + n] = np.argmax(y, axis=1)
+                    row += n
+                    progress.update(n)
+                if hasattr(loader, 'on_epoch_end'):
+                    loader.on_epoch_end()
+
+        features.flush()
+        del features
+        np.save(labels_path, labels[:row])
+        # meta.json por último: sua presença marca o cache como completo
+        with open(meta_path, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'passes': passes, 'augmented': augmented,
+                       'dim': dim, 'samples': row}, f, indent=2)
+        return np.load(features_path, mmap_mode='r')[:row], labels[:row]
+
+    def get_or_build(self, split: str, extractor: tf.keras.Model, loader, passes: int = 1,
+                     augmented: bool = False, refresh: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        fingerprint = dataset_fingerprint(loader)
+        cached = None if refresh else self.load(split, fingerprint, passes, augmented)
+        if cached is not None:
+            print(f"Usando features em cache de {os.path.join(self.dir, split)}")
+            return cached
+        return self.build(split, extractor, loader, fingerprint, passes, augmented)
+
+class FeatureSequence(tf.keras.utils.Sequence):
+    """Sequence Keras sobre features em cache, com a interface dos geradores de imagens"""
+
+    def __init__(self, features: np.ndarray, labels: np.ndarray, class_indices, batch_size: int,
+                 shuffle: bool = False, seed: Optional[int] = None):
+        super().__init__()
+        self.features = features
+        self.labels = labels
+        self.class_indices = class_indices
+        self.num_classes = len(class_indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.samples = len(labels)
+        self._rng = np.random.default_rng(seed)
+        self.on_epoch_end()
+
+    @property
+    def classes(self) -> np.ndarray:
+        return self.labels[self.order]
+
+    def __len__(self):
+        return int(np.ceil(self.samples / self.batch_size))
+
+    def __getitem__(self, idx):
+        # Índices ordenados dentro do lote para leituras sequenciais no mmap
+        indices = np.sort(self.order[idx * self.batch_size:(idx + 1) * self.batch_size])
+        x = np.asarray(self.features[indices], dtype=np.float32)
+        y = tf.keras.utils.to_categorical(self.labels[indices], self.num_classes)
+        return x, y
+
+    def on_epoch_end(self):
+        self.order = self._rng.permutation(self.samples) if self.shuffle else np.arange(self.samples)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# ml/image_decode.py - Decodificação de imagens em resolução reduzida e redimensionamento
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import cv2
+from PIL import Image
+from typing import Dict, Any, List, Optional, Tuple
+
+DECODE_MODES = ('full', 'reduced')
+RESIZE_MODES = ('stretch', 'letterbox', 'crop')
+
+# Fatores de redução suportados pelo decodificador JPEG (escala DCT), do maior para o menor
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+def image_header(path: str) -> Tuple[int, int, Optional[str]]:
+    """Largura, altura e formato (ex.: 'JPEG') lidos apenas do cabeçalho do arquivo"""
+    with Image.open(path) as image:
+        width, height = image.size
+        return width, height, image.format
+
+def _covers(width: int, height: int, image_size: int, resize_mode: str) -> bool:
+    """Indica se uma imagem width x height ainda tem pixels suficientes para a saída"""
+    if resize_mode == 'letterbox':
+        # O lado maior é o que ocupa image_size pixels na saída
+        return max(width, height) >= image_size
+    return min(width, height) >= image_size
+
+def reduction_factor(width: int, height: int, image_size: int, resize_mode: str = 'stretch') -> int:
+    """Maior fator de redução da decodificação (8, 4, 2 ou 1) que ainda cobre a saída"""
+    for factor, _ in _REDUCED_FLAGS:
+        # O libjpeg arredonda para cima as dimensões reduzidas
+        if _covers(-(-width // factor), -(-height // factor), image_size, resize_mode):
+            return factor
+    return 1
+
+def interpolation_for(decode: str) -> int:
+    """Interpolação do redimensionamento final de cada caminho de decodificação
+
+    O caminho completo mantém a interpolação padrão do cv2.resize (compatível com os
+    datasets já gerados); o reduzido termina com INTER_AREA, adequada para reduções.
+    """
+    return cv2.INTER_AREA if decode == 'reduced' else cv2.INTER_LINEAR
+
+def decode_image(path: str, image_size: int, decode: str = 'full',
+                 resize_mode: str = 'stretch') -> Optional[np.ndarray]:
+    """Lê uma imagem BGR; None se não puder ser lida
+
+    Com decode='reduced', JPEGs são decodificados direto em 1/2, 1/4 ou 1/8 da
+    resolução (o maior fator que ainda cobre image_size), sem descomprimir os
+    pixels descartados depois pelo redimensionamento. Outros formatos e arquivos
+    com cabeçalho ilegível são decodificados por completo.
+    """
+    flag = cv2.IMREAD_COLOR
+    if decode == 'reduced':
+        try:
+            width, height, fmt = image_header(path)
+        except (OSError, ValueError):
+            fmt = None
+        if fmt == 'JPEG':
+            factor = reduction_factor(width, height, image_size, resize_mode)
+            flag = dict(_REDUCED_FLAGS).get(factor, cv2.IMREAD_COLOR)
+    return cv2.imread(path, flag)
+
+def resize_image(image: np.ndarray, image_size: int, resize_mode: str = 'stretch',
+                 interpolation: int = cv2.INTER_LINEAR) -> np.ndarray:
+    """Redimensiona para image_size x image_size
+
+    stretch distorce a proporção; crop recorta o quadrado central antes de
+    redimensionar; letterbox preserva a imagem inteira e completa com preto.
+    """
+    height, width = image.shape[:2]
+    if resize_mode == 'crop':
+        side = min(width, height)
+        top, left = (height - side) // 2, (width - side) // 2
+        image = image[top:top + side, left:left + side]
+    elif resize_mode == 'letterbox':
+        scale = image_size / max(width, height)
+        new_width = max(1, min(image_size, round(width * scale)))
+        new_height = max(1, min(image_size, round(height * scale)))
+        image = cv2.resize(image, (new_width, new_height), interpolation=interpolation)
+        top = (image_size - new_height) // 2
+        left = (image_size - new_width) // 2
+        return cv2.copyMakeBorder(image, top, image_size - new_height - top, left, image_size - new_width - left,
+                                  cv2.BORDER_CONSTANT, value=0)
+    elif resize_mode != 'stretch':
+        raise ValueError(f"Modo de redimensionamento não suportado: {resize_mode}")
+    if image.shape[:2] == (image_size, image_size):
+        return image
+    return cv2.resize(image, (image_size, image_size), interpolation=interpolation)
+
+def load_image(path: str, image_size: int, decode: str = 'full',
+               resize_mode: str = 'stretch') -> Optional[np.ndarray]:
+    """Decodifica e redimensiona uma imagem pelo caminho pedido; None se não puder ser lida"""
+    image = decode_image(path, image_size, decode, resize_mode)
+    if image is None:
+        return None
+    return resize_image(image, image_size, resize_mode, interpolation_for(decode))
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    """Relação sinal-ruído de pico (dB) entre duas imagens uint8; inf se forem idênticas"""
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+def compare_decode_paths(paths: List[str], image_size: int, resize_mode: str = 'stretch') -> Dict[str, Any]:
+    """Mede imagens/s de cada caminho de decodificação e a qualidade de cada um
+
+    A qualidade é o PSNR em relação à referência de maior fidelidade (decodificação
+    completa + INTER_AREA), além do PSNR entre os dois caminhos.
+    """
+    outputs: Dict[str, List[np.ndarray]] = {}
+    report: Dict[str, Any] = {'images': 0, 'image_size': image_size, 'resize_mode': resize_mode}
+    for decode in DECODE_MODES:
+        images = []
+        start = time.perf_counter()
+        for path in paths:
+            image = load_image(path, image_size, decode, resize_mode)
+            if image is not None:
+                images.append(image)
+        elapsed = time.perf_counter() - start
+        outputs[decode] = images
+        report[f'{decode}_images_per_sec'] = len(images) / elapsed if elapsed > 0 else 0.0
+
+    reference = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is not None:
+            reference.append(resize_image(image, image_size, resize_mode, cv2.INTER_AREA))
+    report['images'] = len(reference)
+    if not reference:
+        return report
+
+    def summary(values: List[float]) -> Dict[str, float]:
+        finite = [v for v in values if np.isfinite(v)] or [float('inf')]
+        return {'mean_db': float(np.mean(finite)), 'min_db': float(np.min(finite))}
+
+    for decode in DECODE_MODES:
+        report[f'{decode}_psnr_vs_reference'] = summary([psnr(a, b) for a, b in zip(outputs[decode], reference)])
+    report['reduced_psnr_vs_full'] = summary([psnr(a, b) for a, b in zip(outputs['reduced'], outputs['full'])])
+    report['speedup'] = report['reduced_images_per_sec'] / report['full_images_per_sec'] \
+        if report['full_images_per_sec'] else 0.0
+    return report
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Compara a decodificação completa e a reduzida no conjunto de teste do data_prep')
+    parser.add_argument('--input-dir', type=str, default='data/raw', help='Diretório com as imagens brutas')
+    parser.add_argument('--metadata', type=str, default='data/processed/metadata/test_metadata.parquet',
+                        help='Metadados do conjunto de teste (define quais imagens brutas são medidas)')
+    parser.add_argument('--image-size', type=int, default=224, help='Tamanho de redimensionamento')
+    parser.add_argument('--resize-mode', type=str, default='stretch', choices=RESIZE_MODES,
+                        help='Modo de redimensionamento')
+    parser.add_argument('--max-images', type=int, default=1000, help='Máximo de imagens medidas')
+    parser.add_argument('--output', type=str, help='Arquivo JSON do relatório')
+    return parser.parse_args()
+
+def main():
+    from metadata_io import iter_metadata
+
+    args = parse_arguments()
+    paths = []
+    for df in iter_metadata(args.metadata, columns=['filename']):
+        for filename in df['filename']:
+            path = os.path.join(args.input_dir, filename)
+            # Frames extraídos de vídeo não têm arquivo bruto correspondente
+            if os.path.exists(path):
+                paths.append(path)
+        if len(paths) >= args.max_images:
+            break
+    paths = paths[:args.max_images]
+    if not paths:
+        print(f"Erro: nenhuma imagem de {args.metadata} encontrada em {args.input_dir}")
+        sys.exit(1)
+
+    report = compare_decode_paths(paths, args.image_size, args.resize_mode)
+    print(f"Imagens medidas: {report['images']}")
+    for decode in DECODE_MODES:
+        quality = report[f'{decode}_psnr_vs_reference']
+        print(f"{decode:<8} {report[f'{decode}_images_per_sec']:>9.1f} imagens/s  "
+              f"PSNR médio {quality['mean_db']:.2f} dB (mín. {quality['min_db']:.2f} dB)")
+    print(f"Aceleração da decodificação reduzida: {report['speedup']:.2f}x; "
+          f"PSNR reduzida x completa: {report['reduced_psnr_vs_full']['mean_db']:.2f} dB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Relatório salvo em {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# ml/infer.py - Inferência em lote de modelos do SafeWatch sobre arquivos de frames
+
+import os
+import re
+import json
+import time
+import argparse
+import numpy as np
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Iterator, Tuple, Set
+from tqdm import tqdm
+from shards import ShardReader, is_shard_dir
+from image_decode import DECODE_MODES, RESIZE_MODES, load_image
+
+# TensorFlow e pandas são importados nas funções que os usam
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Executa um modelo do SafeWatch sobre um acervo de frames')
+    parser.add_argument('--model-path', type=str, required=True, help='Modelo treinado (*_final.h5 ou *_final_tf)')
+    parser.add_argument('--source', type=str, required=True,
+                        help='Diretório de imagens, arquivo .txt com um caminho por linha ou diretório de shards')
+    parser.add_argument('--output', type=str, required=True,
+                        help='Arquivo de resultados (.csv) ou diretório de partes Parquet (.parquet)')
+    parser.add_argument('--batch-size', type=int, default=64, help='Tamanho do batch')
+    parser.add_argument('--image-size', type=int, default=224, help='Tamanho das imagens')
+    parser.add_argument('--workers', type=int, default=8, help='Threads de decodificação')
+    parser.add_argument('--decode', type=str, default='full', choices=DECODE_MODES,
+                        help='Caminho de decodificação; use o mesmo do data_prep que gerou o dataset de treino')
+    parser.add_argument('--resize-mode', type=str, default='stretch', choices=RESIZE_MODES,
+                        help='Redimensionamento; use o mesmo do data_prep que gerou o dataset de treino')
+    parser.add_argument('--class-names', type=str,
+                        help='Classes separadas por vírgula (padrão: *_metrics.json do treinamento)')
+    parser.add_argument('--flush-every', type=int, default=5000, help='Linhas por gravação incremental')
+    parser.add_argument('--overwrite', action='store_true', help='Descartar resultados existentes em vez de retomar')
+    return parser.parse_args(argv)
+
+def resolve_class_names(model_path: str, class_names: Optional[str], num_classes: int) -> List[str]:
+    """Nomes das classes: argumento, metrics.json salvo pelo train.py ou índices"""
+    if class_names:
+        names = [name.strip() for name in class_names.split(',')]
+    else:
+        prefix = re.sub(r'_final(_tf)?(\.h5)?/?$', '', model_path.rstrip('/'))
+        metrics_path = f"{prefix}_metrics.json"
+        names = None
+        if os.path.exists(metrics_path):
+            with open(metrics_path, 'r') as f:
+                names = json.load(f).get('classes')
+        if not names:
+            print("Aviso: nomes das classes não encontrados; usando índices.")
+            names = [str(i) for i in range(num_classes)]
+    if len(names) != num_classes:
+        raise ValueError(f"O modelo tem {num_classes} saídas, mas foram dadas {len(names)} classes")
+    return names
+
+def list_source(source: str) -> List[str]:
+    """Lista os identificadores das imagens na ordem de processamento"""
+    from loaders import IMAGE_EXTENSIONS
+    if is_shard_dir(source):
+        return ShardReader(source).filenames()
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS))
+        return paths
+    with open(source, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def decode_image(path: str, image_size: int, decode: str = 'full',
+                 resize_mode: str = 'stretch') -> Optional[np.ndarray]:
+    """Lê uma imagem como RGB float32 em [0, 1] no tamanho do modelo; None se não puder ser lida
+
+    Decodifica e redimensiona como o data_prep (image_decode.load_image), para que os
+    frames brutos cheguem ao modelo como as imagens de treino.
+    """
+    image = load_image(path, image_size, decode, resize_mode)
+    if image is None:
+        return None
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0
+
+class ResultWriter:
+    """Grava resultados incrementalmente em CSV (append) ou em partes Parquet
+
+    Em Parquet, output é um diretório com part-NNNNN.parquet; cada parte é gravada em
+    arquivo temporário e renomeada, então uma interrupção não deixa partes corrompidas.
+    """
+
+    def __init__(self, output: str, flush_every: int = 5000, overwrite: bool = False):
+        self.output = output
+        self.parquet = output.endswith('.parquet')
+        self.flush_every = flush_every
+        self._rows = []
+        if overwrite:
+            self._remove()
+        if self.parquet:
+            os.makedirs(output, exist_ok=True)
+            parts = [f for f in os.listdir(output) if f.startswith('part-') and f.endswith('.parquet')]
+            self._next_part = len(parts)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    def _remove(self):
+        if self.parquet and os.path.isdir(self.output):
+            for f in os.listdir(self.output):
+                os.remove(os.path.join(self.output, f))
+        elif os.path.exists(self.output):
+            os.remove(self.output)
+
+    def done(self) -> Set[str]:
+        """Imagens já registradas em execuções anteriores"""
+        import pandas as pd
+        if self.parquet:
+            parts = sorted(f for f in os.listdir(self.output) if f.startswith('part-') and f.endswith('.parquet'))
+            return {name for f in parts
+                    for name in pd.read_parquet(os.path.join(self.output, f), columns=['path'])['path']}
+        if not os.path.exists(self.output):
+            return set()
+        done = set()
+        for df in pd.read_csv(self.output, usecols=['path'], chunksize=100000):
+            done.update(df['path'])
+        return done
+
+    def write(self, rows: List[dict]):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        import pandas as pd
+        df = pd.DataFrame(self._rows)
+        if self.parquet:
+            path = os.path.join(self.output, f"part-{self._next_part:05d}.parquet")
+            df.to_parquet(f"{path}.tmp", index=False)
+            os.replace(f"{path}.tmp", path)
+            self._next_part += 1
+        else:
+            header = not os.path.exists(self.output) or os.path.getsize(self.output) == 0
+            with open(self.output, 'a', newline='') as f:
+                df.to_csv(f, header=header, index=False)
+                f.flush()
+                os.fsync(f.fileno())
+        self._rows = []
+
+def iter_batches(source: str, items: List[str], image_size: int, batch_size: int, workers: int,
+                 decode: str = 'full', resize_mode: str = 'stretch') -> Iterator[Tuple[List[str], np.ndarray, List[str]]]:
+    """Produz (ids, imagens, ids ilegíveis) por lote, decodificando o próximo lote em paralelo"""
+    if is_shard_dir(source):
+        reader = ShardReader(source)
+        if reader.image_size != image_size:
+            raise ValueError(f"Shards em {source} têm tamanho {reader.image_size}, mas --image-size é {image_size}")
+        positions = {name: i for i, name in enumerate(reader.filenames())}
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            indices = np.array([positions[name] for name in batch], dtype=np.int64)
+            # Índices ordenados para leitura sequencial do mmap
+            order = np.argsort(indices)
+            images = np.empty((len(batch), image_size, image_size, 3), dtype=np.float32)
+            images[order] = reader.get_images(indices[order]) / 255.0
+            yield batch, images, []
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(start):
+            batch = items[start:start + batch_size]
+            return batch, [executor.submit(decode_image, path, image_size, decode, resize_mode) for path in batch]
+
+        starts = range(0, len(items), batch_size)
+        pending = submit(starts[0]) if starts else None
+        for i in range(len(starts)):
+            batch, futures = pending
+            # Enfileirar o próximo lote enquanto o modelo processa este
+            pending = submit(starts[i + 1]) if i + 1 < len(starts) else None
+            decoded = [f.result() for f in futures]
+            ok = [name for name, image in zip(batch, decoded) if image is not None]
+            failed = [name for name, image in zip(batch, decoded) if image is None]
+            images = np.stack([image for image in decoded if image is not None]) if ok else \
+                np.empty((0, image_size, image_size, 3), dtype=np.float32)
+            yield ok, images, failed
+
+def run_inference(model, source: str, items: List[str], class_names: List[str], writer: ResultWriter,
+                  image_size: int, batch_size: int, workers: int, decode: str = 'full',
+                  resize_mode: str = 'stretch') -> dict:
+    """Pontua as imagens e grava os resultados; retorna estatísticas de vazão e latência"""
+    latencies = []
+    frames = 0
+    failed = 0
+    start = time.perf_counter()
+    with tqdm(total=len(items), desc="Inferência") as progress:
+        for names, images, unreadable in iter_batches(source, items, image_size, batch_size, workers,
+                                                      decode, resize_mode):
+            for name in unreadable:
+                progress.write(f"Erro ao ler {name}")
+            failed += len(unreadable)
+            if len(names):
+                t0 = time.perf_counter()
+                probs = np.asarray(model.predict_on_batch(images))
+                latencies.append(time.perf_counter() - t0)
+                preds = np.argmax(probs, axis=1)
+                rows = []
+                for name, pred, prob in zip(names, preds, probs):
+                    row = {'path': name, 'prediction': class_names[pred], 'confidence': float(prob[pred])}
+                    row.update({f"prob_{c}": float(p) for c, p in zip(class_names, prob)})
+                    rows.append(row)
+                writer.write(rows)
+                frames += len(names)
+            progress.update(len(names) + len(unreadable))
+    writer.flush()
+    elapsed = time.perf_counter() - start
+
+    stats = {'frames': frames, 'failed': failed, 'seconds': elapsed,
+             'frames_per_sec': frames / elapsed if elapsed > 0 else 0.0}
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        stats.update({'batch_latency_ms_p50': float(p50), 'batch_latency_ms_p95': float(p95),
+                      'batch_latency_ms_p99': float(p99)})
+    return stats
+
+def main(argv=None):
+    args = parse_arguments(argv)
+
+    # Listar imagens e descartar as já pontuadas (retomada)
+    items = list_source(args.source)
+    writer = ResultWriter(args.output, args.flush_every, args.overwrite)
+    done = writer.done()
+    if done:
+        print(f"Retomando: {len(done)} imagens já pontuadas em {args.output}")
+        items = [item for item in items if item not in done]
+    print(f"{len(items)} imagens para pontuar")
+    if not items:
+        return
+
+    # Carregar modelo
+    print(f"Carregando modelo de {args.model_path}...")
+    from tensorflow.keras.models import load_model
+    model = load_model(args.model_path)
+    class_names = resolve_class_names(args.model_path, args.class_names, model.output_shape[-1])
+
+    stats = run_inference(model, args.source, items, class_names, writer,
+                          args.image_size, args.batch_size, args.workers, args.decode, args.resize_mode)
+
+    print(f"Frames pontuados: {stats['frames']} ({stats['failed']} com erro de leitura)")
+    print(f"Vazão: {stats['frames_per_sec']:.2f} frames/s")
+    if 'batch_latency_ms_p50' in stats:
+        print(f"Latência por batch: p50 {stats['batch_latency_ms_p50']:.1f} ms, "
+              f"p95 {stats['batch_latency_ms_p95']:.1f} ms, p99 {stats['batch_latency_ms_p99']:.1f} ms")
+    print(f"Resultados salvos em {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# ml/instrumentation.py - Temporizadores, contadores e linha do tempo por execução
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Optional, List
+
+class Timeline:
+    """Coleta a duração de cada etapa de uma execução e grava uma linha do tempo em JSON
+
+    stage() registra um evento (início relativo, duração, atributos) e acumula as
+    estatísticas da etapa; add() só acumula, para medições finas e numerosas (ex.:
+    decodificação por imagem) ou feitas em outros processos. Seguro entre threads.
+    """
+
+    def __init__(self, run: str = '', max_events: int = 100000):
+        self.run = run
+        self.max_events = max_events
+        self.started_at = datetime.now().isoformat()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, float] = {}
+        self.events: List[Dict[str, Any]] = []
+        self.dropped_events = 0
+
+    def add(self, name: str, seconds: float, count: int = 1):
+        """Acumula count ocorrências da etapa name com duração total seconds"""
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = {'count': 0, 'total_s': 0.0, 'min_s': float('inf'), 'max_s': 0.0}
+            per_item = seconds / count if count else 0.0
+            stats['count'] += count
+            stats['total_s'] += seconds
+            stats['min_s'] = min(stats['min_s'], per_item)
+            stats['max_s'] = max(stats['max_s'], per_item)
+
+    def merge(self, timings: Dict[str, List[float]]):
+        """Incorpora durações acumuladas fora do processo ({etapa: [total_s, count]})"""
+        for name, (seconds, count) in timings.items():
+            if count:
+                self.add(name, seconds, int(count))
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def event(self, name: str, start: float, duration: float, count: int = 1, **attrs):
+        """Registra um evento já medido (start em perf_counter) e acumula sua duração
+        
+        count > 1 indica que o evento cobre várias ocorrências da etapa (ex.: um bloco
+        de passos com steps_per_execution); as estatísticas são por ocorrência.
+        """
+        self.add(name, duration, count)
+        with self._lock:
+            if len(self.events) >= self.max_events:
+                self.dropped_events += 1
+                return
+            self.events.append({'name': name, 'start_s': round(start - self._t0, 6),
+                                'duration_s': round(duration, 6), 'thread': threading.current_thread().name,
+                                **attrs})
+
+    @contextmanager
+    def stage(self, name: str, **attrs):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.event(name, start, time.perf_counter() - start, **attrs)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: dict(stats, mean_s=stats['total_s'] / stats['count'] if stats['count'] else 0.0)
+                    for name, stats in self.stages.items()}
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        data = {
+            'run': self.run,
+            'started_at': self.started_at,
+            'duration_s': time.perf_counter() - self._t0,
+            'stages': self.summary(),
+            'counters': dict(self.counters),
+            'events': list(self.events),
+            'dropped_events': self.dropped_events,
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+        print(f"Linha do tempo salva em {path}")
+
+    def print_summary(self):
+        print(f"{'Etapa':<28} {'N':>8} {'Total (s)':>10} {'Média (ms)':>11}")
+        for name, stats in sorted(self.summary().items(), key=lambda item: -item[1]['total_s']):
+            print(f"{name:<28} {stats['count']:>8} {stats['total_s']:>10.2f} {stats['mean_s'] * 1000:>11.2f}")
+
+class Stopwatch:
+    """Acumulador leve de durações para uso dentro de workers ({etapa: [total_s, count]})"""
+
+    def __init__(self):
+        self.timings: Dict[str, List[float]] = {}
+
+    @contextmanager
+    def time(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.timings.setdefault(name, [0.0, 0])
+            entry[0] += time.perf_counter() - start
+            entry[1] += 1
+
+# Linha do tempo da execução atual, compartilhada pelos módulos do pipeline
+timeline = Timeline()
+
+def start_run(run: str) -> Timeline:
+    """Reinicia a linha do tempo global para uma nova execução"""
+    global timeline
+    timeline = Timeline(run)
+    return timeline
+
+def stage(name: str, **attrs):
+    return timeline.stage(name, **attrs)
+
+def count(name: str, value: float = 1):
+    timeline.count(name, value)
+
+def get_timeline() -> Timeline:
+    return timeline
+
+def make_step_timer(tl: Optional[Timeline] = None):
+    """Callback Keras que registra o tempo de parede de cada passo de treino e de cada época
+
+    O intervalo entre o fim de um passo e o início do seguinte (callbacks, laço do
+    Keras) é acumulado em train/between_steps. Com steps_per_execution > 1 cada
+    chamada cobre um bloco de passos e a duração é dividida entre eles.
+    """
+    import tensorflow as tf
+
+    class StepTimer(tf.keras.callbacks.Callback):
+        def _timeline(self) -> Timeline:
+            return tl or timeline
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self._epoch = epoch
+            self._last_batch = -1
+            self._epoch_start = self._last_end = time.perf_counter()
+
+        def on_train_batch_begin(self, batch, logs=None):
+            self._batch_start = time.perf_counter()
+            self._timeline().add('train/between_steps', self._batch_start - self._last_end)
+
+        def on_train_batch_end(self, batch, logs=None):
+            self._last_end = time.perf_counter()
+            steps = max(1, batch - self._last_batch)
+            self._last_batch = batch
+            self._timeline().event('train/step', self._batch_start, self._last_end - self._batch_start,
+                                   count=steps, epoch=self._epoch, step=batch)
+
+        def on_epoch_end(self, epoch, logs=None):
+            self._timeline().event('train/epoch', self._epoch_start, time.perf_counter() - self._epoch_start,
+                                   epoch=epoch)
+
+    return StepTimer()
+
+def make_profiler_callback(log_dir: str, start_step: int, end_step: int):
+    """Callback Keras que captura um trace do profiler do TensorBoard entre dois passos da 1ª época
+
+    Usa tf.profiler diretamente, sem gravar sumários de métricas; o trace pode ser
+    aberto na aba Profile do TensorBoard (input pipeline, tempo de cada op). Com
+    steps_per_execution > 1 o trace começa no primeiro bloco que alcança start_step.
+    """
+    import tensorflow as tf
+
+    class ProfilerWindow(tf.keras.callbacks.Callback):
+        def __init__(self):
+            super().__init__()
+            self._active = False
+            self._done = False
+
+        def on_train_begin(self, logs=None):
+            steps = self.params.get('steps')
+            if steps and start_step >= steps:
+                self._warn(steps)
+
+        def on_train_batch_begin(self, batch, logs=None):
+            # Com steps_per_execution > 1 os hooks só veem o início de cada bloco de passos
+            if not self._done and not self._active and batch >= start_step:
+                tf.profiler.experimental.start(log_dir)
+                self._active = True
+
+        def on_train_batch_end(self, batch, logs=None):
+            if self._active and batch >= end_step:
+                self._stop()
+
+        def on_epoch_end(self, epoch, logs=None):
+            if self._active:
+                self._stop()
+            elif not self._done:
+                self._warn(self.params.get('steps'))
+            self._done = True
+
+        def on_train_end(self, logs=None):
+            if self._active:
+                self._stop()
+
+        def _warn(self, steps):
+            if not self._done:
+                print(f"Aviso: --profile-steps {start_step},{end_step} fica além da 1ª época "
+                      f"({steps} passos); nenhum trace será capturado")
+                self._done = True
+
+        def _stop(self):
+            tf.profiler.experimental.stop()
+            self._active = False
+            self._done = True
+            print(f"Trace do profiler salvo em {log_dir}")
+
+    return ProfilerWindow()
+
+def timed_loader(loader, name: str = 'train/input_batch'):
+    """Envolve um loader no formato Sequence para medir o tempo de produção de cada lote
+
+    Comparado a train/step, indica se o treino está limitado pela entrada. Loaders
+    tf.data são devolvidos sem alteração (use --profile para analisá-los).
+    """
+    if hasattr(loader, 'dataset'):
+        return loader
+    import tensorflow as tf
+
+    class TimedSequence(tf.keras.utils.Sequence):
+        def __init__(self, inner):
+            super().__init__()
+            self._inner = inner
+
+        def __getattr__(self, attr):
+            if attr.startswith('__') or attr == '_inner':
+                raise AttributeError(attr)
+            return getattr(self._inner, attr)
+
+        def __len__(self):
+            return len(self._inner)
+
+        def __getitem__(self, idx):
+            start = time.perf_counter()
+            batch = self._inner[idx]
+            timeline.add(name, time.perf_counter() - start)
+            return batch
+
+        def on_epoch_end(self):
+            if hasattr(self._inner, 'on_epoch_end'):
+                self._inner.on_epoch_end()
+
+    return TimedSequence(loader)
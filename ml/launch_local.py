@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# ml/launch_local.py - Lança vários workers de treino na máquina local com TF_CONFIG
+
+import os
+import sys
+import json
+import socket
+import argparse
+import threading
+import subprocess
+from typing import List
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Executa um script (ex.: train.py --strategy multiworker --loader tfdata) em N workers '
+                    'de CPU em localhost, cada um com seu TF_CONFIG',
+        usage='%(prog)s [--num-workers N] [--keep-gpus] -- script.py [argumentos do script]')
+    parser.add_argument('--num-workers', type=int, default=2, help='Número de processos worker')
+    parser.add_argument('--keep-gpus', action='store_true',
+                        help='Não esconder as GPUs dos workers (por padrão rodam só em CPU)')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='Script e seus argumentos')
+    args = parser.parse_args()
+    if args.command and args.command[0] == '--':
+        args.command = args.command[1:]
+    if not args.command:
+        parser.error('informe o script a executar após --')
+    return args
+
+def free_ports(count: int) -> List[int]:
+    """Reserva portas livres em localhost (liberadas logo antes de iniciar os workers)"""
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('localhost', 0))
+        sockets.append(sock)
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+def _relay(process: subprocess.Popen, prefix: str):
+    """Repassa a saída de um worker, linha a linha, com o prefixo do worker"""
+    for line in iter(process.stdout.readline, ''):
+        sys.stdout.write(f"{prefix} {line}")
+        sys.stdout.flush()
+
+def main():
+    args = parse_arguments()
+    cluster = {'worker': [f'localhost:{port}' for port in free_ports(args.num_workers)]}
+    print(f"Cluster local: {', '.join(cluster['worker'])}")
+
+    processes, relays = [], []
+    for index in range(args.num_workers):
+        env = dict(os.environ, TF_CONFIG=json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}}))
+        if not args.keep_gpus:
+            env['CUDA_VISIBLE_DEVICES'] = '-1'
+        process = subprocess.Popen([sys.executable, *args.command], env=env, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, text=True, bufsize=1)
+        relay = threading.Thread(target=_relay, args=(process, f'[worker {index}]'), daemon=True)
+        relay.start()
+        processes.append(process)
+        relays.append(relay)
+
+    try:
+        codes = [process.wait() for process in processes]
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        codes = [process.wait() for process in processes]
+    for relay in relays:
+        relay.join()
+
+    failed = [i for i, code in enumerate(codes) if code != 0]
+    if failed:
+        print(f"Erro: workers com falha: {', '.join(map(str, failed))}")
+        sys.exit(1)
+    print(f"{args.num_workers} workers concluídos")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# ml/loaders.py - Carregadores de dados para treinamento e avaliação do SafeWatch
+
+import os
+import math
+import numpy as np
+import tensorflow as tf
+from typing import Callable, Optional, Dict, List, Tuple
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+from shards import ShardReader
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+# Parâmetros de aumentação compartilhados pelo ImageDataGenerator e pelo pipeline tf.data
+AUGMENTATION = {
+    'rotation_range': 20,
+    'width_shift_range': 0.2,
+    'height_shift_range': 0.2,
+    'shear_range': 0.2,
+    'zoom_range': 0.2,
+    'horizontal_flip': True,
+}
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.tif', '.tiff')
+
+class ShardSequence(tf.keras.utils.Sequence):
+    """Sequence Keras sobre um dataset em shards, com a mesma interface usada dos geradores
+
+    Expõe classes, class_indices, samples e batch_size como o DirectoryIterator do
+    flow_from_directory. A aumentação, quando pedida, usa o próprio ImageDataGenerator
+    para manter a mesma semântica do formato em diretórios.
+    """
+
+    def __init__(self, shard_dir: str, batch_size: int, image_size: int, shuffle: bool = False,
+                 augmenter: Optional[ImageDataGenerator] = None, seed: Optional[int] = None):
+        super().__init__()
+        self.reader = ShardReader(shard_dir)
+        self.directory = shard_dir
+        if self.reader.image_size != image_size:
+            raise ValueError(f"Shards em {shard_dir} têm tamanho {self.reader.image_size}, "
+                             f"mas --image-size é {image_size}")
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.augmenter = augmenter
+        self.class_indices = self.reader.class_indices
+        self.samples = self.reader.samples
+        self.num_classes = len(self.class_indices)
+        self._rng = np.random.default_rng(seed)
+        self._batch_index = 0
+        self.on_epoch_end()
+
+    @property
+    def classes(self) -> np.ndarray:
+        """Rótulos na ordem de iteração da época atual"""
+        return self.reader.labels[self.order]
+
+    @property
+    def filenames(self):
+        names = self.reader.filenames()
+        return [names[i] for i in self.order]
+
+    def __len__(self):
+        return int(np.ceil(self.samples / self.batch_size))
+
+    def __getitem__(self, idx):
+        indices = self.order[idx * self.batch_size:(idx + 1) * self.batch_size]
+        images = self.reader.get_images(indices).astype(np.float32)
+        if self.augmenter is not None:
+            for i in range(len(images)):
+                images[i] = self.augmenter.standardize(self.augmenter.random_transform(images[i]))
+        else:
+            images /= 255.0
+        labels = tf.keras.utils.to_categorical(self.reader.labels[indices], self.num_classes)
+        return images, labels
+
+    def on_epoch_end(self):
+        self.order = self.reader.epoch_order(self._rng if self.shuffle else None)
+
+    def reset(self):
+        self._batch_index = 0
+
+    def next(self):
+        batch = self[self._batch_index % len(self)]
+        self._batch_index += 1
+        return batch
+
+def model_input(loader):
+    """Retorna o objeto a ser passado para fit/predict (tf.data.Dataset ou Sequence)"""
+    return getattr(loader, 'dataset', loader)
+
+def list_image_directory(data_dir: str) -> Tuple[List[str], np.ndarray, Dict[str, int]]:
+    """Lista imagens por classe na mesma ordem usada pelo flow_from_directory"""
+    class_names = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    class_indices = {name: i for i, name in enumerate(class_names)}
+    filepaths, labels = [], []
+    for name in class_names:
+        for root, _, files in sorted(os.walk(os.path.join(data_dir, name))):
+            for file in sorted(files):
+                if file.lower().endswith(IMAGE_EXTENSIONS):
+                    filepaths.append(os.path.join(root, file))
+                    labels.append(class_indices[name])
+    return filepaths, np.array(labels, dtype=np.int32), class_indices
+
+def affine_matrix(theta, tx, ty, shear, zx, zy, image_size: int) -> tf.Tensor:
+    """Matriz afim do apply_affine_transform do Keras (coordenadas x=coluna, y=linha)
+
+    Ângulos em graus; compõe rotação, deslocamento, cisalhamento e zoom nessa ordem
+    em torno do centro da imagem, como transform_matrix_offset_center.
+    """
+    theta = tf.cast(theta, tf.float32) * math.pi / 180
+    shear = tf.cast(shear, tf.float32) * math.pi / 180
+    tx, ty, zx, zy = (tf.cast(v, tf.float32) for v in (tx, ty, zx, zy))
+    zero, one = tf.constant(0.0), tf.constant(1.0)
+
+    rotation = tf.stack([[tf.cos(theta), -tf.sin(theta), zero],
+                         [tf.sin(theta), tf.cos(theta), zero],
+                         [zero, zero, one]])
+    shift = tf.stack([[one, zero, tx], [zero, one, ty], [zero, zero, one]])
+    shear_m = tf.stack([[one, -tf.sin(shear), zero], [zero, tf.cos(shear), zero], [zero, zero, one]])
+    zoom_m = tf.stack([[zx, zero, zero], [zero, zy, zero], [zero, zero, one]])
+    matrix = rotation @ shift @ shear_m @ zoom_m
+
+    center = tf.cast(image_size, tf.float32) / 2 - 0.5
+    offset = tf.stack([[one, zero, center], [zero, one, center], [zero, zero, one]])
+    reset = tf.stack([[one, zero, -center], [zero, one, -center], [zero, zero, one]])
+    return offset @ matrix @ reset
+
+def apply_affine(image: tf.Tensor, matrix: tf.Tensor, image_size: int) -> tf.Tensor:
+    """Aplica a matriz afim (saída -> entrada) com interpolação bilinear e borda 'nearest'"""
+    m = matrix
+    transform = tf.stack([m[0, 0], m[0, 1], m[0, 2], m[1, 0], m[1, 1], m[1, 2], 0.0, 0.0])
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=image[tf.newaxis], transforms=transform[tf.newaxis],
+        output_shape=tf.constant([image_size, image_size]), fill_value=0.0,
+        interpolation='BILINEAR', fill_mode='NEAREST')[0]
+
+def augment_image(image: tf.Tensor, image_size: int) -> tf.Tensor:
+    """Aplica a aumentação do treinamento a uma imagem float32 (H x W x 3)
+
+    Sorteia os parâmetros como ImageDataGenerator.random_transform com AUGMENTATION.
+    """
+    size = tf.cast(image_size, tf.float32)
+    uniform = lambda r: tf.random.uniform([], -r, r)
+    zoom = tf.random.uniform([2], 1 - AUGMENTATION['zoom_range'], 1 + AUGMENTATION['zoom_range'])
+    matrix = affine_matrix(uniform(AUGMENTATION['rotation_range']),
+                           uniform(AUGMENTATION['height_shift_range']) * size,
+                           uniform(AUGMENTATION['width_shift_range']) * size,
+                           uniform(AUGMENTATION['shear_range']),
+                           zoom[0], zoom[1], image_size)
+    image = apply_affine(image, matrix, image_size)
+    if AUGMENTATION['horizontal_flip']:
+        image = tf.cond(tf.random.uniform([]) < 0.5, lambda: tf.image.flip_left_right(image), lambda: image)
+    return image
+
+class TFDataLoader:
+    """Pipeline tf.data com a mesma interface dos geradores Keras usados no projeto
+
+    shuffled indica que a ordem dos exemplos muda a cada iteração (embaralhamento e
+    map não determinístico), e portanto não pode ser reproduzida numa retomada.
+    steps_per_epoch só é definido para datasets distribuídos (sem cardinalidade), e
+    deve ser passado ao fit.
+    """
+
+    def __init__(self, dataset: tf.data.Dataset, classes: np.ndarray, class_indices: Dict[str, int],
+                 batch_size: int, filenames: List[str], shuffled: bool = False, directory: Optional[str] = None,
+                 steps_per_epoch: Optional[int] = None):
+        self.dataset = dataset
+        self.steps_per_epoch = steps_per_epoch
+        self.directory = directory
+        self.shuffled = shuffled
+        self.classes = classes
+        self.class_indices = class_indices
+        self.samples = len(classes)
+        self.batch_size = batch_size
+        self.filenames = filenames
+        self._iterator = None
+
+    def __len__(self):
+        if self.steps_per_epoch is not None:
+            return self.steps_per_epoch
+        return int(np.ceil(self.samples / self.batch_size))
+
+    def reset(self):
+        self._iterator = None
+
+    def next(self):
+        if self._iterator is None:
+            self._iterator = iter(self.dataset)
+        x, y = next(self._iterator)
+        return x.numpy(), y.numpy()
+
+def make_tfdata_loader(data_dir: str, batch_size: int, image_size: int, data_format: str = 'directory',
+                       training: bool = False, cache: Optional[str] = None,
+                       shuffle_buffer: int = 10000, seed: Optional[int] = None,
+                       num_shards: int = 1, shard_index: int = 0) -> TFDataLoader:
+    """Cria um TFDataLoader com decodificação/aumentação paralelas (AUTOTUNE) e prefetch
+
+    cache pode ser 'memory' para manter as imagens decodificadas em memória ou um
+    caminho de arquivo para cache em disco. Sem training a ordem é determinística.
+    Com num_shards > 1 o loader lê só a parte shard_index dos exemplos (antes de
+    decodificar), todas com o mesmo tamanho para que os workers deem o mesmo número
+    de passos; o autoshard do tf.distribute fica desligado.
+    """
+    if data_format == 'shards':
+        reader = ShardReader(data_dir)
+        if reader.image_size != image_size:
+            raise ValueError(f"Shards em {data_dir} têm tamanho {reader.image_size}, mas --image-size é {image_size}")
+        rng = np.random.default_rng(seed)
+        selected = np.arange(reader.samples)
+        if num_shards > 1:
+            selected = selected[shard_index::num_shards][:reader.samples // num_shards]
+        
+        def generate():
+            # Os shards ficam em mmap; cada época percorre shards em ordem (ou embaralhados)
+            order = reader.epoch_order(rng if training and cache is None else None)
+            if num_shards > 1:
+                order = order[np.isin(order, selected)]
+            for start in range(0, len(order), 256):
+                indices = order[start:start + 256]
+                for image, label in zip(reader.get_images(indices), reader.labels[indices]):
+                    yield image, label
+        
+        dataset = tf.data.Dataset.from_generator(generate, output_signature=(
+            tf.TensorSpec((image_size, image_size, 3), tf.uint8), tf.TensorSpec((), tf.int32)))
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(len(selected)))
+        classes, class_indices = reader.labels[selected], reader.class_indices
+        filenames = reader.filenames()
+        if num_shards > 1:
+            filenames = [filenames[i] for i in selected]
+    else:
+        filepaths, classes, class_indices = list_image_directory(data_dir)
+        if num_shards > 1:
+            per_shard = len(filepaths) // num_shards
+            filepaths = filepaths[shard_index::num_shards][:per_shard]
+            classes = classes[shard_index::num_shards][:per_shard]
+        filenames = [os.path.relpath(p, data_dir) for p in filepaths]
+        dataset = tf.data.Dataset.from_tensor_slices((filepaths, classes))
+        if training and cache is None:
+            # Sem cache, embaralhar os caminhos é barato e cobre todo o conjunto
+            dataset = dataset.shuffle(len(filepaths), seed=seed, reshuffle_each_iteration=True)
+        
+        def decode(path, label):
+            image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+            image = tf.image.resize(image, (image_size, image_size), method='nearest')
+            image.set_shape((image_size, image_size, 3))
+            return image, label
+        
+        dataset = dataset.map(decode, num_parallel_calls=AUTOTUNE, deterministic=not training)
+    
+    if cache == 'memory':
+        dataset = dataset.cache()
+    elif cache:
+        os.makedirs(os.path.dirname(os.path.abspath(cache)), exist_ok=True)
+        dataset = dataset.cache(cache)
+    if training and cache:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    
+    num_classes = len(class_indices)
+    
+    def prepare(image, label):
+        image = tf.cast(image, tf.float32)
+        if training:
+            image = augment_image(image, image_size)
+        return image / 255.0, tf.one_hot(label, num_classes)
+    
+    dataset = dataset.map(prepare, num_parallel_calls=AUTOTUNE, deterministic=not training)
+    dataset = dataset.batch(batch_size).prefetch(AUTOTUNE)
+    
+    # A divisão entre workers é feita acima; o tf.distribute não deve redividir
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    dataset = dataset.with_options(options)
+    
+    # Em treinamento a ordem varia a cada época; classes só vale para a ordem fixa
+    return TFDataLoader(dataset, classes, class_indices, batch_size, filenames, shuffled=training,
+                        directory=data_dir)
+
+def distribute_tfdata_loader(strategy: tf.distribute.Strategy, make_loader: Callable[[int, int, int], TFDataLoader],
+                             global_batch_size: int) -> TFDataLoader:
+    """Loader de treino multiworker criado por strategy.distribute_datasets_from_function
+
+    make_loader(batch_size, num_shards, shard_index) cria o TFDataLoader da parte de um
+    worker. Cada worker lê a parte input_pipeline_id em lotes por réplica
+    (get_per_replica_batch_size), de modo que cada passo consome global_batch_size
+    exemplos no total. O dataset distribuído não tem cardinalidade: cada época tem
+    steps_per_epoch passos completos (o resto da parte do worker fica de fora da época)
+    e o dataset é repetido entre as épocas.
+    """
+    worker_loaders = []
+
+    def dataset_fn(input_context: tf.distribute.InputContext) -> tf.data.Dataset:
+        loader = make_loader(input_context.get_per_replica_batch_size(global_batch_size),
+                             input_context.num_input_pipelines, input_context.input_pipeline_id)
+        replicas = strategy.num_replicas_in_sync // input_context.num_input_pipelines
+        loader.steps_per_epoch = loader.samples // (loader.batch_size * replicas)
+        worker_loaders.append(loader)
+        return loader.dataset.take(loader.steps_per_epoch * replicas).repeat()
+
+    # A função roda já aqui, uma vez por worker deste processo
+    dataset = strategy.distribute_datasets_from_function(dataset_fn)
+    loader = worker_loaders[0]
+    return TFDataLoader(dataset, loader.classes, loader.class_indices, global_batch_size, loader.filenames,
+                        shuffled=loader.shuffled, directory=loader.directory, steps_per_epoch=loader.steps_per_epoch)
+
+def iterate_batches(loader):
+    """Percorre uma época do loader (Sequence Keras ou TFDataLoader) em lotes numpy"""
+    if hasattr(loader, 'dataset'):
+        yield from loader.dataset.as_numpy_iterator()
+    else:
+        for i in range(len(loader)):
+            yield loader[i]
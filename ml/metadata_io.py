@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# ml/metadata_io.py - Escrita incremental e leitura em blocos dos metadados do dataset
+
+import os
+import json
+from typing import TYPE_CHECKING, Dict, Any, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Colunas conhecidas e seus tipos; colunas ausentes em um registro ficam nulas
+METADATA_COLUMNS = {
+    'filename': 'string',
+    'label': 'string',
+    'processed_path': 'string',
+    'brightness_mean': 'float64',
+    'brightness_std': 'float64',
+    'width': 'int32',
+    'height': 'int32',
+    'source': 'string',
+    'timestamp': 'float64',
+    'phash': 'string',
+    'cluster_id': 'int64',
+    'split': 'string',
+}
+
+EXTENSIONS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+    'jsonl': '.jsonl',
+    'json': '.json',
+}
+
+def _json_default(value):
+    # Escalares numpy vindos do pandas/pyarrow
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Tipo não serializável: {type(value)}")
+
+def metadata_path(output_dir: str, name: str, fmt: str) -> str:
+    """Caminho do arquivo de metadados de um conjunto (ex.: train_metadata.parquet)"""
+    return os.path.join(output_dir, f"{name}_metadata{EXTENSIONS[fmt]}")
+
+def arrow_schema():
+    import pyarrow as pa
+    return pa.schema([(name, getattr(pa, dtype)()) for name, dtype in METADATA_COLUMNS.items()])
+
+class MetadataWriter:
+    """Grava registros de metadados à medida que são produzidos
+
+    parquet e arrow (IPC) gravam blocos tipados de batch_size linhas; jsonl grava uma
+    linha por registro. json mantém o formato antigo (JSON indentado + CSV) e por isso
+    acumula os registros até o fechamento.
+    """
+
+    def __init__(self, path: str, fmt: str, batch_size: int = 10000):
+        if fmt not in EXTENSIONS:
+            raise ValueError(f"Formato de metadados não suportado: {fmt}")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.count = 0
+        self._buffer: List[Dict[str, Any]] = []
+        self._writer = None
+        self._file = None
+
+        if fmt in ('parquet', 'arrow'):
+            import pyarrow.parquet as pq
+            import pyarrow as pa
+            self._schema = arrow_schema()
+            if fmt == 'parquet':
+                self._writer = pq.ParquetWriter(path, self._schema)
+            else:
+                self._file = pa.OSFile(path, 'wb')
+                self._writer = pa.ipc.new_file(self._file, self._schema)
+        elif fmt == 'jsonl':
+            self._file = open(path, 'w')
+
+    def write(self, record: Dict[str, Any]):
+        unknown = set(record) - set(METADATA_COLUMNS)
+        if unknown:
+            raise ValueError(f"Colunas de metadados desconhecidas: {sorted(unknown)}")
+        self.count += 1
+        if self.fmt == 'jsonl':
+            self._file.write(json.dumps(record, default=_json_default) + '\n')
+            return
+        self._buffer.append(record)
+        if self.fmt != 'json' and len(self._buffer) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        import pyarrow as pa
+        table = pa.Table.from_pylist(self._buffer, schema=self._schema)
+        self._writer.write_table(table)
+        self._buffer = []
+
+    def close(self):
+        if self.fmt in ('parquet', 'arrow'):
+            self._flush()
+            self._writer.close()
+            if self._file is not None:
+                self._file.close()
+        elif self.fmt == 'jsonl':
+            self._file.close()
+        else:
+            with open(self.path, 'w') as f:
+                json.dump(self._buffer, f, indent=2, default=_json_default)
+            # Também salvar como CSV para análise fácil
+            import pandas as pd
+            pd.DataFrame(self._buffer, columns=[c for c in METADATA_COLUMNS if any(c in r for r in self._buffer)]) \
+                .to_csv(os.path.splitext(self.path)[0] + '.csv', index=False)
+            self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def iter_metadata(path: str, columns: Optional[List[str]] = None, chunksize: int = 10000) -> Iterator['pd.DataFrame']:
+    """Lê um arquivo de metadados/anotações em blocos de DataFrame (parquet, arrow, jsonl, json, csv)"""
+    import pandas as pd
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    elif path.endswith('.arrow'):
+        import pyarrow as pa
+        with pa.memory_map(path, 'r') as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                yield (batch.select(columns) if columns else batch).to_pandas()
+    elif path.endswith('.jsonl'):
+        with pd.read_json(path, lines=True, chunksize=chunksize, dtype=False) as reader:
+            for df in reader:
+                yield df[columns] if columns else df
+    elif path.endswith('.csv'):
+        for df in pd.read_csv(path, usecols=columns, chunksize=chunksize):
+            yield df
+    elif path.endswith('.json'):
+        df = pd.read_json(path, dtype=False)
+        for start in range(0, len(df), chunksize):
+            chunk = df.iloc[start:start + chunksize]
+            yield chunk[columns] if columns else chunk
+    else:
+        raise ValueError(f"Formato de arquivo não suportado: {path}")
+
+def iter_records(path: str, chunksize: int = 10000) -> Iterator[Dict[str, Any]]:
+    """Percorre os registros de um arquivo de metadados sem carregar a tabela inteira"""
+    for df in iter_metadata(path, chunksize=chunksize):
+        for record in df.to_dict('records'):
+            # Remover colunas nulas (ex.: campos opcionais ausentes no registro)
+            yield {k: v for k, v in record.items() if v is not None and v == v}
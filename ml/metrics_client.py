@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# ml/metrics_client.py - Registro de métricas no Supabase (PostgREST) com spool em disco e envio em segundo plano
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import contextlib
+import hashlib
+import argparse
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_SPOOL_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'safewatch', 'metrics_spool')
+# Respostas transitórias: o lote volta para o spool e é reenviado com backoff
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+class MetricsClient:
+    """Cliente compartilhado de uma tabela do Supabase, com upsert em lote
+
+    submit() só grava o registro no spool (um arquivo JSON por registro, escrito de
+    forma atômica) e retorna; uma thread envia o spool em lotes de até batch_size
+    registros por POST com Prefer: resolution=merge-duplicates (upsert pela coluna
+    on_conflict), em uma requests.Session com pool de conexões. Falhas transitórias
+    são repetidas com backoff exponencial; registros que não puderem ser enviados
+    ficam no spool e são enviados pela próxima execução (ou por metrics_client.py).
+    Em máquinas efêmeras (CI), spool_dir deve ficar junto dos artefatos da execução.
+    """
+
+    def __init__(self, url: str, key: str, table: str = 'model_metrics', on_conflict: str = 'model_name',
+                 spool_dir: Optional[str] = None, batch_size: int = 50, max_retries: int = 5,
+                 backoff: float = 0.5, timeout: float = 10.0, flush_interval: float = 1.0, linger: float = 0.2):
+        self.endpoint = f"{url.rstrip('/')}/rest/v1/{table}"
+        self.on_conflict = on_conflict
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        # Espera curta após um submit, para juntar registros próximos no mesmo POST
+        self.linger = linger
+        # Um spool por destino, para que registros de projetos diferentes não se misturem
+        target = hashlib.sha256(f"{self.endpoint}?on_conflict={on_conflict}".encode()).hexdigest()[:16]
+        self.spool_root = spool_dir or DEFAULT_SPOOL_DIR
+        self.spool_dir = os.path.join(self.spool_root, target)
+        self.failed_dir = os.path.join(self.spool_dir, 'failed')
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.headers.update({
+            'apikey': key,
+            'Authorization': f'Bearer {key}',
+            'Content-Type': 'application/json',
+            'Prefer': 'resolution=merge-duplicates,return=minimal',
+        })
+
+        self.sent = 0
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._idle = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='metrics-spool', daemon=True)
+        self._thread.start()
+
+    def submit(self, record: Dict[str, Any]) -> str:
+        """Grava o registro no spool e agenda o envio; não faz acesso à rede"""
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.json"
+        path = os.path.join(self.spool_dir, name)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(record, f, default=str)
+        os.replace(f"{path}.tmp", path)
+        self._wakeup.set()
+        return path
+
+    def pending(self) -> List[str]:
+        return sorted(f for f in os.listdir(self.spool_dir) if f.endswith('.json'))
+
+    def flush(self, timeout: Optional[float] = None) -> int:
+        """Espera o spool esvaziar (até timeout segundos); retorna quantos registros restam"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self.pending() and self._thread.is_alive():
+                self._wakeup.set()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._idle.wait(min(remaining, 0.5) if remaining is not None else 0.5)
+        return len(self.pending())
+
+    def close(self, timeout: float = 10.0) -> int:
+        """Tenta esvaziar o spool por até timeout segundos e encerra a thread de envio"""
+        remaining = self.flush(timeout)
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join(timeout=1.0)
+        self.session.close()
+        if remaining:
+            print(f"Aviso: {remaining} registros de métricas ficaram no spool {self.spool_dir}; "
+                  f"envie com: python metrics_client.py --spool-dir {self.spool_root}")
+        return remaining
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._wakeup.wait(self.flush_interval):
+                self._stop.wait(self.linger)
+            self._wakeup.clear()
+            try:
+                while self._send_batch():
+                    pass
+            except Exception as e:
+                print(f"Erro ao enviar métricas: {e}")
+            with self._idle:
+                self._idle.notify_all()
+
+    def _load_batch(self) -> List[Tuple[str, Dict[str, Any]]]:
+        batch = []
+        for name in self.pending()[:self.batch_size]:
+            path = os.path.join(self.spool_dir, name)
+            try:
+                with open(path, 'r') as f:
+                    batch.append((path, json.load(f)))
+            except (OSError, ValueError):
+                os.replace(path, os.path.join(self.failed_dir, name))
+        return batch
+
+    def _send_batch(self) -> bool:
+        """Envia um lote do spool; retorna True se há mais a enviar agora"""
+        batch = self._load_batch()
+        if not batch:
+            return False
+        # Um upsert em lote exige as mesmas colunas em todos os objetos
+        groups: Dict[Tuple[str, ...], List[Tuple[str, Dict[str, Any]]]] = {}
+        for path, record in batch:
+            groups.setdefault(tuple(sorted(record)), []).append((path, record))
+        for columns, items in groups.items():
+            # O último registro de cada chave prevalece (um upsert não aceita a mesma chave duas vezes)
+            latest = {}
+            for path, record in items:
+                latest[record.get(self.on_conflict, path)] = record
+            if not self._post(list(latest.values())):
+                return False
+            for path, _ in items:
+                # Outro processo com o mesmo spool pode já ter enviado (upsert idempotente)
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            self.sent += len(items)
+        return True
+
+    def _post(self, records: List[Dict[str, Any]]) -> bool:
+        """POST com retry e backoff exponencial; False deixa o lote no spool para depois"""
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                if self._stop.wait(min(self.backoff * 2 ** (attempt - 1), 30) * (0.5 + random.random())):
+                    break
+            try:
+                response = self.session.post(self.endpoint, params={'on_conflict': self.on_conflict},
+                                             data=json.dumps(records, default=str), timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e.__class__.__name__
+                continue
+            if response.status_code < 300:
+                return True
+            if response.status_code not in RETRY_STATUS:
+                # Erro permanente (ex.: coluna inválida): o lote é separado para inspeção
+                print(f"Erro ao registrar métricas: {response.status_code} - {response.text}")
+                for record in records:
+                    self._quarantine(record)
+                return True
+            error = f"HTTP {response.status_code}"
+        print(f"Aviso: Supabase indisponível ({error}); {len(records)} registros mantidos no spool")
+        return False
+
+    def _quarantine(self, record: Dict[str, Any]):
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.json"
+        with open(os.path.join(self.failed_dir, name), 'w') as f:
+            json.dump(record, f, default=str)
+
+_clients: Dict[Tuple[str, str, str], MetricsClient] = {}
+_clients_lock = threading.Lock()
+
+def get_client(url: str, key: str, table: str = 'model_metrics', **kwargs) -> MetricsClient:
+    """Cliente compartilhado por (url, chave, tabela) dentro do processo"""
+    with _clients_lock:
+        if (url, key, table) not in _clients:
+            _clients[(url, key, table)] = MetricsClient(url, key, table, **kwargs)
+        return _clients[(url, key, table)]
+
+def close_all(timeout: float = 10.0) -> int:
+    """Esvazia (até timeout) e encerra todos os clientes criados no processo; retorna quantos registros restam"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    return sum(client.close(timeout) for client in clients)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Envia ao Supabase as métricas que ficaram no spool local')
+    parser.add_argument('--supabase-url', type=str, default=os.environ.get('SUPABASE_URL'), help='URL do Supabase')
+    parser.add_argument('--supabase-key', type=str, default=os.environ.get('SUPABASE_KEY'), help='Chave do Supabase')
+    parser.add_argument('--spool-dir', type=str, help=f'Diretório do spool (padrão: {DEFAULT_SPOOL_DIR})')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Tempo máximo de envio (s)')
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    if not args.supabase_url or not args.supabase_key:
+        print("Erro: informe --supabase-url e --supabase-key (ou SUPABASE_URL/SUPABASE_KEY)")
+        sys.exit(1)
+    client = MetricsClient(args.supabase_url, args.supabase_key, spool_dir=args.spool_dir)
+    pending = len(client.pending())
+    remaining = client.close(args.timeout)
+    print(f"{pending - remaining} registros enviados, {remaining} pendentes")
+    sys.exit(1 if remaining else 0)
+
+if __name__ == "__main__":
+    main()
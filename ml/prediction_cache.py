@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# ml/prediction_cache.py - Cache persistente das predições do evaluate.py
+
+import os
+import json
+import hashlib
+import numpy as np
+from typing import Dict, Any, Optional, List
+
+def path_digest(path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 do conteúdo de um arquivo ou de todos os arquivos de um diretório (ex.: SavedModel)"""
+    h = hashlib.sha256()
+    if os.path.isdir(path):
+        files = sorted(os.path.relpath(os.path.join(root, f), path)
+                       for root, _, names in os.walk(path) for f in names)
+    else:
+        files = ['']
+    for rel in files:
+        h.update(rel.encode() + b'\0')
+        with open(os.path.join(path, rel) if rel else path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                h.update(block)
+    return h.hexdigest()
+
+def manifest_digest(data_dir: str) -> str:
+    """Hash do manifesto do dataset (caminho relativo, tamanho, mtime de cada arquivo)
+
+    Não lê o conteúdo das imagens; qualquer arquivo adicionado, removido ou reescrito
+    muda o hash.
+    """
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(data_dir):
+        dirs.sort()
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            st = os.stat(path)
+            h.update(f"{os.path.relpath(path, data_dir)}\t{st.st_size}\t{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+class PredictionCache:
+    """Predições (probabilidades, rótulos e ordem dos arquivos) por modelo + dataset + pré-processamento
+
+    Cada entrada é um .npz em cache_dir; o tempo de acesso é atualizado a cada uso e
+    as entradas menos usadas recentemente são removidas quando o total passa de max_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, model_path: str, data_dir: str, params: Dict[str, Any]) -> str:
+        parts = {
+            'model': path_digest(model_path),
+            'dataset': manifest_digest(data_dir),
+            'params': params,
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:32]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def load(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """Retorna as predições em cache ou None"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                entry = {name: data[name] for name in data.files}
+        except (OSError, ValueError) as e:
+            print(f"Aviso: entrada de cache inválida {path}: {e}")
+            os.remove(path)
+            return None
+        # Marcar como usada recentemente
+        os.utime(path)
+        return entry
+
+    def store(self, key: str, probabilities: np.ndarray, classes: np.ndarray, filenames: List[str]):
+        """Grava as predições e remove entradas antigas se o cache passar do limite"""
+        path = self._path(key)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, probabilities=np.asarray(probabilities, dtype=np.float32),
+                 classes=np.asarray(classes, dtype=np.int32), filenames=np.asarray(filenames, dtype=str))
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Remove as entradas menos usadas recentemente até o cache caber em max_bytes"""
+        entries = []
+        for file in os.listdir(self.cache_dir):
+            if file.endswith('.npz') and not file.endswith('.tmp.npz'):
+                path = os.path.join(self.cache_dir, file)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# ml/prep_cache.py - Cache persistente de imagens processadas, endereçado pelo conteúdo
+
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+from typing import Dict, Any, Optional, Iterable, Set, Sequence, List
+from pyramid import variant_file
+
+# Incrementar quando o processamento mudar de forma incompatível com o cache
+PROCESSING_VERSION = 2
+
+def file_digest(filepath: str, block_size: int = 1 << 20) -> str:
+    """Calcula o SHA-256 do conteúdo de um arquivo"""
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def link_or_copy(src: str, dst: str):
+    """Cria hardlink de src em dst, copiando quando o sistema de arquivos não suporta"""
+    tmp_path = f"{dst}.tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+class ProcessingCache:
+    """Cache de saídas do data_prep chaveado por hash da fonte + parâmetros de processamento
+
+    Fontes já processadas com os mesmos parâmetros são restauradas sem decodificar a
+    imagem. O índice de fontes (caminho, tamanho, mtime -> hash) evita reler arquivos
+    inalterados entre execuções. Com extra_sizes, cada entrada guarda também as
+    variantes de outros tamanhos (ver pyramid), restauradas junto com a principal.
+    Vídeos são chaveados pelo hash da gravação + parâmetros de amostragem (video_key);
+    cada frame amostrado vira uma entrada própria, restaurada com o rótulo atual.
+    """
+
+    def __init__(self, cache_dir: str, params: Dict[str, Any], extra_sizes: Sequence[int] = ()):
+        self.extra_sizes = sorted(extra_sizes)
+        params = dict(params, version=PROCESSING_VERSION)
+        if self.extra_sizes:
+            params['extra_sizes'] = self.extra_sizes
+        self.params_key = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+        self.objects_dir = os.path.join(cache_dir, self.params_key)
+        os.makedirs(self.objects_dir, exist_ok=True)
+        with open(os.path.join(self.objects_dir, 'params.json'), 'w') as f:
+            json.dump(params, f, indent=2)
+
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'cache.db'))
+        # WAL: commits baratos a cada janela; uma execução interrompida mantém o que já foi gravado
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT);
+            CREATE TABLE IF NOT EXISTS entries (
+                params_key TEXT, digest TEXT, ext TEXT, record TEXT,
+                PRIMARY KEY (params_key, digest));
+            CREATE TABLE IF NOT EXISTS videos (
+                params_key TEXT, video_key TEXT, timestamps TEXT,
+                PRIMARY KEY (params_key, video_key));
+            CREATE TABLE IF NOT EXISTS frames (
+                params_key TEXT, video_key TEXT, timestamp REAL, ext TEXT, record TEXT,
+                PRIMARY KEY (params_key, video_key, timestamp));
+        """)
+        self.hits = 0
+        self.misses = 0
+
+    def digest(self, filepath: str) -> str:
+        """Retorna o hash do arquivo, reaproveitando o índice quando tamanho/mtime não mudaram"""
+        path = os.path.abspath(filepath)
+        st = os.stat(path)
+        row = self.db.execute('SELECT size, mtime_ns, digest FROM sources WHERE path = ?', (path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        digest = file_digest(path)
+        self.db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                        (path, st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+    def _object_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest + ext)
+
+    def restore(self, digest: str, filename: str, label: str, output_dir: str) -> Optional[Dict[str, Any]]:
+        """Restaura uma saída do cache para output_dir; retorna os metadados ou None"""
+        row = self.db.execute('SELECT ext, record FROM entries WHERE params_key = ? AND digest = ?',
+                              (self.params_key, digest)).fetchone()
+        return self._restore_object(digest, row, filename, label, output_dir)
+
+    def _restore_object(self, digest: str, row: Optional[tuple], filename: str, label: str,
+                        output_dir: str) -> Optional[Dict[str, Any]]:
+        """Liga em output_dir o objeto (ext, record) de digest e suas variantes"""
+        if row is None:
+            self.misses += 1
+            return None
+        output_file = os.path.join(output_dir, label, filename)
+        outputs = [(self._object_path(digest, row[0]), output_file)]
+        outputs += [(self._object_path(digest, f'@{size}{row[0]}'), variant_file(output_file, output_dir, size))
+                    for size in self.extra_sizes]
+        if not all(os.path.exists(object_path) for object_path, _ in outputs):
+            self.misses += 1
+            return None
+
+        for object_path, target in outputs:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if not (os.path.exists(target) and os.path.samefile(object_path, target)):
+                link_or_copy(object_path, target)
+
+        self.hits += 1
+        record = json.loads(row[1])
+        record.update({'filename': filename, 'label': label, 'processed_path': output_file})
+        return record
+
+    def store(self, digest: str, record: Dict[str, Any], output_dir: str):
+        """Guarda no cache a saída recém-processada descrita por record (e suas variantes)"""
+        ext, cached = self._store_object(digest, record, output_dir)
+        self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                        (self.params_key, digest, ext, json.dumps(cached)))
+
+    def _store_object(self, digest: str, record: Dict[str, Any], output_dir: str):
+        """Liga no cache a saída de record e suas variantes; retorna (ext, metadados a guardar)"""
+        ext = os.path.splitext(record['processed_path'])[1]
+        object_path = self._object_path(digest, ext)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        link_or_copy(record['processed_path'], object_path)
+        for size in self.extra_sizes:
+            link_or_copy(variant_file(record['processed_path'], output_dir, size),
+                         self._object_path(digest, f'@{size}{ext}'))
+        return ext, {k: v for k, v in record.items() if k not in ('filename', 'label', 'processed_path')}
+
+    def video_key(self, digest: str, sampling: Dict[str, Any]) -> str:
+        """Chave de um vídeo: hash da gravação + parâmetros de amostragem dos frames"""
+        payload = json.dumps({'digest': digest, 'sampling': sampling}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _frame_digest(self, video_key: str, timestamp: float) -> str:
+        return hashlib.sha256(f'{video_key}@{timestamp!r}'.encode()).hexdigest()
+
+    def video_timestamps(self, video_key: str) -> Optional[List[float]]:
+        """Timestamps de todos os frames amostrados do vídeo (rotulados ou não), ou None"""
+        row = self.db.execute('SELECT timestamps FROM videos WHERE params_key = ? AND video_key = ?',
+                              (self.params_key, video_key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def restore_frame(self, video_key: str, timestamp: float, filename: str, label: str,
+                      output_dir: str) -> Optional[Dict[str, Any]]:
+        """Restaura um frame amostrado de um vídeo do cache; retorna os metadados ou None"""
+        row = self.db.execute('SELECT ext, record FROM frames WHERE params_key = ? AND video_key = ? '
+                              'AND timestamp = ?', (self.params_key, video_key, timestamp)).fetchone()
+        return self._restore_object(self._frame_digest(video_key, timestamp), row, filename, label, output_dir)
+
+    def store_video(self, video_key: str, timestamps: List[float], frames: Dict[float, Dict[str, Any]],
+                    output_dir: str):
+        """Guarda os frames processados de um vídeo (por timestamp) e a lista completa de amostras"""
+        self.db.execute('DELETE FROM frames WHERE params_key = ? AND video_key = ?', (self.params_key, video_key))
+        for timestamp, record in frames.items():
+            ext, cached = self._store_object(self._frame_digest(video_key, timestamp), record, output_dir)
+            self.db.execute('INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?)',
+                            (self.params_key, video_key, timestamp, ext, json.dumps(cached)))
+        self.db.execute('INSERT OR REPLACE INTO videos VALUES (?, ?, ?)',
+                        (self.params_key, video_key, json.dumps(timestamps)))
+
+    def prune_videos(self, live_keys: Set[str]) -> int:
+        """Remove vídeos deste conjunto de parâmetros que não fazem mais parte da entrada"""
+        removed = 0
+        rows = self.db.execute('SELECT video_key FROM videos WHERE params_key = ?', (self.params_key,)).fetchall()
+        for (video_key,) in rows:
+            if video_key in live_keys:
+                continue
+            frames = self.db.execute('SELECT timestamp, ext FROM frames WHERE params_key = ? AND video_key = ?',
+                                     (self.params_key, video_key)).fetchall()
+            for timestamp, ext in frames:
+                digest = self._frame_digest(video_key, timestamp)
+                for suffix in [ext] + [f'@{size}{ext}' for size in self.extra_sizes]:
+                    object_path = self._object_path(digest, suffix)
+                    if os.path.exists(object_path):
+                        os.remove(object_path)
+            self.db.execute('DELETE FROM frames WHERE params_key = ? AND video_key = ?', (self.params_key, video_key))
+            self.db.execute('DELETE FROM videos WHERE params_key = ? AND video_key = ?', (self.params_key, video_key))
+            removed += 1
+        return removed
+
+    def prune(self, live_digests: Set[str], live_paths: Iterable[str]) -> int:
+        """Remove entradas deste conjunto de parâmetros cujas fontes não existem mais"""
+        # Fontes de outra etapa (ex.: vídeos) ainda existentes continuam no índice
+        live_paths = {os.path.abspath(p) for p in live_paths}
+        stale_sources = [(p,) for (p,) in self.db.execute('SELECT path FROM sources')
+                         if p not in live_paths and not os.path.exists(p)]
+        self.db.executemany('DELETE FROM sources WHERE path = ?', stale_sources)
+
+        removed = 0
+        rows = self.db.execute('SELECT digest, ext FROM entries WHERE params_key = ?', (self.params_key,)).fetchall()
+        for digest, ext in rows:
+            if digest in live_digests:
+                continue
+            for suffix in [ext] + [f'@{size}{ext}' for size in self.extra_sizes]:
+                object_path = self._object_path(digest, suffix)
+                if os.path.exists(object_path):
+                    os.remove(object_path)
+            self.db.execute('DELETE FROM entries WHERE params_key = ? AND digest = ?', (self.params_key, digest))
+            removed += 1
+        return removed
+
+    def commit(self):
+        """Grava no índice os hashes e entradas registrados até aqui (chamado a cada janela)"""
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+def prune_outputs(output_dir: str, keep_paths: Iterable[str]) -> int:
+    """Remove de output_dir as saídas que não pertencem à execução atual"""
+    keep = {os.path.abspath(p) for p in keep_paths}
+    removed = 0
+    for root, dirs, files in os.walk(output_dir):
+        for file in files:
+            path = os.path.abspath(os.path.join(root, file))
+            if path not in keep:
+                os.remove(path)
+                removed += 1
+    return removed
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# ml/pyramid.py - Saídas do data_prep em várias resoluções (uma decodificação por fonte)
+
+import os
+import json
+from typing import Dict, Any, List, Optional
+
+MANIFEST_FILENAME = 'pyramid.json'
+
+def size_dir(path: str, size: int) -> str:
+    """Variante de tamanho size de um diretório de saída: <pai>/size_<N>/<nome>"""
+    parent, name = os.path.split(os.path.normpath(path))
+    return os.path.join(parent, f'size_{size}', name)
+
+def variant_file(path: str, root: str, size: int) -> str:
+    """Caminho de um arquivo de root (ex.: images/<classe>/<arquivo>) na variante de tamanho size"""
+    return os.path.join(size_dir(root, size), os.path.relpath(path, root))
+
+def write_manifest(output_dir: str, primary: int, sizes: List[int], params: Optional[Dict[str, Any]] = None):
+    """Registra os tamanhos gerados; o principal fica nos diretórios de sempre
+
+    params guarda os parâmetros de pré-processamento do data_prep (ex.: decode, resize_mode).
+    """
+    with open(os.path.join(output_dir, MANIFEST_FILENAME), 'w') as f:
+        json.dump({'primary': primary, 'sizes': sorted(set(sizes)), 'params': params or {}}, f, indent=2)
+
+def load_manifest(output_dir: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def dataset_manifest(set_dir: str) -> Optional[Dict[str, Any]]:
+    """Manifesto do dataset de um conjunto, também para as variantes size_<N>/<conjunto>"""
+    parent = os.path.dirname(os.path.normpath(set_dir))
+    if os.path.basename(parent).startswith('size_'):
+        parent = os.path.dirname(parent)
+    return load_manifest(parent)
+
+def resolve_size_dir(path: str, image_size: int) -> str:
+    """Diretório de um conjunto (images_train, shards_test, ...) no tamanho pedido
+
+    Sem pyramid.json ao lado do conjunto, para o tamanho principal ou para um tamanho
+    não preparado, retorna path (e os carregadores redimensionam ou recusam, como antes).
+    """
+    manifest = load_manifest(os.path.dirname(os.path.normpath(path)))
+    if manifest is None or image_size == manifest['primary']:
+        return path
+    if image_size not in manifest['sizes']:
+        print(f"Aviso: tamanho {image_size} não foi preparado para {path} "
+              f"(disponíveis: {', '.join(map(str, manifest['sizes']))})")
+        return path
+    return size_dir(path, image_size)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# ml/reporting.py - Métricas de classificação, gráficos e registro no Supabase (comuns ao treino e à avaliação)
+
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+import numpy as np
+import metrics_client
+
+def classification_metrics(y_true, y_pred, class_indices: Dict[str, int], model_name: str,
+                           detailed: bool = False) -> Dict[str, Any]:
+    """Acurácia, precisão, recall e F1 ponderados, relatório por classe e matriz de confusão
+
+    detailed=True também imprime o relatório por classe.
+    """
+    from sklearn.metrics import classification_report, confusion_matrix
+    from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+
+    # Classes nunca preditas (ex.: modelo quantizado degenerado) contam como 0, sem aviso
+    accuracy = accuracy_score(y_true, y_pred)
+    precision = precision_score(y_true, y_pred, average='weighted', zero_division=0)
+    recall = recall_score(y_true, y_pred, average='weighted', zero_division=0)
+    f1 = f1_score(y_true, y_pred, average='weighted', zero_division=0)
+
+    print(f"Accuracy: {accuracy:.4f}")
+    print(f"Precision: {precision:.4f}")
+    print(f"Recall: {recall:.4f}")
+    print(f"F1 Score: {f1:.4f}")
+
+    # Relatório completo
+    # Todas as classes no relatório e na matriz, mesmo as ausentes deste conjunto
+    class_names = sorted(class_indices, key=class_indices.get)
+    labels = [class_indices[name] for name in class_names]
+    report = classification_report(y_true, y_pred, labels=labels, target_names=class_names,
+                                   output_dict=True, zero_division=0)
+    if detailed:
+        print(classification_report(y_true, y_pred, labels=labels, target_names=class_names, zero_division=0))
+
+    return {
+        'model_name': model_name,
+        'accuracy': float(accuracy),
+        'precision': float(precision),
+        'recall': float(recall),
+        'f1_score': float(f1),
+        'class_report': report,
+        'confusion_matrix': confusion_matrix(y_true, y_pred, labels=labels).tolist(),
+        'number_of_classes': len(class_indices),
+        'classes': class_names,
+    }
+
+def plot_confusion_matrix(cm, class_indices: Dict[str, int], path: str):
+    import matplotlib.pyplot as plt
+
+    # Inverter mapeamento de classes
+    class_labels = {v: k for k, v in class_indices.items()}
+
+    plt.figure(figsize=(10, 8))
+    plt.imshow(np.asarray(cm), interpolation='nearest', cmap=plt.cm.Blues)
+    plt.title('Matriz de Confusão')
+    plt.colorbar()
+    tick_marks = np.arange(len(class_indices))
+    plt.xticks(tick_marks, [class_labels[i] for i in range(len(class_labels))], rotation=45)
+    plt.yticks(tick_marks, [class_labels[i] for i in range(len(class_labels))])
+    plt.tight_layout()
+    plt.ylabel('Rótulo Verdadeiro')
+    plt.xlabel('Rótulo Predito')
+    plt.savefig(path)
+    plt.close()
+
+def plot_history(history: Dict[str, List[float]], path: str):
+    """Curvas de acurácia e perda (treino e validação) de um History.history"""
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(12, 5))
+    plt.subplot(1, 2, 1)
+    plt.plot(history['accuracy'])
+    plt.plot(history['val_accuracy'])
+    plt.title('Acurácia do Modelo')
+    plt.ylabel('Acurácia')
+    plt.xlabel('Época')
+    plt.legend(['Treino', 'Validação'], loc='lower right')
+
+    plt.subplot(1, 2, 2)
+    plt.plot(history['loss'])
+    plt.plot(history['val_loss'])
+    plt.title('Perda do Modelo')
+    plt.ylabel('Perda')
+    plt.xlabel('Época')
+    plt.legend(['Treino', 'Validação'], loc='upper right')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def register_metrics_to_supabase(supabase_url, supabase_key, metrics: Dict[str, Any],
+                                 spool_dir: Optional[str] = None, **columns):
+    """Registra métricas do modelo no Supabase
+
+    training_date (treino) vira coluna e evaluation_date (avaliação) vai em parameters;
+    columns acrescenta colunas extras (ex.: model_path). spool_dir guarda os registros
+    ainda não enviados (padrão: metrics_client.DEFAULT_SPOOL_DIR).
+    """
+    if not supabase_url or not supabase_key:
+        print("Aviso: URL ou chave do Supabase não fornecidos, métricas não serão registradas.")
+        return
+
+    # Preparar dados para inserção ou atualização
+    data = {
+        'model_name': metrics['model_name'],
+        'version': datetime.now().strftime("%Y%m%d_%H%M%S"),
+        'accuracy': metrics['accuracy'],
+        'precision': metrics['precision'],
+        'recall': metrics['recall'],
+        'f1_score': metrics['f1_score'],
+        'parameters': {
+            'classes': metrics['classes'],
+            'number_of_classes': metrics['number_of_classes']
+        },
+    }
+    if 'evaluation_date' in metrics:
+        data['parameters']['evaluation_date'] = metrics['evaluation_date']
+    if 'training_date' in metrics:
+        data['training_date'] = metrics['training_date']
+    data.update(columns)
+
+    # Enfileirar no spool; o envio (upsert por model_name) acontece em segundo plano
+    client = metrics_client.get_client(supabase_url, supabase_key, spool_dir=spool_dir)
+    client.submit(data)
+    print("Métricas enfileiradas para o Supabase.")
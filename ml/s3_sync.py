@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# ml/s3_sync.py - Transferências concorrentes com o S3 para o pipeline do SafeWatch
+
+import os
+import json
+import time
+import hashlib
+import posixpath
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Optional, Iterable
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from tqdm import tqdm
+import instrumentation
+
+MANIFEST_FILENAME = '.s3_manifest.json'
+# Artefatos publicados ficam em <raiz>/blobs/sha256/<2 primeiros>/<hash>, compartilhados entre versões
+BLOB_PREFIX = 'blobs/sha256'
+ARTIFACT_MANIFEST = 'manifest.json'
+MULTIPART_CHUNK = 8 * 1024 * 1024
+
+def create_s3_client(max_pool_connections: int = 10, endpoint_url: Optional[str] = None):
+    """Cria um cliente S3 com pool de conexões compartilhável entre threads"""
+    config = Config(
+        max_pool_connections=max_pool_connections,
+        retries={'max_attempts': 5, 'mode': 'adaptive'}
+    )
+    return boto3.client('s3', endpoint_url=endpoint_url or os.environ.get('AWS_ENDPOINT_URL'), config=config)
+
+def list_objects(s3, bucket: str, prefix: str, suffixes: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """Lista objetos de um prefixo, opcionalmente filtrando por extensão"""
+    suffixes = tuple(suffixes) if suffixes else None
+    objects = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if suffixes and not obj['Key'].endswith(suffixes):
+                continue
+            objects.append(obj)
+    return objects
+
+class DownloadManifest:
+    """Manifesto local chave S3 -> ETag/tamanho, usado para pular objetos inalterados
+
+    O manifesto é regravado periodicamente durante o download, então uma execução
+    interrompida retoma a partir dos objetos já concluídos.
+    """
+
+    def __init__(self, path: str, flush_every: int = 200):
+        self.path = path
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Aviso: manifesto {path} inválido, ignorando ({e})")
+
+    def is_current(self, obj: Dict[str, Any], filepath: str) -> bool:
+        """Verifica se o arquivo local corresponde à versão remota do objeto"""
+        entry = self.entries.get(obj['Key'])
+        if not entry:
+            return False
+        return (entry.get('etag') == obj.get('ETag') and entry.get('size') == obj.get('Size')
+                and os.path.exists(filepath) and os.path.getsize(filepath) == obj.get('Size'))
+
+    def record(self, obj: Dict[str, Any], filepath: str):
+        with self._lock:
+            self.entries[obj['Key']] = {'etag': obj.get('ETag'), 'size': obj.get('Size'), 'path': filepath}
+            self._pending += 1
+            if self._pending >= self.flush_every:
+                self._save_locked()
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+        self._pending = 0
+
+def _download_object(s3, bucket: str, obj: Dict[str, Any], filepath: str):
+    """Baixa para um arquivo temporário e renomeia, evitando arquivos parciais"""
+    tmp_path = f"{filepath}.part"
+    try:
+        s3.download_file(bucket, obj['Key'], tmp_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, filepath)
+
+def download_prefix(bucket: str, prefix: str, output_dir: str, suffixes: Optional[Iterable[str]] = None,
+                    workers: int = 16, endpoint_url: Optional[str] = None, s3=None) -> List[str]:
+    """Baixa um prefixo do S3 em paralelo e retorna os caminhos locais
+
+    Objetos cujo ETag/tamanho coincidem com o manifesto local são reaproveitados.
+    """
+    workers = max(1, workers)
+    s3 = s3 or create_s3_client(max_pool_connections=workers, endpoint_url=endpoint_url)
+    objects = list_objects(s3, bucket, prefix, suffixes)
+
+    # Criar diretório de saída se não existir
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = DownloadManifest(os.path.join(output_dir, MANIFEST_FILENAME))
+
+    file_paths = []
+    to_download = []
+    for obj in objects:
+        filepath = os.path.join(output_dir, os.path.basename(obj['Key']))
+        file_paths.append(filepath)
+        if not manifest.is_current(obj, filepath):
+            to_download.append((obj, filepath))
+
+    skipped = len(objects) - len(to_download)
+    downloaded_bytes = 0
+    failed = set()
+    start = time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+                tqdm(total=len(to_download), desc="Baixando frames") as progress:
+            # Limitar tarefas em andamento para não enfileirar milhões de futures
+            pending = {}
+            queue = iter(to_download)
+            while True:
+                for obj, filepath in queue:
+                    future = executor.submit(_download_object, s3, bucket, obj, filepath)
+                    pending[future] = (obj, filepath)
+                    if len(pending) >= workers * 4:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    obj, filepath = pending.pop(future)
+                    try:
+                        future.result()
+                        manifest.record(obj, filepath)
+                        downloaded_bytes += obj.get('Size', 0)
+                    except Exception as e:
+                        failed.add(filepath)
+                        progress.write(f"Erro ao baixar {obj['Key']}: {e}")
+                    progress.update(1)
+    finally:
+        manifest.save()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    downloaded = len(to_download) - len(failed)
+    print(f"Download concluído. {downloaded} arquivos baixados, {skipped} inalterados, {len(failed)} erros.")
+    print(f"Vazão: {downloaded / elapsed:.1f} objetos/s, {downloaded_bytes / elapsed / 1e6:.2f} MB/s")
+    instrumentation.count('s3/objects_downloaded', downloaded)
+    instrumentation.count('s3/objects_skipped', skipped)
+    instrumentation.count('s3/bytes_downloaded', downloaded_bytes)
+    instrumentation.count('s3/errors', len(failed))
+
+    if failed:
+        file_paths = [p for p in file_paths if p not in failed]
+    return file_paths
+
+def file_sha256(path: str, chunk_size: int = MULTIPART_CHUNK) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def blob_key(root: str, digest: str) -> str:
+    return posixpath.join(root, BLOB_PREFIX, digest[:2], digest)
+
+def object_exists(s3, bucket: str, key: str) -> bool:
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+def transfer_config(concurrency: int = 4) -> TransferConfig:
+    """Uploads multipart (partes de 8 MB enviadas em paralelo) para arquivos grandes"""
+    return TransferConfig(multipart_threshold=MULTIPART_CHUNK, multipart_chunksize=MULTIPART_CHUNK,
+                          max_concurrency=concurrency, use_threads=concurrency > 1)
+
+def publish_artifacts(files: Dict[str, str], bucket: str, root: str, version: str, workers: int = 8,
+                      endpoint_url: Optional[str] = None, s3=None,
+                      metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Publica arquivos por conteúdo: cada um vira o blob <root>/blobs/sha256/<hash>
+
+    files mapeia o nome relativo do artefato ao caminho local. Blobs já presentes no
+    bucket (de versões anteriores ou repetidos nesta) não são reenviados. O manifesto
+    <root>/<version>/manifest.json lista nome -> hash/tamanho/chave de cada arquivo.
+    Retorna o manifesto, com bytes enviados e pulados.
+    """
+    workers = max(1, workers)
+    transfer_concurrency = 4
+    s3 = s3 or create_s3_client(max_pool_connections=workers * transfer_concurrency, endpoint_url=endpoint_url)
+    config = transfer_config(transfer_concurrency)
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Hash de todos os arquivos; conteúdos repetidos são enviados uma vez
+        digests = dict(zip(files, executor.map(file_sha256, files.values())))
+        blobs = {}
+        for name, digest in digests.items():
+            blobs.setdefault(digest, files[name])
+
+        def publish(digest: str, path: str) -> bool:
+            key = blob_key(root, digest)
+            if object_exists(s3, bucket, key):
+                return False
+            s3.upload_file(path, bucket, key, Config=config)
+            return True
+
+        futures = {executor.submit(publish, digest, path): digest for digest, path in blobs.items()}
+        sent = {futures[future] for future in futures if future.result()}
+
+    sizes = {name: os.path.getsize(path) for name, path in files.items()}
+    bytes_sent = sum(os.path.getsize(blobs[digest]) for digest in sent)
+    manifest = {
+        'version': version,
+        'created': datetime.now().isoformat(),
+        'files': {name: {'sha256': digests[name], 'size': sizes[name], 'key': blob_key(root, digests[name])}
+                  for name in sorted(files)},
+        'bytes_total': sum(sizes.values()),
+        'bytes_sent': bytes_sent,
+        'bytes_skipped': sum(sizes.values()) - bytes_sent,
+        'blobs_sent': len(sent),
+        'blobs_skipped': len(blobs) - len(sent),
+        **(metadata or {}),
+    }
+    manifest_key = posixpath.join(root, version, ARTIFACT_MANIFEST)
+    s3.put_object(Bucket=bucket, Key=manifest_key, Body=json.dumps(manifest, indent=2).encode(),
+                  ContentType='application/json')
+    manifest['manifest_key'] = manifest_key
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"Publicação: {len(files)} arquivos, {len(sent)} blobs enviados, {len(blobs) - len(sent)} já existentes; "
+          f"{bytes_sent / 1e6:.1f} MB enviados, {manifest['bytes_skipped'] / 1e6:.1f} MB pulados "
+          f"({bytes_sent / elapsed / 1e6:.2f} MB/s)")
+    instrumentation.count('s3/bytes_uploaded', bytes_sent)
+    instrumentation.count('s3/bytes_skipped', manifest['bytes_skipped'])
+    return manifest
+
+def fetch_artifacts(bucket: str, manifest_key: str, output_dir: str, workers: int = 8,
+                    endpoint_url: Optional[str] = None, s3=None) -> Dict[str, Any]:
+    """Recria localmente os arquivos de uma versão publicada a partir do seu manifesto"""
+    workers = max(1, workers)
+    s3 = s3 or create_s3_client(max_pool_connections=workers, endpoint_url=endpoint_url)
+    manifest = json.loads(s3.get_object(Bucket=bucket, Key=manifest_key)['Body'].read())
+
+    def fetch(name: str, entry: Dict[str, Any]):
+        filepath = os.path.join(output_dir, *name.split('/'))
+        if os.path.exists(filepath) and os.path.getsize(filepath) == entry['size'] \
+                and file_sha256(filepath) == entry['sha256']:
+            return
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        _download_object(s3, bucket, {'Key': entry['key']}, filepath)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(fetch, name, entry) for name, entry in manifest['files'].items()]:
+            future.result()
+    return manifest
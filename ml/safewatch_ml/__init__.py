@@ -0,0 +1,9 @@
+# ml/safewatch_ml/__init__.py - Pipeline de ML do SafeWatch: ponto de entrada safewatch-ml
+"""Pipeline de ML do SafeWatch
+
+As etapas ficam nos módulos de ml/ (data_prep, train, evaluate, infer), cada uma com
+main(argv); safewatch_ml.cli os reúne em um único comando. Importar este pacote não
+carrega TensorFlow nem outras dependências pesadas.
+"""
+
+__version__ = '0.1.0'
@@ -0,0 +1,6 @@
+# ml/safewatch_ml/__main__.py - Permite `python -m safewatch_ml <etapa> ...`
+
+from safewatch_ml.cli import main
+
+if __name__ == "__main__":
+    main()
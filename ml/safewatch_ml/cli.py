@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# ml/safewatch_ml/cli.py - Comando safewatch-ml {prep,train,evaluate,infer}
+
+import os
+import sys
+import argparse
+import importlib
+from typing import List, Optional
+
+# Etapa -> (módulo, descrição); o módulo só é importado quando a etapa é executada
+STAGES = {
+    'prep': ('data_prep', 'Prepara o dataset (frames, vídeos, anotações) para treino'),
+    'train': ('train', 'Treina um modelo de detecção'),
+    'evaluate': ('evaluate', 'Avalia um modelo treinado sobre o conjunto de teste'),
+    'infer': ('infer', 'Executa um modelo sobre um acervo de frames'),
+}
+
+def _ensure_importable():
+    """Em uma cópia do repositório (sem pip install), os módulos das etapas estão em ml/"""
+    ml_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if os.path.exists(os.path.join(ml_dir, 'train.py')) and ml_dir not in sys.path:
+        sys.path.insert(0, ml_dir)
+
+def parse_arguments(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog='safewatch-ml', description='Pipeline de ML do SafeWatch',
+        epilog='Use "safewatch-ml <etapa> --help" para as opções de cada etapa.')
+    parser.add_argument('stage', choices=list(STAGES), metavar='etapa',
+                        help='; '.join(f'{name}: {description}' for name, (_, description) in STAGES.items()))
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Opções da etapa')
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_arguments(argv)
+    _ensure_importable()
+    module = importlib.import_module(STAGES[args.stage][0])
+    # Ajuda e erros de argumento da etapa aparecem como "safewatch-ml <etapa>"
+    sys.argv[0] = f'safewatch-ml {args.stage}'
+    return module.main(args.args)
+
+if __name__ == "__main__":
+    main()
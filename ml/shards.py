@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# ml/shards.py - Dataset binário em shards .npy mapeáveis em memória
+
+import os
+import json
+import itertools
+import numpy as np
+import cv2
+from typing import List, Dict, Any, Optional, Iterable
+from tqdm import tqdm
+
+INDEX_FILENAME = 'index.json'
+FORMAT_VERSION = 1
+
+def is_shard_dir(path: str) -> bool:
+    """Indica se o diretório contém um dataset em shards"""
+    return os.path.exists(os.path.join(path, INDEX_FILENAME))
+
+def write_shards(records: Iterable[Dict[str, Any]], class_names: List[str], shard_dir: str,
+                 image_size: int, shard_size: int = 1024) -> Dict[str, Any]:
+    """Grava imagens processadas em shards de tensores uint8 RGB + rótulos, com índice
+
+    Cada shard tem shard-NNNNN.images.npy (N x H x W x 3), shard-NNNNN.labels.npy
+    (N, int32, índice em class_names) e shard-NNNNN.files.txt com os nomes de arquivo.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    class_index = {name: i for i, name in enumerate(class_names)}
+
+    # Remover shards antigos para não misturar com a gravação atual
+    for file in os.listdir(shard_dir):
+        if file.startswith('shard-') or file == INDEX_FILENAME:
+            os.remove(os.path.join(shard_dir, file))
+
+    shards = []
+    records = iter(records)
+    progress = tqdm(desc=f"Gravando shards em {shard_dir}")
+    for shard_id in itertools.count():
+        chunk = list(itertools.islice(records, shard_size))
+        if not chunk:
+            break
+        name = f"shard-{shard_id:05d}"
+        images = np.lib.format.open_memmap(
+            os.path.join(shard_dir, f"{name}.images.npy"), mode='w+',
+            dtype=np.uint8, shape=(len(chunk), image_size, image_size, 3))
+        labels = np.empty(len(chunk), dtype=np.int32)
+
+        for i, record in enumerate(chunk):
+            image = cv2.imread(record['processed_path'])
+            if image is None:
+                raise ValueError(f"Não foi possível ler a imagem: {record['processed_path']}")
+            if image.shape[:2] != (image_size, image_size):
+                image = cv2.resize(image, (image_size, image_size))
+            images[i] = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            labels[i] = class_index[record['label']]
+
+        images.flush()
+        del images
+        np.save(os.path.join(shard_dir, f"{name}.labels.npy"), labels)
+        with open(os.path.join(shard_dir, f"{name}.files.txt"), 'w') as f:
+            f.write('\n'.join(record['filename'] for record in chunk))
+        shards.append({'name': name, 'count': len(chunk)})
+        progress.update(len(chunk))
+    progress.close()
+
+    index = {
+        'format_version': FORMAT_VERSION,
+        'image_size': image_size,
+        'class_names': list(class_names),
+        'samples': sum(shard['count'] for shard in shards),
+        'shards': shards,
+    }
+    with open(os.path.join(shard_dir, INDEX_FILENAME), 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+class ShardReader:
+    """Acesso aleatório a um dataset em shards sem copiar os arquivos para a memória
+
+    As imagens são abertas com mmap; apenas os exemplos de cada lote são copiados.
+    """
+
+    def __init__(self, shard_dir: str):
+        with open(os.path.join(shard_dir, INDEX_FILENAME), 'r') as f:
+            self.index = json.load(f)
+        if self.index.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Versão de shards não suportada em {shard_dir}: {self.index.get('format_version')}")
+
+        self.shard_dir = shard_dir
+        self.image_size = self.index['image_size']
+        self.class_names = self.index['class_names']
+        self.class_indices = {name: i for i, name in enumerate(self.class_names)}
+        self.samples = self.index['samples']
+
+        counts = [shard['count'] for shard in self.index['shards']]
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self._images: List[Optional[np.ndarray]] = [None] * len(counts)
+        labels = [np.load(os.path.join(shard_dir, f"{shard['name']}.labels.npy")) for shard in self.index['shards']]
+        self.labels = np.concatenate(labels) if labels else np.empty(0, dtype=np.int32)
+
+    @property
+    def num_shards(self) -> int:
+        return len(self._images)
+
+    def shard_images(self, shard_id: int) -> np.ndarray:
+        """Retorna o array mapeado em memória das imagens de um shard"""
+        if self._images[shard_id] is None:
+            name = self.index['shards'][shard_id]['name']
+            self._images[shard_id] = np.load(os.path.join(self.shard_dir, f"{name}.images.npy"), mmap_mode='r')
+        return self._images[shard_id]
+
+    def filenames(self) -> List[str]:
+        names = []
+        for shard in self.index['shards']:
+            with open(os.path.join(self.shard_dir, f"{shard['name']}.files.txt"), 'r') as f:
+                names.extend(f.read().split('\n') if shard['count'] else [])
+        return names
+
+    def get_images(self, indices: np.ndarray) -> np.ndarray:
+        """Copia as imagens dos índices globais pedidos (uint8, N x H x W x 3)"""
+        indices = np.asarray(indices, dtype=np.int64)
+        out = np.empty((len(indices), self.image_size, self.image_size, 3), dtype=np.uint8)
+        shard_ids = np.searchsorted(self.offsets, indices, side='right') - 1
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            out[mask] = self.shard_images(shard_id)[indices[mask] - self.offsets[shard_id]]
+        return out
+
+    def epoch_order(self, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        """Ordem de leitura de uma época; com rng embaralha shards e exemplos dentro de cada shard
+
+        Manter os exemplos de um lote no mesmo shard preserva a localidade de leitura.
+        """
+        if rng is None:
+            return np.arange(self.samples, dtype=np.int64)
+        order = []
+        for shard_id in rng.permutation(self.num_shards):
+            start, end = self.offsets[shard_id], self.offsets[shard_id + 1]
+            order.append(start + rng.permutation(end - start))
+        return np.concatenate(order) if order else np.empty(0, dtype=np.int64)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# ml/splitting.py - Divisão treino/teste estável por hash de uma chave de agrupamento
+
+import os
+import re
+import hashlib
+from collections import Counter
+from typing import Dict, Any, List, Optional
+
+SPLIT_KEYS = ('source', 'filename')
+
+class HashSplitter:
+    """Atribui cada registro a 'train' ou 'test' pelo hash da sua chave de agrupamento
+
+    A decisão depende só da chave (e do salt): registros novos nunca mudam o conjunto
+    dos já existentes, e todos os frames de um mesmo vídeo/câmera (source) ficam no
+    mesmo conjunto. O hash é uniforme e independente do rótulo, então em cada classe
+    a fração de grupos no teste tende a test_split (estratificação aproximada, tanto
+    melhor quanto mais grupos a classe tiver); report() mostra a fração obtida.
+    """
+
+    def __init__(self, test_split: float, key: str = 'source', pattern: Optional[str] = None, salt: str = ''):
+        if key not in SPLIT_KEYS:
+            raise ValueError(f"Chave de divisão inválida: {key}")
+        self.test_split = test_split
+        self.key = key
+        # Ex.: r'^(cam\d+)_' agrupa pelo identificador da câmera no nome do arquivo
+        self.pattern = re.compile(pattern) if pattern else None
+        self.salt = salt
+        self.counts: Dict[str, Counter] = {}
+
+    def group_key(self, record: Dict[str, Any]) -> str:
+        """Chave de agrupamento: source (vídeo de origem; imagens avulsas usam o próprio arquivo)
+        ou filename, opcionalmente reduzida ao primeiro grupo de pattern"""
+        key = record.get('source') if self.key == 'source' else None
+        key = key or os.path.basename(record['filename'])
+        if self.pattern is not None:
+            match = self.pattern.search(key)
+            if match:
+                key = match.group(1) if match.groups() else match.group(0)
+        return key
+
+    def assign(self, record: Dict[str, Any]) -> str:
+        key = self.group_key(record)
+        digest = hashlib.blake2b(f"{self.salt}\0{key}".encode(), digest_size=8).digest()
+        split = 'test' if int.from_bytes(digest, 'big') / 2 ** 64 < self.test_split else 'train'
+        self.counts.setdefault(record['label'], Counter())[split] += 1
+        return split
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Amostras e fração de teste por classe"""
+        report = {}
+        for label, counts in sorted(self.counts.items()):
+            total = counts['train'] + counts['test']
+            report[label] = {'train': counts['train'], 'test': counts['test'],
+                             'test_fraction': counts['test'] / total if total else 0.0}
+        return report
+
+    @property
+    def class_names(self) -> List[str]:
+        return sorted(self.counts)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# ml/sweep.py - Busca de hiperparâmetros em paralelo com successive halving
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import itertools
+import multiprocessing
+import pandas as pd
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Sweep de hiperparâmetros do SafeWatch: treinos concorrentes com successive halving')
+    parser.add_argument('--data-dir', type=str, default='data/processed', help='Diretório com dados processados')
+    parser.add_argument('--output-dir', type=str, default='sweeps', help='Diretório do sweep')
+    parser.add_argument('--model-types', nargs='+', default=['mobilenet', 'resnet', 'efficientnet'],
+                        choices=['mobilenet', 'resnet', 'efficientnet'], help='Backbones avaliados')
+    parser.add_argument('--learning-rates', type=float, nargs='+', default=[1e-3, 3e-4, 1e-4],
+                        help='Taxas de aprendizado avaliadas')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[32], help='Tamanhos de batch avaliados')
+    parser.add_argument('--image-size', type=int, default=224, help='Tamanho das imagens')
+    parser.add_argument('--data-format', type=str, default='directory', choices=['directory', 'shards'],
+                        help='Formato do dataset gerado pelo data_prep.py')
+    parser.add_argument('--loader', type=str, default='keras', choices=['keras', 'tfdata'],
+                        help='Pipeline de entrada')
+    parser.add_argument('--feature-cache', action='store_true',
+                        help='Extrair os embeddings uma vez por backbone e treinar só as cabeças')
+    parser.add_argument('--min-epochs', type=int, default=2, help='Épocas da primeira rodada')
+    parser.add_argument('--max-epochs', type=int, default=50, help='Épocas dos finalistas')
+    parser.add_argument('--eta', type=int, default=3, help='A cada rodada, só 1/eta dos trials continua')
+    parser.add_argument('--metric', type=str, default='val_accuracy', help='Métrica do histórico a maximizar')
+    parser.add_argument('--workers', type=int, help='Trials simultâneos (padrão: limitado por CPUs e memória)')
+    parser.add_argument('--threads-per-trial', type=int, default=2, help='Threads do TensorFlow por trial')
+    parser.add_argument('--memory-per-trial-gb', type=float, default=3.0, help='Memória estimada por trial (GB)')
+    parser.add_argument('--random-weights', action='store_true',
+                        help='Backbones sem pesos pré-treinados (testes offline)')
+    return parser.parse_args()
+
+def available_memory_bytes() -> Optional[int]:
+    """Memória disponível (MemAvailable do /proc/meminfo; senão páginas livres)"""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def default_workers(threads_per_trial: int, memory_per_trial_gb: float) -> int:
+    """Trials simultâneos que cabem nos núcleos e na memória disponíveis"""
+    by_cpu = max(1, (os.cpu_count() or 1) // max(1, threads_per_trial))
+    memory = available_memory_bytes()
+    by_memory = max(1, int(memory // (memory_per_trial_gb * 1024 ** 3))) if memory else by_cpu
+    return min(by_cpu, by_memory)
+
+def rungs(min_epochs: int, max_epochs: int, eta: int) -> List[int]:
+    """Épocas acumuladas ao fim de cada rodada: min_epochs * eta^i, terminando em max_epochs"""
+    epochs = [min_epochs]
+    while epochs[-1] * eta < max_epochs:
+        epochs.append(epochs[-1] * eta)
+    if epochs[-1] < max_epochs:
+        epochs.append(max_epochs)
+    return epochs
+
+def make_trials(args) -> List[Dict[str, Any]]:
+    trials = []
+    for i, (model_type, learning_rate, batch_size) in enumerate(
+            itertools.product(args.model_types, args.learning_rates, args.batch_sizes)):
+        trials.append({'trial_id': f'trial_{i:03d}', 'model_type': model_type,
+                       'learning_rate': learning_rate, 'batch_size': batch_size})
+    return trials
+
+# Estado por processo do pool: dados e loaders compartilhados entre os trials que o processo executa
+_loaders: Dict[Tuple, Any] = {}
+_features: Dict[str, Any] = {}
+
+def _init_worker(threads: int):
+    """Limita as threads do TensorFlow de cada processo para que os trials não disputem núcleos"""
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(max(1, threads // 2))
+
+def _split_dirs(config: Dict[str, Any]) -> Tuple[str, str]:
+    from pyramid import resolve_size_dir
+    prefix = 'shards' if config['data_format'] == 'shards' else 'images'
+    return (resolve_size_dir(os.path.join(config['data_dir'], f'{prefix}_train'), config['image_size']),
+            resolve_size_dir(os.path.join(config['data_dir'], f'{prefix}_test'), config['image_size']))
+
+def _get_loaders(config: Dict[str, Any], batch_size: int, augment: bool = True):
+    """Loaders de treino/validação, criados uma vez por processo para cada batch_size"""
+    from train import create_data_generators
+    key = (batch_size, augment)
+    if key not in _loaders:
+        train_dir, val_dir = _split_dirs(config)
+        _loaders[key] = create_data_generators(train_dir, val_dir, batch_size, config['image_size'],
+                                               config['data_format'], config['loader'], augment=augment)
+    return _loaders[key]
+
+def _feature_store(config: Dict[str, Any], model_type: str):
+    from feature_cache import FeatureStore
+    return FeatureStore(os.path.join(config['output_dir'], 'features'), model_type, config['image_size'],
+                        weights=config['weights'])
+
+def extract_features(config: Dict[str, Any], model_type: str) -> Tuple[str, Dict[str, str], Dict[str, int]]:
+    """Calcula (ou reaproveita) os embeddings de treino/validação de um backbone
+
+    Retorna (backbone, impressões digitais dos conjuntos, class_indices), com que os
+    trials localizam as features no FeatureStore.
+    """
+    from tensorflow.keras import layers, models
+    from train import create_backbone
+    from feature_cache import dataset_fingerprint
+
+    train_loader, val_loader, class_indices = _get_loaders(config, config['extract_batch_size'], augment=False)
+    backbone = create_backbone(model_type, (config['image_size'], config['image_size'], 3), config['weights'])
+    extractor = models.Sequential([backbone, layers.GlobalAveragePooling2D()])
+    store = _feature_store(config, model_type)
+    store.get_or_build('train', extractor, train_loader)
+    store.get_or_build('val', extractor, val_loader)
+    fingerprints = {'train': dataset_fingerprint(train_loader), 'val': dataset_fingerprint(val_loader)}
+    return model_type, fingerprints, class_indices
+
+def run_trial(config: Dict[str, Any], trial: Dict[str, Any], initial_epoch: int, epochs: int) -> Dict[str, Any]:
+    """Treina um trial de initial_epoch até epochs, continuando dos pesos da rodada anterior
+
+    Retorna a melhor métrica da rodada e os tempos; os pesos ficam em <trial>/weights.h5.
+    """
+    import tensorflow as tf
+    from train import create_model, create_feature_head, train_model
+    from feature_cache import FeatureSequence
+
+    trial_dir = os.path.join(config['output_dir'], trial['trial_id'])
+    weights_path = os.path.join(trial_dir, 'weights.h5')
+    start = time.perf_counter()
+    tf.keras.backend.clear_session()
+
+    if config['feature_cache']:
+        key = trial['model_type']
+        if key not in _features:
+            store = _feature_store(config, key)
+            fingerprints = config['fingerprints'][key]
+            train_x, train_y = store.load('train', fingerprints['train'], 1, False)
+            val_x, val_y = store.load('val', fingerprints['val'], 1, False)
+            _features[key] = (train_x, train_y, val_x, val_y)
+        train_x, train_y, val_x, val_y = _features[key]
+        class_indices = config['class_indices']
+        train_loader = FeatureSequence(train_x, train_y, class_indices, trial['batch_size'], shuffle=True)
+        val_loader = FeatureSequence(val_x, val_y, class_indices, trial['batch_size'])
+        model, _ = create_feature_head(train_x.shape[1], len(class_indices), learning_rate=trial['learning_rate'])
+    else:
+        train_loader, val_loader, class_indices = _get_loaders(config, trial['batch_size'])
+        input_shape = (config['image_size'], config['image_size'], 3)
+        model = create_model(trial['model_type'], input_shape, len(class_indices), weights=config['weights'],
+                             learning_rate=trial['learning_rate'])
+    if initial_epoch > 0:
+        model.load_weights(weights_path)
+
+    history, model = train_model(model, train_loader, val_loader, epochs, trial_dir, trial['trial_id'],
+                                 initial_epoch=initial_epoch, save_final=False, verbose=0)
+    model.save_weights(weights_path)
+
+    values = history.history.get(config['metric'], [])
+    step_times = history.history.get('step_time_ms', [])
+    return {
+        **trial,
+        'initial_epoch': initial_epoch,
+        'epochs': epochs,
+        config['metric']: max(values) if values else float('nan'),
+        'val_loss': min(history.history.get('val_loss', [float('nan')])),
+        'step_time_ms': sum(step_times) / len(step_times) if step_times else float('nan'),
+        'seconds': time.perf_counter() - start,
+        'pid': os.getpid(),
+    }
+
+def _rank_key(metric: str):
+    """Ordenação dos trials de uma rodada: concluídos primeiro, depois métrica e menor val_loss"""
+    def key(row: Dict[str, Any]) -> Tuple[bool, float, float]:
+        if row['status'] != 'ok':
+            return False, -math.inf, -math.inf
+        val_loss = row.get('val_loss', math.inf)
+        return True, row[metric], -math.inf if math.isnan(val_loss) else -val_loss
+    return key
+
+def successive_halving(executor, config: Dict[str, Any], trials: List[Dict[str, Any]], epoch_rungs: List[int],
+                       eta: int, results_path: str, failed: Optional[List[Dict[str, Any]]] = None) -> pd.DataFrame:
+    """Roda todos os trials na 1ª rodada e promove o melhor 1/eta a cada rodada seguinte
+
+    Cada rodada é executada em paralelo no pool; a tabela de resultados é regravada
+    ao fim de cada rodada, com uma linha por trial e rodada. Trials sem a métrica no
+    histórico contam como erro e nunca são promovidos. failed são linhas de trials que
+    falharam antes da 1ª rodada (ex.: extração de features), mantidas na tabela.
+    """
+    metric = config['metric']
+    rows: List[Dict[str, Any]] = list(failed or [])
+    alive = trials
+    previous = 0
+    for rung, epochs in enumerate(epoch_rungs):
+        print(f"Rodada {rung + 1}/{len(epoch_rungs)}: {len(alive)} trials até a época {epochs}")
+        futures = {executor.submit(run_trial, config, trial, previous, epochs): trial for trial in alive}
+        finished = []
+        for future in as_completed(futures):
+            trial = futures[future]
+            try:
+                row = future.result()
+                row['status'] = 'ok' if not math.isnan(row[metric]) else f'erro: {metric} ausente no histórico'
+            except Exception as e:
+                row = {**trial, 'initial_epoch': previous, 'epochs': epochs, metric: float('nan'),
+                       'status': f'erro: {e}'}
+            row['rung'] = rung
+            finished.append(row)
+            print(f"  {row['trial_id']} ({row['model_type']}, lr={row['learning_rate']}, "
+                  f"batch={row['batch_size']}): {metric}={row[metric]:.4f}")
+
+        # Empates na métrica são decididos pela menor val_loss (NaN fica por último)
+        finished.sort(key=_rank_key(metric), reverse=True)
+        last = rung == len(epoch_rungs) - 1
+        keep = len(finished) if last else max(1, len(finished) // eta)
+        promoted_ids = {row['trial_id'] for row in finished[:keep] if row['status'] == 'ok'}
+        for row in finished:
+            if row['status'] == 'ok':
+                row['status'] = ('finalista' if last else 'promovido') if row['trial_id'] in promoted_ids \
+                    else 'podado'
+        rows.extend(finished)
+        pd.DataFrame(rows).to_csv(results_path, index=False)
+
+        alive = [trial for trial in alive if trial['trial_id'] in promoted_ids]
+        previous = epochs
+        if not alive:
+            break
+    return pd.DataFrame(rows)
+
+def main():
+    args = parse_arguments()
+    sweep_dir = os.path.join(args.output_dir, datetime.now().strftime('sweep_%Y%m%d_%H%M%S'))
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    workers = args.workers or default_workers(args.threads_per_trial, args.memory_per_trial_gb)
+    trials = make_trials(args)
+    epoch_rungs = rungs(args.min_epochs, args.max_epochs, args.eta)
+    print(f"{len(trials)} trials, rodadas em {epoch_rungs} épocas, {workers} trials simultâneos")
+
+    config = {
+        'data_dir': args.data_dir, 'output_dir': sweep_dir, 'image_size': args.image_size,
+        'data_format': args.data_format, 'loader': args.loader, 'feature_cache': args.feature_cache,
+        'metric': args.metric, 'weights': None if args.random_weights else 'imagenet',
+        'extract_batch_size': max(args.batch_sizes),
+    }
+    with open(os.path.join(sweep_dir, 'sweep.json'), 'w') as f:
+        json.dump({**config, 'trials': trials, 'rungs': epoch_rungs, 'eta': args.eta, 'workers': workers},
+                  f, indent=2)
+
+    # Processos novos (spawn): o TensorFlow não é seguro após fork
+    context = multiprocessing.get_context('spawn')
+    results_path = os.path.join(sweep_dir, 'results.csv')
+    start = time.perf_counter()
+    failed: List[Dict[str, Any]] = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(args.threads_per_trial,)) as executor:
+        if args.feature_cache:
+            # Embeddings uma vez por backbone, em paralelo; os trials só treinam cabeças
+            model_types = sorted({trial['model_type'] for trial in trials})
+            print(f"Extraindo features de {', '.join(model_types)}...")
+            config['fingerprints'] = {}
+            futures = {executor.submit(extract_features, config, m): m for m in model_types}
+            for future in as_completed(futures):
+                try:
+                    model_type, fingerprints, config['class_indices'] = future.result()
+                except Exception as e:
+                    # Um backbone com falha não derruba o sweep: seus trials ficam registrados como erro
+                    print(f"Erro ao extrair features de {futures[future]}: {e}")
+                    failed.extend({**trial, 'initial_epoch': 0, 'epochs': epoch_rungs[0], args.metric: float('nan'),
+                                   'status': f'erro: extração de features: {e}', 'rung': 0}
+                                  for trial in trials if trial['model_type'] == futures[future])
+                    continue
+                config['fingerprints'][model_type] = fingerprints
+            trials = [trial for trial in trials if trial['model_type'] in config['fingerprints']]
+        results = successive_halving(executor, config, trials, epoch_rungs, args.eta, results_path, failed)
+
+    print(f"Sweep concluído em {time.perf_counter() - start:.1f}s; resultados em {results_path}")
+    ok = results[results['status'] == 'finalista'] if 'status' in results else results.iloc[0:0]
+    if ok.empty:
+        print("Erro: nenhum trial concluiu todas as rodadas")
+        sys.exit(1)
+    best = ok.sort_values(args.metric, ascending=False).iloc[0].to_dict()
+    with open(os.path.join(sweep_dir, 'best.json'), 'w') as f:
+        json.dump(best, f, indent=2, default=str)
+    print(f"Melhor configuração: {best['model_type']}, lr={best['learning_rate']}, batch={best['batch_size']} "
+          f"({args.metric}={best[args.metric]:.4f})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+# ml/tests/conftest.py - Configuração comum dos testes do pipeline de ML
+
+import os
+import sys
+
+import pytest
+
+# Os módulos de ml/ importam uns aos outros pelo nome, como ao rodar os scripts diretamente
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ML_DIR not in sys.path:
+    sys.path.insert(0, ML_DIR)
+
+@pytest.fixture
+def s3():
+    """Cliente S3 contra o moto em processo, com um bucket vazio"""
+    moto = pytest.importorskip('moto')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        from s3_sync import create_s3_client
+        client = create_s3_client()
+        client.create_bucket(Bucket='safewatch-test')
+        yield client
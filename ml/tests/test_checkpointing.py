@@ -0,0 +1,47 @@
+# ml/tests/test_checkpointing.py - Retomada de treino no meio de uma época
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+import checkpointing
+from feature_cache import FeatureSequence
+from loaders import TFDataLoader
+
+CLASSES = {'fall': 0, 'normal': 1}
+
+def make_model():
+    model = tf.keras.Sequential([tf.keras.Input((4,)), tf.keras.layers.Dense(2, activation='softmax')])
+    model.compile(optimizer='adam', loss='categorical_crossentropy')
+    return model
+
+def test_sequence_resume_reads_remaining_samples_once():
+    features = np.arange(40, dtype=np.float32).reshape(10, 4)
+    labels = np.arange(10) % 2
+    loader = FeatureSequence(features, labels, CLASSES, batch_size=2, shuffle=True, seed=1)
+    seen = [loader[i][0][:, 0] for i in range(2)]
+    state, arrays = checkpointing._loader_state(loader)
+
+    # Processo novo: outra semente, ordem vinda do checkpoint
+    resumed = FeatureSequence(features, labels, CLASSES, batch_size=2, shuffle=True, seed=2)
+    checkpointing._apply_loader_state(resumed, state, arrays)
+    rest = checkpointing.skip_batches(resumed, 2)
+    seen += [rest[i][0][:, 0] for i in range(len(rest))]
+    assert sorted(np.concatenate(seen) // 4) == list(range(10))
+
+def test_shuffled_tfdata_resumes_from_epoch_boundary(tmp_path):
+    dataset = tf.data.Dataset.from_tensor_slices((np.zeros((8, 4), np.float32), np.zeros((8, 2), np.float32)))
+    loader = TFDataLoader(dataset.batch(2), np.zeros(8), CLASSES, 2, [], shuffled=True)
+    assert not checkpointing.order_restorable(loader)
+
+    directory = str(tmp_path / 'ckpt')
+    checkpointer = checkpointing.TrainingCheckpoint(directory, every_steps=1, async_write=False)
+    checkpointer.attach(make_model(), loader, [])
+    checkpointer.save(1, 0)
+    # Checkpoint de meio de época (ex.: gravado por uma versão anterior)
+    checkpointer.save(1, 3)
+
+    resumed = checkpointing.TrainingCheckpoint(directory, resume=True, async_write=False)
+    resumed.attach(make_model(), loader, [])
+    assert resumed.restore() == (1, 0)
@@ -0,0 +1,28 @@
+# ml/tests/test_cli.py - `python -m safewatch_ml <etapa> --help` sem importar dependências pesadas
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ML_DIR
+from safewatch_ml.cli import STAGES
+
+HEAVY_MODULES = ('tensorflow', 'sklearn', 'matplotlib', 'pandas', 'boto3')
+
+# Roda como `python -m safewatch_ml` e, ao sair, informa quais módulos pesados foram importados
+PROBE = """
+import atexit, json, runpy, sys
+atexit.register(lambda: print(json.dumps(sorted(m for m in {heavy!r} if m in sys.modules))))
+sys.argv = ['safewatch_ml', {stage!r}, '--help']
+runpy.run_module('safewatch_ml', run_name='__main__', alter_sys=True)
+"""
+
+@pytest.mark.parametrize('stage', list(STAGES))
+def test_stage_help_does_not_import_heavy_modules(stage):
+    result = subprocess.run([sys.executable, '-c', PROBE.format(heavy=HEAVY_MODULES, stage=stage)],
+                            cwd=ML_DIR, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert f'usage: safewatch-ml {stage}' in result.stdout
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == []
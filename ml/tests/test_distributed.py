@@ -0,0 +1,44 @@
+# ml/tests/test_distributed.py - Lotes por réplica no treino multiworker (2 workers locais)
+
+import json
+import os
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import ML_DIR
+
+pytest.importorskip('tensorflow')
+
+# Roda em cada worker: percorre duas épocas do loader de treino e informa o lote de cada réplica
+PROBE = """
+import json, sys
+import tensorflow as tf
+strategy = tf.distribute.MultiWorkerMirroredStrategy()
+from train import create_data_generators
+train, _, _ = create_data_generators(sys.argv[1], sys.argv[1], 4 * strategy.num_replicas_in_sync, 8,
+                                     loader='tfdata', strategy=strategy)
+batches = iter(train.dataset)
+sizes = [int(x.shape[0]) for _ in range(2 * len(train))
+         for x in strategy.experimental_local_results(next(batches)[0])]
+print('PROBE ' + json.dumps({'replicas': strategy.num_replicas_in_sync, 'steps': len(train), 'sizes': sizes}))
+"""
+
+def test_each_replica_gets_the_per_replica_batch(tmp_path):
+    for label in ('normal', 'violento'):
+        os.makedirs(tmp_path / label)
+        for i in range(12):
+            cv2.imwrite(str(tmp_path / label / f'{i}.png'), np.full((8, 8, 3), i * 10, np.uint8))
+    env = dict(os.environ, TF_USE_LEGACY_KERAS='1', PYTHONPATH=ML_DIR)
+    result = subprocess.run([sys.executable, os.path.join(ML_DIR, 'launch_local.py'), '--num-workers', '2', '--',
+                             '-c', PROBE, str(tmp_path)],
+                            cwd=ML_DIR, env=env, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stdout[-3000:]
+    probes = [json.loads(line.split('PROBE ', 1)[1]) for line in result.stdout.splitlines() if 'PROBE ' in line]
+    assert len(probes) == 2
+    for probe in probes:
+        # 24 imagens, 12 por worker, lote global 8: 3 passos por época com 4 exemplos por réplica
+        assert probe == {'replicas': 2, 'steps': 3, 'sizes': [4] * 6}
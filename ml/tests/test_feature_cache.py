@@ -0,0 +1,43 @@
+# ml/tests/test_feature_cache.py - Invalidação do cache de embeddings
+
+import cv2
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from feature_cache import FeatureStore
+from loaders import make_tfdata_loader
+
+def write_dataset(root, value: int = 0):
+    for label in ('fall', 'normal'):
+        (root / label).mkdir(parents=True, exist_ok=True)
+        for i in range(3):
+            cv2.imwrite(str(root / label / f'{label}_{i}.png'), np.full((8, 8, 3), value + i, np.uint8))
+
+def test_rewritten_image_rebuilds_features(tmp_path, monkeypatch):
+    data_dir = tmp_path / 'images_train'
+    write_dataset(data_dir)
+    extractor = tf.keras.Sequential([tf.keras.Input((8, 8, 3)), tf.keras.layers.GlobalAveragePooling2D()])
+    store = FeatureStore(str(tmp_path / 'features'), 'identity', 8)
+    builds = []
+    original = FeatureStore.build
+
+    def build(self, split, *args, **kwargs):
+        builds.append(split)
+        return original(self, split, *args, **kwargs)
+
+    monkeypatch.setattr(FeatureStore, 'build', build)
+
+    def features():
+        loader = make_tfdata_loader(str(data_dir), 2, 8)
+        return np.array(store.get_or_build('train', extractor, loader)[0])
+
+    first = features()
+    assert np.array_equal(features(), first) and builds == ['train']
+
+    # Mesmo nome de arquivo, outros pixels (ex.: reprocessado com outro --decode)
+    cv2.imwrite(str(data_dir / 'fall' / 'fall_0.png'), np.full((8, 8, 3), 200, np.uint8))
+    rebuilt = features()
+    assert builds == ['train', 'train']
+    assert not np.array_equal(rebuilt, first)
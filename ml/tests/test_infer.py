@@ -0,0 +1,25 @@
+# ml/tests/test_infer.py - Pré-processamento da inferência igual ao do data_prep
+
+import cv2
+import numpy as np
+import pytest
+
+from data_prep import _process_image
+from image_decode import RESIZE_MODES
+from infer import decode_image
+
+@pytest.mark.parametrize('resize_mode', RESIZE_MODES)
+def test_raw_frame_matches_prepared_training_image(tmp_path, resize_mode):
+    # Frame bruto de câmera (PNG: sem perdas na regravação do data_prep)
+    rng = np.random.default_rng(0)
+    frame = cv2.GaussianBlur(rng.integers(0, 255, (720, 1280, 3), dtype=np.uint8), (9, 9), 0)
+    raw = str(tmp_path / 'cam_0001.png')
+    cv2.imwrite(raw, frame)
+
+    (tmp_path / 'out' / 'normal').mkdir(parents=True, exist_ok=True)
+    record = _process_image(raw, 'normal', str(tmp_path / 'out'), 64, resize_mode=resize_mode)
+    prepared = cv2.cvtColor(cv2.imread(record['processed_path']), cv2.COLOR_BGR2RGB)
+
+    served = decode_image(raw, 64, resize_mode=resize_mode)
+    assert served.shape == (64, 64, 3) and served.dtype == np.float32
+    assert np.array_equal(np.round(served * 255).astype(np.uint8), prepared)
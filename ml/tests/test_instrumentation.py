@@ -0,0 +1,30 @@
+# ml/tests/test_instrumentation.py - Janela do profiler com steps_per_execution
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+import instrumentation
+
+def fit_with_profiler(monkeypatch, tmp_path, start_step, end_step, steps_per_execution=4):
+    calls = []
+    monkeypatch.setattr(tf.profiler.experimental, 'start', lambda log_dir: calls.append(('start', log_dir)))
+    monkeypatch.setattr(tf.profiler.experimental, 'stop', lambda: calls.append(('stop',)))
+    model = tf.keras.Sequential([tf.keras.Input((4,)), tf.keras.layers.Dense(2, activation='softmax')])
+    model.compile(optimizer='sgd', loss='categorical_crossentropy', steps_per_execution=steps_per_execution)
+    x = np.zeros((64, 4), np.float32)
+    y = np.tile([1.0, 0.0], (64, 1)).astype(np.float32)
+    callback = instrumentation.make_profiler_callback(str(tmp_path), start_step, end_step)
+    model.fit(x, y, batch_size=4, epochs=2, callbacks=[callback], verbose=0)
+    return calls
+
+def test_window_inside_a_block_still_captures_a_trace(monkeypatch, tmp_path):
+    # Com blocos de 4 passos os hooks veem os lotes 0, 4, 8...; 10 cai no meio de um bloco
+    calls = fit_with_profiler(monkeypatch, tmp_path, 10, 13)
+    assert calls == [('start', str(tmp_path)), ('stop',)]
+
+def test_window_beyond_first_epoch_warns(monkeypatch, tmp_path, capsys):
+    calls = fit_with_profiler(monkeypatch, tmp_path, 20, 30)
+    assert calls == []
+    assert 'além da 1ª época (16 passos)' in capsys.readouterr().out
@@ -0,0 +1,105 @@
+# ml/tests/test_metrics_client.py - Upsert em lote, retry e spool do MetricsClient (PostgREST local)
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from metrics_client import MetricsClient
+
+class PostgREST:
+    """Servidor local que imita o upsert do PostgREST em uma tabela"""
+
+    def __init__(self, failures=(), port: int = 0):
+        self.rows = {}
+        self.requests = []
+        # Status devolvidos (em ordem) antes de aceitar os POSTs
+        self.failures = list(failures)
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                query = parse_qs(urlparse(self.path).query)
+                stand_in.requests.append({'path': urlparse(self.path).path, 'query': query,
+                                          'prefer': self.headers.get('Prefer'), 'body': body})
+                status = stand_in.failures.pop(0) if stand_in.failures else 201
+                if status == 201:
+                    key = query['on_conflict'][0]
+                    for row in body:
+                        stand_in.rows.setdefault(row[key], {}).update(row)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def postgrest():
+    servers = []
+
+    def start(**kwargs):
+        servers.append(PostgREST(**kwargs))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
+
+def make_client(url, spool_dir, **kwargs):
+    return MetricsClient(url, 'service-key', spool_dir=str(spool_dir), **{'backoff': 0.01, **kwargs})
+
+def test_records_are_upserted_in_one_batch(postgrest, tmp_path):
+    server = postgrest()
+    # linger longo: todos os submits entram no primeiro lote
+    client = make_client(server.url, tmp_path, linger=1.0)
+    for i in range(5):
+        client.submit({'model_name': f'model_{i}', 'accuracy': 0.5})
+    client.submit({'model_name': 'model_0', 'accuracy': 0.9})
+    assert client.close() == 0
+
+    assert len(server.requests) == 1
+    request = server.requests[0]
+    assert request['path'] == '/rest/v1/model_metrics'
+    assert request['query'] == {'on_conflict': ['model_name']}
+    assert 'resolution=merge-duplicates' in request['prefer']
+    # A mesma chave só aparece uma vez no lote, com o registro mais recente
+    assert len(request['body']) == 5
+    assert server.rows['model_0']['accuracy'] == 0.9
+    assert client.pending() == []
+
+@pytest.mark.parametrize('status', [503, 429])
+def test_transient_errors_are_retried(postgrest, tmp_path, status):
+    server = postgrest(failures=[status, status])
+    client = make_client(server.url, tmp_path)
+    client.submit({'model_name': 'safewatch', 'accuracy': 0.8})
+    assert client.close() == 0
+    assert len(server.requests) == 3
+    assert server.rows == {'safewatch': {'model_name': 'safewatch', 'accuracy': 0.8}}
+
+def test_unsent_records_stay_in_spool_for_next_client(postgrest, tmp_path):
+    # Servidor fora do ar: nada chega, o registro fica no spool
+    down = postgrest()
+    url = down.url
+    down.stop()
+    client = make_client(url, tmp_path, max_retries=1)
+    client.submit({'model_name': 'safewatch', 'accuracy': 0.7})
+    assert client.close(timeout=1.0) == 1
+
+    # Próxima execução (mesmo destino, mesmo spool) envia o que ficou
+    server = postgrest(port=int(url.rsplit(':', 1)[1]))
+    client = make_client(url, tmp_path)
+    assert len(client.pending()) == 1
+    assert client.close() == 0
+    assert server.rows == {'safewatch': {'model_name': 'safewatch', 'accuracy': 0.7}}
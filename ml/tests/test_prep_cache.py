@@ -0,0 +1,103 @@
+# ml/tests/test_prep_cache.py - Cache de processamento do data_prep
+
+import itertools
+import os
+
+import cv2
+import numpy as np
+
+import data_prep
+from data_prep import iter_process_images, iter_process_videos
+from prep_cache import ProcessingCache
+from video_ingest import TimeRangeLabels
+
+PARAMS = {'image_size': 32}
+
+def write_frames(directory, count: int) -> list:
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        path = directory / f"frame_{i:03d}.jpg"
+        cv2.imwrite(str(path), rng.integers(0, 255, (48, 64, 3), dtype=np.uint8))
+        paths.append(str(path))
+    return paths
+
+def test_interrupted_run_keeps_completed_windows(tmp_path):
+    paths = write_frames(tmp_path, 8)
+    annotations = {p.rsplit('/', 1)[1]: 'normal' for p in paths}
+    output_dir, cache_dir = str(tmp_path / 'out'), str(tmp_path / 'cache')
+
+    # Interrompida durante a terceira janela, sem chegar ao close()
+    cache = ProcessingCache(cache_dir, PARAMS)
+    records = iter_process_images(paths, annotations, output_dir, 32, cache=cache, window_size=2)
+    assert len(list(itertools.islice(records, 5))) == 5
+    records.close()
+    del cache, records
+
+    cache = ProcessingCache(cache_dir, PARAMS)
+    restored = list(iter_process_images(paths, annotations, output_dir, 32, cache=cache, window_size=2))
+    cache.close()
+    assert len(restored) == 8
+    assert cache.hits >= 4
+    assert cache.misses == 8 - cache.hits
+
+def write_video(path, seconds: int = 3, fps: int = 10) -> str:
+    rng = np.random.default_rng(1)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), fps, (64, 48))
+    for _ in range(seconds * fps):
+        writer.write(rng.integers(0, 255, (48, 64, 3), dtype=np.uint8))
+    writer.release()
+    return str(path)
+
+def test_videos_restored_from_cache_without_decoding(tmp_path, monkeypatch):
+    video = write_video(tmp_path / 'queda_001.mp4')
+    annotations = {'queda_001.mp4': 'fall'}
+    output_dir, cache_dir = str(tmp_path / 'out'), str(tmp_path / 'cache')
+
+    def run(sample_fps):
+        cache = ProcessingCache(cache_dir, PARAMS)
+        records = list(iter_process_videos([video], annotations, TimeRangeLabels(), output_dir, 32,
+                                           sample_fps=sample_fps, cache=cache))
+        cache.close()
+        return records, cache
+
+    first, cache = run(2.0)
+    assert first and cache.hits == 0
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError("vídeo decodificado apesar do cache")
+    with monkeypatch.context() as m:
+        m.setattr(data_prep, 'iter_video_frames', no_decode)
+        second, cache = run(2.0)
+    assert cache.hits == len(first)
+    assert second == first
+    assert all(os.path.exists(r['processed_path']) for r in second)
+
+    # Outra taxa de amostragem é outra chave: o vídeo é decodificado de novo
+    third, cache = run(1.0)
+    assert cache.hits == 0 and len(third) < len(first)
+
+def test_progress_counts_only_annotated_images(tmp_path, monkeypatch):
+    paths = write_frames(tmp_path, 4)
+    annotations = {os.path.basename(p): 'normal' for p in paths[:3]}
+    bars = []
+
+    class Progress:
+        def __init__(self, total, desc):
+            self.total, self.n, self.messages = total, 0, []
+            bars.append(self)
+
+        def update(self, n=1):
+            self.n += n
+
+        def write(self, message):
+            self.messages.append(message)
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(data_prep, 'tqdm', Progress)
+    records = list(iter_process_images(paths, annotations, str(tmp_path / 'out'), 32))
+    assert len(records) == 3
+    assert bars[0].n == bars[0].total == 3
+    assert bars[0].messages == ["Aviso: Não há anotação para frame_003.jpg"]
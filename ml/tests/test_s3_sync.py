@@ -0,0 +1,153 @@
+# ml/tests/test_s3_sync.py - Download incremental e retomável do S3 (moto)
+
+import os
+import json
+import hashlib
+
+import pytest
+
+import s3_sync
+from s3_sync import MANIFEST_FILENAME, DownloadManifest, download_prefix
+
+BUCKET = 'safewatch-test'
+
+def put_frames(s3, count: int, prefix: str = 'frames/') -> dict:
+    contents = {}
+    for i in range(count):
+        key = f"{prefix}frame_{i:03d}.jpg"
+        contents[key] = f"frame {i}".encode() * 100
+        s3.put_object(Bucket=BUCKET, Key=key, Body=contents[key])
+    return contents
+
+def count_downloads(s3, monkeypatch) -> list:
+    keys = []
+    original = s3.download_file
+
+    def download_file(bucket, key, filename, *args, **kwargs):
+        keys.append(key)
+        return original(bucket, key, filename, *args, **kwargs)
+
+    monkeypatch.setattr(s3, 'download_file', download_file)
+    return keys
+
+def test_download_skips_unchanged_objects(s3, tmp_path, monkeypatch):
+    contents = put_frames(s3, 5)
+    paths = download_prefix(BUCKET, 'frames/', str(tmp_path), suffixes=('.jpg',), workers=4, s3=s3)
+    assert sorted(os.path.basename(p) for p in paths) == sorted(os.path.basename(k) for k in contents)
+    for key, body in contents.items():
+        assert (tmp_path / os.path.basename(key)).read_bytes() == body
+
+    # Só o objeto alterado no bucket é baixado de novo
+    s3.put_object(Bucket=BUCKET, Key='frames/frame_002.jpg', Body=b'changed')
+    downloads = count_downloads(s3, monkeypatch)
+    paths = download_prefix(BUCKET, 'frames/', str(tmp_path), suffixes=('.jpg',), workers=4, s3=s3)
+    assert downloads == ['frames/frame_002.jpg']
+    assert len(paths) == 5
+    assert (tmp_path / 'frame_002.jpg').read_bytes() == b'changed'
+
+def test_download_resumes_from_manifest_after_interruption(s3, tmp_path, monkeypatch):
+    contents = put_frames(s3, 12)
+    original = s3_sync._download_object
+    completed = []
+
+    def interrupted(s3_client, bucket, obj, filepath):
+        if len(completed) >= 5:
+            # Ctrl-C no meio do download: sobra um .part e o resto nem começa
+            with open(f"{filepath}.part", 'wb') as f:
+                f.write(b'partial')
+            raise KeyboardInterrupt
+        original(s3_client, bucket, obj, filepath)
+        completed.append(obj['Key'])
+
+    monkeypatch.setattr(s3_sync, '_download_object', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        download_prefix(BUCKET, 'frames/', str(tmp_path), workers=1, s3=s3)
+
+    # O manifesto gravado na interrupção só lista objetos concluídos (um concluído no mesmo
+    # instante da interrupção pode ficar de fora e é baixado de novo)
+    recorded = set(DownloadManifest(str(tmp_path / MANIFEST_FILENAME)).entries)
+    assert recorded and recorded <= set(completed)
+    assert list(tmp_path.glob('*.part'))
+
+    monkeypatch.setattr(s3_sync, '_download_object', original)
+    downloads = count_downloads(s3, monkeypatch)
+    paths = download_prefix(BUCKET, 'frames/', str(tmp_path), workers=3, s3=s3)
+    assert sorted(downloads) == sorted(set(contents) - recorded)
+    assert len(paths) == len(contents)
+    assert not list(tmp_path.glob('*.part'))
+    for key, body in contents.items():
+        assert (tmp_path / os.path.basename(key)).read_bytes() == body
+
+def test_failed_download_leaves_no_partial_file(s3, tmp_path, monkeypatch):
+    put_frames(s3, 3)
+
+    def failing(bucket, key, filename, *args, **kwargs):
+        with open(filename, 'wb') as f:
+            f.write(b'partial')
+        raise OSError('conexão perdida')
+
+    monkeypatch.setattr(s3, 'download_file', failing)
+    paths = download_prefix(BUCKET, 'frames/', str(tmp_path), workers=2, s3=s3)
+    assert paths == []
+    assert not list(tmp_path.glob('*.jpg*'))
+    assert DownloadManifest(str(tmp_path / MANIFEST_FILENAME)).entries == {}
+
+def write_artifacts(directory, contents: dict) -> dict:
+    files = {}
+    for name, body in contents.items():
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(body)
+        files[name] = str(path)
+    return files
+
+def spy(s3, monkeypatch, method: str) -> list:
+    calls = []
+    original = getattr(s3, method)
+
+    def wrapper(*args, **kwargs):
+        calls.append(kwargs.get('Key') or args[2])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(s3, method, wrapper)
+    return calls
+
+def test_publish_skips_blobs_already_in_bucket(s3, tmp_path, monkeypatch):
+    contents = {'model.h5': b'weights' * 1000, 'labels.json': b'{"fall": 0}', 'tflite/model.tflite': b'weights' * 1000}
+    files = write_artifacts(tmp_path, contents)
+    first = s3_sync.publish_artifacts(files, BUCKET, 'models', 'v1', workers=2, s3=s3)
+    # Conteúdos repetidos viram um único blob
+    assert first['blobs_sent'] == 2
+    assert first['bytes_sent'] == len(contents['model.h5']) + len(contents['labels.json'])
+
+    # Segunda publicação do mesmo conteúdo: HEAD encontra os blobs e nada é enviado
+    heads = spy(s3, monkeypatch, 'head_object')
+    uploads = spy(s3, monkeypatch, 'upload_file')
+    second = s3_sync.publish_artifacts(files, BUCKET, 'models', 'v2', workers=2, s3=s3)
+    assert uploads == []
+    assert len(heads) == 2
+    assert second['bytes_sent'] == 0 and second['blobs_skipped'] == 2
+
+    # Só o blob novo é enviado
+    labels = b'{"fall": 0, "normal": 1}'
+    files.update(write_artifacts(tmp_path, {'labels.json': labels}))
+    third = s3_sync.publish_artifacts(files, BUCKET, 'models', 'v3', workers=2, s3=s3)
+    assert uploads == [s3_sync.blob_key('models', hashlib.sha256(labels).hexdigest())]
+    assert third['bytes_sent'] == len(labels)
+
+def test_publish_manifest_maps_names_to_content_hashes(s3, tmp_path):
+    contents = {'model.h5': b'weights' * 1000, 'labels.json': b'{"fall": 0}'}
+    files = write_artifacts(tmp_path / 'src', contents)
+    s3_sync.publish_artifacts(files, BUCKET, 'models', 'v1', s3=s3)
+
+    manifest = json.loads(s3.get_object(Bucket=BUCKET, Key='models/v1/manifest.json')['Body'].read())
+    assert sorted(manifest['files']) == sorted(contents)
+    for name, body in contents.items():
+        entry = manifest['files'][name]
+        assert entry['sha256'] == hashlib.sha256(body).hexdigest()
+        assert entry['key'] == s3_sync.blob_key('models', entry['sha256'])
+        assert s3.get_object(Bucket=BUCKET, Key=entry['key'])['Body'].read() == body
+
+    s3_sync.fetch_artifacts(BUCKET, 'models/v1/manifest.json', str(tmp_path / 'dst'), s3=s3)
+    for name, body in contents.items():
+        assert (tmp_path / 'dst' / name).read_bytes() == body
@@ -0,0 +1,31 @@
+# ml/tests/test_sweep.py - Promoção do successive halving
+
+from concurrent.futures import ThreadPoolExecutor
+
+import sweep
+
+SCORES = {'t0': 0.9, 't1': float('nan'), 't2': 0.5, 't3': 0.7}
+
+def fake_trial(config, trial, initial_epoch, epochs):
+    return {**trial, 'initial_epoch': initial_epoch, 'epochs': epochs,
+            'val_accuracy': SCORES[trial['trial_id']], 'val_loss': 1.0}
+
+def make_trials(model_type='mobilenet'):
+    return [{'trial_id': trial_id, 'model_type': model_type, 'learning_rate': 1e-3, 'batch_size': 32}
+            for trial_id in SCORES]
+
+def test_missing_metric_is_an_error_and_never_promoted(tmp_path, monkeypatch):
+    monkeypatch.setattr(sweep, 'run_trial', fake_trial)
+    failed = [{'trial_id': 'x0', 'model_type': 'resnet', 'learning_rate': 1e-3, 'batch_size': 32,
+               'val_accuracy': float('nan'), 'status': 'erro: extração de features: falhou', 'rung': 0}]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = sweep.successive_halving(executor, {'metric': 'val_accuracy'}, make_trials(), [1, 3], 2,
+                                           str(tmp_path / 'results.csv'), failed)
+
+    first = results[results['rung'] == 0].set_index('trial_id')['status']
+    assert first['t1'].startswith('erro')
+    assert first['x0'].startswith('erro: extração')
+    assert set(first[first == 'promovido'].index) == {'t0', 't3'}
+    final = results[results['rung'] == 1].set_index('trial_id')['status']
+    assert set(final.index) == {'t0', 't3'} and set(final) == {'finalista'}
+    assert (tmp_path / 'results.csv').exists()
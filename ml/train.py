@@ -3,97 +3,199 @@
 # ml/train.py - Script para treinar modelo de detecção do SafeWatch
 
 import os
+import sys
 import json
+import time
 import argparse
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 from datetime import datetime
 from pathlib import Path
-import boto3
-import tensorflow as tf
-from tensorflow.keras import layers, models, applications, optimizers
-from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, precision_score, recall_score, f1_score
-import io
-import cv2
+import posixpath
+from pyramid import resolve_size_dir
+import acceleration
+import metrics_client
+import distributed
+import instrumentation
+import reporting
 
-def parse_arguments():
+# TensorFlow, pandas, sklearn, matplotlib, boto3 e os módulos que dependem deles são
+# importados dentro das funções que os usam: --help e erros de argumento saem sem carregá-los
+
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description='Treina modelo de detecção do SafeWatch')
     parser.add_argument('--data-dir', type=str, default='data/processed', help='Diretório com dados processados')
     parser.add_argument('--output-dir', type=str, default='models', help='Diretório para salvar modelo')
     parser.add_argument('--model-type', type=str, default='mobilenet', 
                         choices=['mobilenet', 'resnet', 'efficientnet'], help='Tipo de modelo base')
     parser.add_argument('--epochs', type=int, default=50, help='Número de épocas')
-    parser.add_argument('--batch-size', type=int, default=32, help='Tamanho do batch')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Tamanho do batch por réplica (o lote global é multiplicado pelo número de réplicas)')
     parser.add_argument('--learning-rate', type=float, default=0.001, help='Taxa de aprendizado')
     parser.add_argument('--image-size', type=int, default=224, help='Tamanho das imagens')
+    parser.add_argument('--data-format', type=str, default='directory', choices=['directory', 'shards'],
+                        help='Formato do dataset gerado pelo data_prep.py')
+    parser.add_argument('--loader', type=str, default='keras', choices=['keras', 'tfdata'],
+                        help='Pipeline de entrada: ImageDataGenerator (keras) ou tf.data')
+    parser.add_argument('--tfdata-cache', type=str,
+                        help="Cache das imagens decodificadas no tf.data: 'memory' ou diretório em disco")
+    parser.add_argument('--feature-cache', action='store_true',
+                        help='Rodar o backbone congelado uma vez e treinar só a cabeça sobre features em cache')
+    parser.add_argument('--feature-cache-dir', type=str, help='Diretório do cache de features (padrão: <data-dir>/features)')
+    parser.add_argument('--augment-variants', type=int, default=0,
+                        help='Variantes aumentadas por imagem no cache de features (0 = sem aumentação)')
+    parser.add_argument('--refresh-features', action='store_true', help='Recalcular o cache de features')
+    parser.add_argument('--export', nargs='*', default=[], choices=['dynamic', 'float16', 'int8', 'onnx'],
+                        help='Variantes exportadas após o treino (TFLite dinâmico/float16/int8 e ONNX)')
+    parser.add_argument('--accuracy-budget', type=float, default=0.01,
+                        help='Queda máxima de acurácia aceita para recomendar uma variante exportada')
+    parser.add_argument('--calibration-samples', type=int, default=200,
+                        help='Imagens de treino usadas para calibrar a quantização int8')
+    acceleration.add_arguments(parser)
+    parser.add_argument('--checkpoint-dir', type=str,
+                        help='Diretório dos checkpoints retomáveis (padrão: <output-dir>/checkpoints)')
+    parser.add_argument('--checkpoint-steps', type=int, default=0,
+                        help='Gravar um checkpoint a cada N passos (0 = só ao fim de cada época)')
+    parser.add_argument('--checkpoint-minutes', type=float, default=0,
+                        help='Gravar um checkpoint a cada N minutos de treino')
+    parser.add_argument('--checkpoint-keep', type=int, default=3, help='Checkpoints mantidos por execução')
+    parser.add_argument('--checkpoint-sync', action='store_true',
+                        help='Gravar checkpoints de forma síncrona (por padrão a escrita roda em segundo plano)')
+    parser.add_argument('--resume', nargs='?', const='latest',
+                        help='Retomar a execução interrompida mais recente (ou a de nome informado)')
+    parser.add_argument('--strategy', type=str, default='default', choices=distributed.STRATEGIES,
+                        help='Distribuição do treino: mirrored = dispositivos locais; multiworker = processos/'
+                             'máquinas do TF_CONFIG (ver launch_local.py)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Capturar um trace do profiler do TensorBoard durante o treino')
+    parser.add_argument('--profile-steps', type=str, default='10,20',
+                        help='Intervalo de passos (início,fim) capturado pelo --profile')
+    parser.add_argument('--timeline', type=str,
+                        help='Arquivo JSON da linha do tempo da execução (padrão: <output-dir>/<modelo>_timeline.json)')
     parser.add_argument('--save-to-s3', action='store_true', help='Salvar modelo no S3')
     parser.add_argument('--s3-bucket', type=str, help='Bucket S3 para salvar modelo')
+    parser.add_argument('--s3-endpoint-url', type=str, help='Endpoint S3 alternativo (ex.: MinIO local)')
+    parser.add_argument('--upload-workers', type=int, default=8, help='Uploads simultâneos para o S3')
     parser.add_argument('--supabase-url', type=str, help='URL do Supabase para registrar métricas')
     parser.add_argument('--supabase-key', type=str, help='Chave do Supabase para registrar métricas')
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
-def create_model(model_type: str, input_shape: tuple, num_classes: int):
-    """Cria o modelo de detecção com base em uma arquitetura pré-treinada"""
-    print(f"Criando modelo baseado em {model_type}...")
-    
+def create_backbone(model_type: str, input_shape: tuple, weights='imagenet'):
+    """Cria o backbone pré-treinado congelado"""
+    from tensorflow.keras import applications
     # Seleção do modelo base
     if model_type == 'mobilenet':
         base_model = applications.MobileNetV2(
-            weights='imagenet', include_top=False, input_shape=input_shape)
+            weights=weights, include_top=False, input_shape=input_shape)
     elif model_type == 'resnet':
         base_model = applications.ResNet50V2(
-            weights='imagenet', include_top=False, input_shape=input_shape)
+            weights=weights, include_top=False, input_shape=input_shape)
     elif model_type == 'efficientnet':
         base_model = applications.EfficientNetB0(
-            weights='imagenet', include_top=False, input_shape=input_shape)
+            weights=weights, include_top=False, input_shape=input_shape)
     else:
         raise ValueError(f"Tipo de modelo inválido: {model_type}")
     
     # Congelar camadas do modelo base para transferência de aprendizado
     base_model.trainable = False
-    
-    # Construir modelo completo
-    model = models.Sequential([
-        base_model,
-        layers.GlobalAveragePooling2D(),
+    return base_model
+
+def create_head(num_classes: int):
+    """Camadas de classificação treinadas sobre os embeddings do backbone"""
+    from tensorflow.keras import layers
+    return [
         layers.BatchNormalization(),
         layers.Dropout(0.5),
         layers.Dense(512, activation='relu'),
         layers.BatchNormalization(),
         layers.Dropout(0.3),
-        layers.Dense(num_classes, activation='softmax')
-    ])
+        # float32 mesmo com precisão mista, para probabilidades e perda estáveis
+        layers.Dense(num_classes, activation='softmax', dtype='float32')
+    ]
+
+def compile_model(model, compile_options=None, learning_rate=0.001):
+    """Compila o modelo com otimizador, perda e métricas do projeto
     
-    # Compilar modelo
+    compile_options são repassados ao compile (ex.: jit_compile, steps_per_execution).
+    """
+    import tensorflow as tf
     model.compile(
-        optimizer=optimizers.Adam(),
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
         loss='categorical_crossentropy',
-        metrics=['accuracy', tf.keras.metrics.Precision(), tf.keras.metrics.Recall()]
+        metrics=['accuracy', tf.keras.metrics.Precision(), tf.keras.metrics.Recall()],
+        **(compile_options or {})
     )
-    
     return model
 
-def create_data_generators(train_dir, val_dir, batch_size, image_size):
-    """Cria geradores de dados para treinamento e validação"""
+def create_model(model_type: str, input_shape: tuple, num_classes: int, head_layers=None, weights='imagenet',
+                 compile_options=None, learning_rate=0.001):
+    """Cria o modelo de detecção com base em uma arquitetura pré-treinada
+    
+    head_layers permite reaproveitar camadas de cabeça já treinadas (ex.: sobre features em cache).
+    weights=None cria o backbone sem baixar pesos (ex.: benchmarks offline).
+    """
+    from tensorflow.keras import layers, models
+    print(f"Criando modelo baseado em {model_type}...")
+    
+    base_model = create_backbone(model_type, input_shape, weights)
+    
+    # Construir modelo completo
+    model = models.Sequential([
+        base_model,
+        layers.GlobalAveragePooling2D(),
+        *(head_layers or create_head(num_classes))
+    ])
+    
+    return compile_model(model, compile_options, learning_rate)
+
+def create_feature_head(feature_dim: int, num_classes: int, compile_options=None, learning_rate=0.001):
+    """Cria a cabeça de classificação isolada, com entrada nos embeddings do backbone"""
+    from tensorflow.keras import layers, models
+    head_layers = create_head(num_classes)
+    head_model = models.Sequential([layers.InputLayer(input_shape=(feature_dim,)), *head_layers])
+    return compile_model(head_model, compile_options, learning_rate), head_layers
+
+def create_data_generators(train_dir, val_dir, batch_size, image_size, data_format='directory',
+                           loader='keras', cache=None, augment=True, strategy=None):
+    """Cria geradores de dados para treinamento e validação
+    
+    batch_size é o lote global. Com strategy (multiworker, apenas tf.data), os dados de
+    treino são divididos entre os workers e cada réplica recebe lotes de
+    batch_size / réplicas (distribute_tfdata_loader).
+    """
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+    from loaders import ShardSequence, AUGMENTATION, make_tfdata_loader, distribute_tfdata_loader
+    
+    # Pipeline tf.data: decodificação e aumentação paralelas com prefetch
+    if loader == 'tfdata':
+        def make_train_loader(train_batch_size, num_shards=1, shard_index=0):
+            return make_tfdata_loader(train_dir, train_batch_size, image_size, data_format,
+                                      training=augment, cache=cache and _split_cache(cache, 'train'),
+                                      num_shards=num_shards, shard_index=shard_index)
+        
+        if strategy is not None:
+            train_generator = distribute_tfdata_loader(strategy, make_train_loader, batch_size)
+        else:
+            train_generator = make_train_loader(batch_size)
+        val_generator = make_tfdata_loader(val_dir, batch_size, image_size, data_format,
+                                           training=False, cache=cache and _split_cache(cache, 'val'))
+        return train_generator, val_generator, train_generator.class_indices
     
     # Aumentação de dados para conjunto de treinamento
-    train_datagen = ImageDataGenerator(
-        rescale=1./255,
-        rotation_range=20,
-        width_shift_range=0.2,
-        height_shift_range=0.2,
-        shear_range=0.2,
-        zoom_range=0.2,
-        horizontal_flip=True,
-        fill_mode='nearest'
-    )
+    if augment:
+        train_datagen = ImageDataGenerator(rescale=1./255, fill_mode='nearest', **AUGMENTATION)
+    else:
+        train_datagen = ImageDataGenerator(rescale=1./255)
     
     # Apenas normalização para conjunto de validação
     val_datagen = ImageDataGenerator(rescale=1./255)
     
+    # Shards .npy: leitura por mmap, sem abrir e decodificar JPEGs a cada época
+    if data_format == 'shards':
+        train_generator = ShardSequence(train_dir, batch_size, image_size, shuffle=True,
+                                        augmenter=train_datagen if augment else None)
+        val_generator = ShardSequence(val_dir, batch_size, image_size, shuffle=False)
+        return train_generator, val_generator, train_generator.class_indices
+    
     # Geradores
     train_generator = train_datagen.flow_from_directory(
         train_dir,
@@ -113,15 +215,62 @@ def create_data_generators(train_dir, val_dir, batch_size, image_size):
     
     return train_generator, val_generator, train_generator.class_indices
 
-def train_model(model, train_generator, val_generator, epochs, output_dir, model_name):
-    """Treina o modelo usando os geradores de dados"""
+def _split_cache(cache, split):
+    """Separa o cache em disco do tf.data por conjunto ('memory' é mantido)"""
+    return cache if cache == 'memory' else os.path.join(cache, split)
+
+def make_throughput_logger():
+    """Callback Keras que mede passos de treinamento por segundo e o tempo por passo em cada época e registra no histórico
+    
+    Com steps_per_execution > 1 o Keras chama os callbacks uma vez a cada bloco de
+    passos; batch é o índice do último passo do bloco.
+    """
+    import tensorflow as tf
+    
+    class ThroughputLogger(tf.keras.callbacks.Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self._steps = 0
+            self._start = time.perf_counter()
+            self._last = self._start
+        
+        def on_train_batch_end(self, batch, logs=None):
+            self._steps = batch + 1
+            self._last = time.perf_counter()
+        
+        def on_epoch_end(self, epoch, logs=None):
+            elapsed = max(self._last - self._start, 1e-9)
+            if logs is not None:
+                logs['steps_per_sec'] = self._steps / elapsed
+                logs['step_time_ms'] = elapsed * 1000 / max(self._steps, 1)
+            print(f"Época {epoch + 1}: {self._steps / elapsed:.2f} passos/s "
+                  f"({elapsed * 1000 / max(self._steps, 1):.1f} ms/passo)")
+    
+    return ThroughputLogger()
+
+def train_model(model, train_generator, val_generator, epochs, output_dir, model_name, export_model=None,
+                profile_steps=None, run_config=None, initial_epoch=0, save_final=True, verbose=1, checkpointer=None):
+    """Treina o modelo usando os geradores de dados
+    
+    export_model é o modelo salvo como final quando model é só a cabeça (features em cache).
+    profile_steps=(início, fim) captura um trace do profiler do TensorBoard nesses passos.
+    run_config (ex.: XLA, precisão, steps_per_execution) é gravado em colunas do histórico.
+    initial_epoch > 0 continua um treino (épocas initial_epoch..epochs), acrescentando ao
+    histórico; save_final=False não grava o modelo final (ex.: rodadas de um sweep).
+    checkpointer (checkpointing.TrainingCheckpoint) grava checkpoints periódicos e, se
+    tiver resume=True, retoma o treino do último deles (inclusive no meio de uma época).
+    """
+    import pandas as pd
+    from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
+    from loaders import model_input
+    import checkpointing
     
     # Criar diretório de saída se não existir
     os.makedirs(output_dir, exist_ok=True)
     
     # Callbacks para melhor treinamento
+    best_name = f"{model_name}_head_best.h5" if export_model is not None else f"{model_name}_best.h5"
     checkpoint = ModelCheckpoint(
-        os.path.join(output_dir, f"{model_name}_best.h5"),
+        os.path.join(output_dir, best_name),
         monitor='val_accuracy',
         save_best_only=True,
         mode='max',
@@ -143,213 +292,322 @@ def train_model(model, train_generator, val_generator, epochs, output_dir, model
         verbose=1
     )
     
+    callbacks = [make_throughput_logger(), instrumentation.make_step_timer(), checkpoint, early_stopping, reduce_lr]
+    if profile_steps:
+        log_dir = os.path.join(output_dir, 'logs', model_name)
+        callbacks.append(instrumentation.make_profiler_callback(log_dir, *profile_steps))
+    
+    resume_step = 0
+    if checkpointer is not None:
+        # Por último: registra o estado já atualizado dos demais callbacks
+        callbacks.append(checkpointer)
+        checkpointer.attach(model, train_generator, callbacks)
+        if checkpointer.resume:
+            initial_epoch, resume_step = checkpointer.restore()
+    first_epoch = initial_epoch
+    
+    # Época interrompida no meio: conclui os lotes restantes antes das épocas seguintes
+    partial = None
+    if resume_step:
+        with instrumentation.stage('train/fit_resume', epoch=initial_epoch, step=resume_step):
+            partial = model.fit(
+                model_input(instrumentation.timed_loader(checkpointing.skip_batches(train_generator, resume_step))),
+                epochs=initial_epoch + 1,
+                initial_epoch=initial_epoch,
+                validation_data=model_input(val_generator),
+                callbacks=callbacks,
+                shuffle=False,
+                verbose=verbose
+            )
+        initial_epoch += 1
+    
     # Treinar modelo
-    history = model.fit(
-        train_generator,
-        epochs=epochs,
-        validation_data=val_generator,
-        callbacks=[checkpoint, early_stopping, reduce_lr]
-    )
+    if partial is None or (initial_epoch < epochs and not early_stopping.stopped_epoch):
+        with instrumentation.stage('train/fit', epochs=epochs):
+            history = model.fit(
+                model_input(instrumentation.timed_loader(train_generator)),
+                # Datasets distribuídos (multiworker) não têm cardinalidade
+                steps_per_epoch=getattr(train_generator, 'steps_per_epoch', None),
+                epochs=epochs,
+                initial_epoch=initial_epoch,
+                validation_data=model_input(val_generator),
+                callbacks=callbacks,
+                # Os loaders já embaralham a cada época; a ordem dos lotes deve ser a do índice
+                # para que uma retomada pule exatamente os lotes já treinados
+                shuffle=False,
+                verbose=verbose
+            )
+        if partial is not None:
+            history = checkpointing.merge_histories(partial, history)
+    else:
+        history = partial
     
     # Salvar modelo final
-    model.save(os.path.join(output_dir, f"{model_name}_final.h5"))
-    model.save(os.path.join(output_dir, f"{model_name}_final_tf"), save_format='tf')
-    
-    # Salvar histórico de treinamento
-    hist_df = pd.DataFrame(history.history)
+    if save_final:
+        final_model = export_model if export_model is not None else model
+        with instrumentation.stage('train/save_model'):
+            final_model.save(os.path.join(output_dir, f"{model_name}_final.h5"))
+            final_model.save(os.path.join(output_dir, f"{model_name}_final_tf"), save_format='tf')
+    
+    # Salvar histórico de treinamento (com as épocas anteriores a uma retomada)
+    if checkpointer is not None:
+        history = checkpointing.with_restored_history(history, checkpointer)
+        first_epoch -= checkpointer.restored_epochs
+    hist_df = pd.DataFrame(history.history, index=range(first_epoch, first_epoch + len(history.epoch)))
+    for key, value in (run_config or {}).items():
+        hist_df[key] = value
     hist_csv_file = os.path.join(output_dir, f"{model_name}_history.csv")
-    hist_df.to_csv(hist_csv_file)
+    append = first_epoch > 0 and os.path.exists(hist_csv_file)
+    hist_df.to_csv(hist_csv_file, mode='a' if append else 'w', header=not append)
+    
+    # Treino concluído: os checkpoints retomáveis não são mais necessários
+    if checkpointer is not None and save_final:
+        checkpointer.finish()
     
     return history, model
 
-def evaluate_model(model, val_generator, class_indices, output_dir, model_name):
-    """Avalia o modelo e gera métricas"""
-    
-    # Inverter mapeamento de classes
-    class_labels = {v: k for k, v in class_indices.items()}
+def evaluate_model(model, val_generator, class_indices, output_dir, model_name, history):
+    """Avalia o modelo e gera métricas, matriz de confusão e curvas do histórico de treino"""
+    from loaders import model_input
     
     # Gerar predições
-    y_pred_prob = model.predict(val_generator)
+    start = time.perf_counter()
+    y_pred_prob = model.predict(model_input(val_generator))
+    instrumentation.timeline.event('train/predict', start, time.perf_counter() - start)
+    print(f"Predição: {len(val_generator) / (time.perf_counter() - start):.2f} passos/s")
     y_pred = np.argmax(y_pred_prob, axis=1)
+    metrics_start = time.perf_counter()
     
-    # Obter rótulos reais
-    y_true = val_generator.classes
-    
-    # Calcular métricas
-    accuracy = accuracy_score(y_true, y_pred)
-    precision = precision_score(y_true, y_pred, average='weighted')
-    recall = recall_score(y_true, y_pred, average='weighted')
-    f1 = f1_score(y_true, y_pred, average='weighted')
-    
-    print(f"Accuracy: {accuracy:.4f}")
-    print(f"Precision: {precision:.4f}")
-    print(f"Recall: {recall:.4f}")
-    print(f"F1 Score: {f1:.4f}")
-    
-    # Relatório completo
-    report = classification_report(y_true, y_pred, target_names=list(class_indices.keys()), output_dict=True)
-    
-    # Matriz de confusão
-    cm = confusion_matrix(y_true, y_pred)
-    
-    # Plotar matriz de confusão
-    plt.figure(figsize=(10, 8))
-    plt.imshow(cm, interpolation='nearest', cmap=plt.cm.Blues)
-    plt.title('Matriz de Confusão')
-    plt.colorbar()
-    tick_marks = np.arange(len(class_indices))
-    plt.xticks(tick_marks, [class_labels[i] for i in range(len(class_labels))], rotation=45)
-    plt.yticks(tick_marks, [class_labels[i] for i in range(len(class_labels))])
-    plt.tight_layout()
-    plt.ylabel('Rótulo Verdadeiro')
-    plt.xlabel('Rótulo Predito')
-    plt.savefig(os.path.join(output_dir, f"{model_name}_confusion_matrix.png"))
-    
-    # Histórico de acurácia e perda
-    plt.figure(figsize=(12, 5))
-    plt.subplot(1, 2, 1)
-    plt.plot(history.history['accuracy'])
-    plt.plot(history.history['val_accuracy'])
-    plt.title('Acurácia do Modelo')
-    plt.ylabel('Acurácia')
-    plt.xlabel('Época')
-    plt.legend(['Treino', 'Validação'], loc='lower right')
-    
-    plt.subplot(1, 2, 2)
-    plt.plot(history.history['loss'])
-    plt.plot(history.history['val_loss'])
-    plt.title('Perda do Modelo')
-    plt.ylabel('Perda')
-    plt.xlabel('Época')
-    plt.legend(['Treino', 'Validação'], loc='upper right')
-    plt.tight_layout()
-    plt.savefig(os.path.join(output_dir, f"{model_name}_training_history.png"))
+    # Calcular métricas sobre os rótulos reais
+    metrics = reporting.classification_metrics(val_generator.classes, y_pred, class_indices, model_name)
+    metrics['training_date'] = datetime.now().isoformat()
     
-    # Salvar métricas em JSON
-    metrics = {
-        'model_name': model_name,
-        'accuracy': float(accuracy),
-        'precision': float(precision),
-        'recall': float(recall),
-        'f1_score': float(f1),
-        'class_report': report,
-        'confusion_matrix': cm.tolist(),
-        'training_date': datetime.now().isoformat(),
-        'number_of_classes': len(class_indices),
-        'classes': list(class_indices.keys()),
-    }
+    # Matriz de confusão e histórico de acurácia e perda
+    reporting.plot_confusion_matrix(metrics['confusion_matrix'], class_indices,
+                                    os.path.join(output_dir, f"{model_name}_confusion_matrix.png"))
+    reporting.plot_history(history.history, os.path.join(output_dir, f"{model_name}_training_history.png"))
     
+    # Salvar métricas em JSON
     with open(os.path.join(output_dir, f"{model_name}_metrics.json"), 'w') as f:
         json.dump(metrics, f, indent=2)
+    instrumentation.timeline.event('train/metrics', metrics_start, time.perf_counter() - metrics_start)
     
     return metrics
 
-def save_to_s3(local_dir, s3_bucket, s3_prefix, model_name):
-    """Salva modelo e artefatos no S3"""
-    s3 = boto3.client('s3')
-    
-    # Listar arquivos para upload
-    files_to_upload = []
+def model_artifacts(local_dir, model_name):
+    """Arquivos publicados de um modelo: nome relativo -> caminho local
+
+    Inclui o SavedModel, históricos, relatórios e variantes exportadas. Os .h5 (final e
+    melhor época) duplicam o SavedModel e só entram quando ele não existe; checkpoints
+    retomáveis ficam de fora.
+    """
+    has_saved_model = os.path.isdir(os.path.join(local_dir, f"{model_name}_final_tf"))
+    artifacts = {}
     for root, dirs, files in os.walk(local_dir):
+        dirs[:] = [d for d in dirs if d != 'checkpoints']
         for file in files:
-            if model_name in file:  # Só enviar arquivos relacionados ao modelo atual
-                local_path = os.path.join(root, file)
-                # Caminho relativo no S3
-                s3_path = os.path.join(s3_prefix, file)
-                files_to_upload.append((local_path, s3_path))
-    
-    # Upload de cada arquivo
-    for local_path, s3_path in files_to_upload:
-        print(f"Enviando {local_path} para s3://{s3_bucket}/{s3_path}")
-        s3.upload_file(local_path, s3_bucket, s3_path)
-    
-    # URL do modelo no S3
-    model_path = f"s3://{s3_bucket}/{s3_prefix}/{model_name}_final_tf"
+            local_path = os.path.join(root, file)
+            name = os.path.relpath(local_path, local_dir).replace(os.sep, '/')
+            if model_name not in name:  # Só arquivos relacionados ao modelo atual
+                continue
+            if has_saved_model and file.endswith('.h5'):
+                continue
+            artifacts[name] = local_path
+    return artifacts
+
+def save_to_s3(local_dir, s3_bucket, s3_prefix, model_name, workers=8, endpoint_url=None):
+    """Publica modelo e artefatos no S3, endereçados por conteúdo
+
+    Os arquivos vão para <raiz>/blobs/sha256/ (raiz = pai de s3_prefix), compartilhados
+    entre versões: o que não mudou desde uma publicação anterior não é reenviado. Retorna
+    a URL do manifesto da versão (s3_prefix/manifest.json), que lista os arquivos.
+    """
+    from s3_sync import publish_artifacts
+    artifacts = model_artifacts(local_dir, model_name)
+    root, version = posixpath.split(s3_prefix.rstrip('/'))
+    manifest = publish_artifacts(artifacts, s3_bucket, root, version, workers=workers, endpoint_url=endpoint_url,
+                                 metadata={'model_name': model_name,
+                                           'saved_model': f"{model_name}_final_tf"})
+    
+    # URL do manifesto do modelo no S3
+    model_path = f"s3://{s3_bucket}/{manifest['manifest_key']}"
     print(f"Modelo salvo em: {model_path}")
     return model_path
 
-def register_metrics_to_supabase(supabase_url, supabase_key, metrics, model_path):
-    """Registra métricas do modelo no Supabase"""
-    if not supabase_url or not supabase_key:
-        print("Aviso: URL ou chave do Supabase não fornecidos, métricas não serão registradas.")
-        return
-    
-    import requests
-    
-    # Preparar dados para inserção
-    data = {
-        'model_name': metrics['model_name'],
-        'version': datetime.now().strftime("%Y%m%d_%H%M%S"),
-        'accuracy': metrics['accuracy'],
-        'precision': metrics['precision'],
-        'recall': metrics['recall'],
-        'f1_score': metrics['f1_score'],
-        'parameters': {
-            'classes': metrics['classes'],
-            'number_of_classes': metrics['number_of_classes']
-        },
-        'training_date': metrics['training_date'],
-        'model_path': model_path
-    }
-    
-    # Enviar dados para Supabase
-    try:
-        response = requests.post(
-            f"{supabase_url}/rest/v1/model_metrics",
-            json=data,
-            headers={
-                'apikey': supabase_key,
-                'Authorization': f'Bearer {supabase_key}',
-                'Content-Type': 'application/json',
-                'Prefer': 'return=representation'
-            }
-        )
-        
-        if response.status_code == 201:
-            print("Métricas registradas com sucesso no Supabase.")
-        else:
-            print(f"Erro ao registrar métricas: {response.status_code} - {response.text}")
-    
-    except Exception as e:
-        print(f"Erro ao conectar ao Supabase: {e}")
+def profile_steps(args):
+    """Intervalo de passos do trace do profiler, ou None sem --profile"""
+    return tuple(int(step) for step in args.profile_steps.split(',')) if args.profile else None
+
+def make_checkpointer(args, output_dir, model_name):
+    """Checkpoints retomáveis da execução em <checkpoint-dir>/<modelo>
 
-def main():
-    args = parse_arguments()
+    Workers não-chief gravam no seu diretório temporário, mas retomam dos checkpoints
+    do chief. A escrita assíncrona só é usada sem --strategy (as gravações distribuídas
+    são operações coletivas).
+    """
+    import checkpointing
+    root = checkpointing.checkpoint_root(args, output_dir)
+    directory = os.path.join(root, model_name)
+    write_dir = directory if distributed.is_chief() else os.path.join(args.output_dir, 'checkpoints', model_name)
+    return checkpointing.TrainingCheckpoint(
+        write_dir, every_steps=args.checkpoint_steps, every_minutes=args.checkpoint_minutes,
+        max_to_keep=args.checkpoint_keep, async_write=not args.checkpoint_sync and args.strategy == 'default',
+        resume=bool(args.resume), restore_directory=directory)
+
+def train_on_cached_features(args, train_dir, val_dir, input_shape, class_indices, val_generator, model_name,
+                             checkpointer=None):
+    """Treina apenas a cabeça sobre embeddings do backbone congelado, calculados uma única vez
+    
+    Retorna o histórico, a cabeça treinada, a Sequence de validação sobre features e o
+    modelo completo (backbone + cabeça), que é salvo como modelo final.
+    """
+    from tensorflow.keras import layers, models
+    from feature_cache import FeatureStore, FeatureSequence
+    backbone = create_backbone(args.model_type, input_shape)
+    extractor = models.Sequential([backbone, layers.GlobalAveragePooling2D()])
+    extractor.compile(**acceleration.batch_options(args))
+    store = FeatureStore(args.feature_cache_dir or os.path.join(args.data_dir, 'features'),
+                         args.model_type, args.image_size, precision=args.mixed_precision)
+    
+    # Treino: uma passada sem aumentação ou K passadas aumentadas
+    augmented = args.augment_variants > 0
+    train_loader, _, _ = create_data_generators(
+        train_dir, val_dir, args.batch_size, args.image_size, args.data_format,
+        args.loader, args.tfdata_cache, augment=augmented)
+    with instrumentation.stage('train/extract_features'):
+        train_features, train_labels = store.get_or_build(
+            'train', extractor, train_loader, passes=max(1, args.augment_variants),
+            augmented=augmented, refresh=args.refresh_features)
+        val_features, val_labels = store.get_or_build(
+            'val', extractor, val_generator, refresh=args.refresh_features)
+    
+    train_seq = FeatureSequence(train_features, train_labels, class_indices, args.batch_size, shuffle=True)
+    val_seq = FeatureSequence(val_features, val_labels, class_indices, args.batch_size)
+    
+    head_model, head_layers = create_feature_head(train_features.shape[1], len(class_indices),
+                                                  acceleration.compile_options(args), args.learning_rate)
+    head_model.summary()
+    
+    # Modelo completo compartilha as camadas da cabeça para exportação
+    full_model = compile_model(models.Sequential([backbone, layers.GlobalAveragePooling2D(), *head_layers]),
+                               acceleration.compile_options(args))
+    history, _ = train_model(head_model, train_seq, val_seq, args.epochs, args.output_dir,
+                             model_name, export_model=full_model, profile_steps=profile_steps(args),
+                             run_config=acceleration.describe(args), checkpointer=checkpointer)
+    return history, head_model, val_seq, full_model
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    
+    # A estratégia precisa existir antes de qualquer operação do TensorFlow
+    strategy = distributed.create_strategy(args.strategy)
+    if args.strategy != 'default':
+        if args.feature_cache:
+            print("Erro: --feature-cache treina só a cabeça e não é suportado com --strategy")
+            sys.exit(1)
+        if args.strategy == 'multiworker' and args.loader != 'tfdata':
+            print("Erro: --strategy multiworker exige --loader tfdata (dados divididos por worker)")
+            sys.exit(1)
+    batch_size = distributed.global_batch_size(args.batch_size, strategy)
+    num_shards, shard_index = distributed.worker_shard() if args.strategy == 'multiworker' else (1, 0)
+    chief = distributed.is_chief()
+    # Só o chief grava em --output-dir; os demais workers gravam em um diretório temporário
+    output_dir = args.output_dir
+    args.output_dir = distributed.worker_output_dir(output_dir)
+    if args.strategy != 'default':
+        print(f"Estratégia {args.strategy}: {strategy.num_replicas_in_sync} réplicas, lote global {batch_size} "
+              f"({args.batch_size} por réplica), worker {shard_index + 1}/{num_shards}{' (chief)' if chief else ''}")
     
     # Definir diretórios
-    train_dir = os.path.join(args.data_dir, 'images_train')
-    val_dir = os.path.join(args.data_dir, 'images_test')
+    prefix = 'shards' if args.data_format == 'shards' else 'images'
+    # Com várias resoluções preparadas (--extra-sizes), usar a de --image-size
+    train_dir = resolve_size_dir(os.path.join(args.data_dir, f'{prefix}_train'), args.image_size)
+    val_dir = resolve_size_dir(os.path.join(args.data_dir, f'{prefix}_test'), args.image_size)
     model_name = f"safewatch_{args.model_type}_{datetime.now().strftime('%Y%m%d_%H%M')}"
+    if args.resume:
+        import checkpointing
+        # A execução retomada mantém o nome, os checkpoints e o histórico da original
+        resumed = checkpointing.find_run(checkpointing.checkpoint_root(args, output_dir), args.resume)
+        if resumed is None:
+            print(f"Aviso: nenhuma execução para retomar ({args.resume}); iniciando {model_name}")
+        else:
+            model_name = resumed
+    instrumentation.start_run(model_name)
+    
+    # Política de precisão antes de criar qualquer modelo
+    acceleration.configure(args)
     
     # Criar geradores de dados
-    train_generator, val_generator, class_indices = create_data_generators(
-        train_dir, val_dir, args.batch_size, args.image_size)
+    with instrumentation.stage('train/load_data'):
+        train_generator, val_generator, class_indices = create_data_generators(
+            train_dir, val_dir, batch_size, args.image_size, args.data_format, args.loader, args.tfdata_cache,
+            strategy=strategy if args.strategy == 'multiworker' else None)
     
     print(f"Classes encontradas: {class_indices}")
     
     # Criar modelo
     input_shape = (args.image_size, args.image_size, 3)
-    model = create_model(args.model_type, input_shape, len(class_indices))
+    image_val_generator = val_generator
+    if args.feature_cache:
+        history, model, val_generator, final_model = train_on_cached_features(
+            args, train_dir, val_dir, input_shape, class_indices, val_generator, model_name,
+            make_checkpointer(args, output_dir, model_name))
+    else:
+        with strategy.scope():
+            model = create_model(args.model_type, input_shape, len(class_indices),
+                                 compile_options=acceleration.compile_options(args),
+                                 learning_rate=args.learning_rate)
+        
+        # Resumo do modelo
+        model.summary()
+        
+        # Treinar modelo
+        history, model = train_model(model, train_generator, val_generator, 
+                                  args.epochs, args.output_dir, model_name, profile_steps=profile_steps(args),
+                                  run_config=acceleration.describe(args),
+                                  checkpointer=make_checkpointer(args, output_dir, model_name))
+        final_model = model
     
-    # Resumo do modelo
-    model.summary()
+    # Avaliar modelo
+    metrics = evaluate_model(model, val_generator, class_indices, args.output_dir, model_name, history)
     
-    # Treinar modelo
-    global history  # Para uso na função evaluate_model
-    history, model = train_model(model, train_generator, val_generator, 
-                              args.epochs, args.output_dir, model_name)
+    if not chief:
+        # Workers não-chief só participam do treino e das gravações coletivas
+        distributed.cleanup_output_dir(args.output_dir, output_dir)
+        print(f"Worker {shard_index} concluído")
+        return
     
-    # Avaliar modelo
-    metrics = evaluate_model(model, val_generator, class_indices, args.output_dir, model_name)
+    # Exportar variantes quantizadas, com latência e acurácia de cada uma
+    if args.export:
+        from export import export_variants, representative_images
+        with instrumentation.stage('train/export', variants=','.join(args.export)):
+            # O TFLite não converte camadas em precisão mista; a comparação das variantes
+            # roda lote a lote (predict_on_batch)
+            export_model = acceleration.with_precision(final_model, 'float32')
+            export_model.compile(**acceleration.batch_options(args))
+            calibration = representative_images(train_dir, args.data_format, args.image_size,
+                                                args.calibration_samples)
+            export_variants(export_model, args.output_dir, model_name, image_val_generator, calibration,
+                            args.export, args.accuracy_budget, args.batch_size)
     
     # Salvar no S3 se solicitado
     model_path = None
     if args.save_to_s3 and args.s3_bucket:
         s3_prefix = f"models/{model_name}"
-        model_path = save_to_s3(args.output_dir, args.s3_bucket, s3_prefix, model_name)
+        with instrumentation.stage('train/upload'):
+            model_path = save_to_s3(args.output_dir, args.s3_bucket, s3_prefix, model_name,
+                                    args.upload_workers, args.s3_endpoint_url)
     
     # Registrar métricas no Supabase
-    register_metrics_to_supabase(args.supabase_url, args.supabase_key, metrics, model_path)
+    with instrumentation.stage('train/supabase'):
+        reporting.register_metrics_to_supabase(args.supabase_url, args.supabase_key, metrics,
+                                               spool_dir=os.path.join(args.output_dir, 'metrics_spool'),
+                                               model_path=model_path)
+    
+    instrumentation.timeline.print_summary()
+    instrumentation.timeline.save(args.timeline or os.path.join(args.output_dir, f"{model_name}_timeline.json"))
+    # Espera (com limite) o envio das métricas; o que faltar fica no spool, junto dos artefatos
+    metrics_client.close_all()
     
     print(f"Treinamento concluído! Modelo salvo como {model_name}")
 
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# ml/video_ingest.py - Leitura de vídeos (MP4/TS/HLS) como fluxo de frames amostrados
+
+import os
+import bisect
+import numpy as np
+import cv2
+from typing import Dict, Iterator, List, Optional, Tuple
+from metadata_io import iter_metadata
+
+VIDEO_EXTENSIONS = ('.mp4', '.ts', '.m3u8', '.mkv', '.mov', '.avi')
+
+def is_video(path: str) -> bool:
+    return path.lower().endswith(VIDEO_EXTENSIONS)
+
+def parse_m3u8(playlist_path: str) -> List[Tuple[str, float]]:
+    """Lista os segmentos (caminho, duração em segundos) de uma playlist HLS de mídia"""
+    base_dir = os.path.dirname(playlist_path)
+    segments = []
+    duration = 0.0
+    with open(playlist_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line and not line.startswith('#'):
+                segments.append((os.path.normpath(os.path.join(base_dir, line)), duration))
+                duration = 0.0
+    return segments
+
+def group_video_inputs(paths: List[str]) -> List[str]:
+    """Remove segmentos .ts já referenciados por uma playlist .m3u8 presente na lista"""
+    referenced = set()
+    for path in paths:
+        if path.lower().endswith('.m3u8'):
+            referenced.update(os.path.abspath(segment) for segment, _ in parse_m3u8(path))
+    return [p for p in paths if os.path.abspath(p) not in referenced]
+
+def _open_segments(path: str) -> List[Tuple[str, float]]:
+    """Segmentos de uma fonte com o deslocamento inicial de cada um no tempo da fonte"""
+    if not path.lower().endswith('.m3u8'):
+        return [(path, 0.0)]
+    segments, offset = [], 0.0
+    for segment, duration in parse_m3u8(path):
+        segments.append((segment, offset))
+        offset += duration
+    return segments
+
+def _signature(frame: np.ndarray) -> np.ndarray:
+    """Miniatura em tons de cinza usada para detectar mudança de cena"""
+    small = cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+def iter_video_frames(path: str, sample_fps: Optional[float] = 1.0,
+                      scene_threshold: Optional[float] = None) -> Iterator[Tuple[float, np.ndarray]]:
+    """Decodifica uma fonte de vídeo em fluxo e produz (timestamp em s, frame BGR) amostrados
+
+    Com sample_fps, só os frames no ritmo pedido são convertidos (os demais são apenas
+    avançados com grab). Com scene_threshold, um frame candidato só é emitido se a
+    diferença média de intensidade (0-255) para o último frame emitido passar do limiar.
+    Playlists .m3u8 são lidas segmento a segmento, com timestamps contínuos.
+    """
+    last_signature = None
+    next_time = 0.0
+    for segment, offset in _open_segments(path):
+        capture = cv2.VideoCapture(segment)
+        if not capture.isOpened():
+            raise ValueError(f"Não foi possível abrir o vídeo: {segment}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+        index = 0
+        try:
+            while capture.grab():
+                position = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                if position <= 0 and fps > 0:
+                    position = index / fps
+                timestamp = offset + position
+                index += 1
+                if sample_fps and timestamp + 1e-6 < next_time:
+                    continue
+                ok, frame = capture.retrieve()
+                if not ok:
+                    continue
+                if sample_fps:
+                    next_time = max(next_time + 1.0 / sample_fps, timestamp)
+                if scene_threshold is not None:
+                    signature = _signature(frame)
+                    if last_signature is not None and \
+                            float(np.mean(np.abs(signature - last_signature))) < scene_threshold:
+                        continue
+                    last_signature = signature
+                yield timestamp, frame
+        finally:
+            capture.release()
+
+class TimeRangeLabels:
+    """Rótulos por intervalo de tempo de cada fonte de vídeo
+
+    Lidos de CSV/JSONL/Parquet com as colunas source (nome do arquivo de vídeo),
+    start, end (segundos) e label. Intervalos são fechados no início e abertos no fim.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.ranges: Dict[str, List[Tuple[float, float, str]]] = {}
+        if path:
+            for df in iter_metadata(path, columns=['source', 'start', 'end', 'label']):
+                for source, start, end, label in df.itertuples(index=False):
+                    self.ranges.setdefault(os.path.basename(source), []).append((float(start), float(end), label))
+            for intervals in self.ranges.values():
+                intervals.sort()
+        self._starts = {source: [start for start, _, _ in intervals] for source, intervals in self.ranges.items()}
+
+    def __contains__(self, source: str) -> bool:
+        return os.path.basename(source) in self.ranges
+
+    def label_at(self, source: str, timestamp: float) -> Optional[str]:
+        source = os.path.basename(source)
+        intervals = self.ranges.get(source)
+        if not intervals:
+            return None
+        i = bisect.bisect_right(self._starts[source], timestamp) - 1
+        # Intervalos podem se sobrepor; procurar do mais recente para trás
+        while i >= 0:
+            start, end, label = intervals[i]
+            if start <= timestamp < end:
+                return label
+            i -= 1
+        return None
+
+    def labels(self) -> List[str]:
+        return sorted({label for intervals in self.ranges.values() for _, _, label in intervals})
+
+def frame_filename(source: str, timestamp: float) -> str:
+    """Nome do frame processado: <vídeo>_<timestamp em ms>.jpg"""
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return f"{stem}_{int(round(timestamp * 1000)):010d}.jpg"
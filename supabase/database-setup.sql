@@ -112,6 +112,40 @@ CREATE TABLE IF NOT EXISTS public.model_metrics (
   created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
 );
 
+-- Superseded model_metrics rows, kept when model_name became unique (see migration below)
+CREATE TABLE IF NOT EXISTS public.model_metrics_history (
+  LIKE public.model_metrics INCLUDING DEFAULTS,
+  archived_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
+
+-- Migration: one row per model in model_metrics.
+-- Metrics are upserted on model_name (Prefer: resolution=merge-duplicates, on_conflict=model_name),
+-- which needs a unique index. Databases created before this change may already hold several rows
+-- per model_name (one per training run). The migration runs only while the index is missing, in a
+-- single transaction: the most recent row of each model_name (by created_at, then id) stays in
+-- model_metrics, older ones are moved to model_metrics_history, then the index is created.
+-- Nothing is deleted without being archived; on an up-to-date database this block is a no-op.
+DO $$
+DECLARE
+  archived INTEGER;
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_indexes
+                 WHERE schemaname = 'public' AND indexname = 'model_metrics_model_name_key') THEN
+    WITH moved AS (
+      DELETE FROM public.model_metrics a
+        USING public.model_metrics b
+        WHERE a.model_name = b.model_name
+          AND (COALESCE(a.created_at, '-infinity'), a.id) < (COALESCE(b.created_at, '-infinity'), b.id)
+        RETURNING a.*
+    )
+    INSERT INTO public.model_metrics_history
+      SELECT moved.*, now() FROM moved;
+    GET DIAGNOSTICS archived = ROW_COUNT;
+    RAISE NOTICE 'model_metrics: % superseded rows moved to model_metrics_history', archived;
+    CREATE UNIQUE INDEX model_metrics_model_name_key ON public.model_metrics (model_name);
+  END IF;
+END $$;
+
 -- Enable Row Level Security
 ALTER TABLE public.cameras ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.events ENABLE ROW LEVEL SECURITY;
@@ -121,6 +155,7 @@ ALTER TABLE public.user_settings ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.profiles ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.emergency_contacts ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.model_metrics ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.model_metrics_history ENABLE ROW LEVEL SECURITY;
 
 -- RLS Policies for cameras
 CREATE POLICY IF NOT EXISTS "Users can view their own cameras" ON public.cameras